@@ -1,5 +1,5 @@
 import logging
-from flask import Flask, request, jsonify, send_file, render_template, session, redirect, url_for, flash
+from flask import Flask, request, jsonify, send_file, render_template, session, redirect, url_for, flash, Response, g, has_request_context
 from datetime import datetime, timedelta, timezone
 import threading
 import time
@@ -14,14 +14,30 @@ import urllib.parse
 import requests
 import pkg_resources
 import json
+import hashlib
+import queue
+import struct
+import heapq
+import glob
+import lzma
+import math
+import random
+import mimetypes
+import atexit
+from collections import deque
 from functools import wraps
-from werkzeug.utils import secure_filename
+from contextlib import contextmanager
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
 import mysql.connector
 from mysql.connector import Error
 from mysql.connector.pooling import MySQLConnectionPool
 import pytz
 import msal
+from PIL import Image, ImageOps
+
+# Load environment variables from .env file (before any os.getenv below)
+load_dotenv()
 
 # Microsoft Auth config
 CLIENT_ID = "7aac3bf0-10c1-4f11-8152-cca5c43f4100"
@@ -41,61 +57,271 @@ MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))
 
-# Connection pool (recommended)
+# Connection pool (recommended). mysql-connector caps pool_size at 32.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "5"))  # max wait for a free connection
+DB_POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", "50"))          # callers beyond this fail fast
+DB_POOL_FALLBACK = os.getenv("DB_POOL_FALLBACK", "none").lower()            # "none" or "direct" (open an unpooled connection)
+DB_POOL_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
 db_pool = None
 
 SERVER_URL = "http://127.0.0.1:5000/"
 
-# Load environment variables from .env file
-load_dotenv()
+
+def _connect_direct():
+    return mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DATABASE,
+        port=MYSQL_PORT,
+        autocommit=True,
+        charset='utf8mb4',
+        init_command='SET SESSION time_zone = "+00:00"'
+    )
+
+
+class PooledConnection:
+    """Proxy for a pooled connection that hands its slot back to DatabasePool on close()."""
+
+    def __init__(self, conn, pool, checked_out_at):
+        self._conn = conn
+        self._pool = pool
+        self._checked_out_at = checked_out_at
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._conn.close()
+        finally:
+            self._pool._release(time.monotonic() - self._checked_out_at)
+
+
+class DatabasePool:
+    """
+    Wraps MySQLConnectionPool with a bounded wait: mysql-connector raises as soon as the pool is
+    empty, so a semaphore sized to the pool makes callers queue for up to timeout seconds instead.
+    At most max_waiters callers queue at once; the rest (and anyone who times out) get None, or a
+    direct connection when fallback == "direct".
+    """
+
+    def __init__(self, pool_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT_SECONDS,
+                 max_waiters=DB_POOL_MAX_WAITERS, fallback=DB_POOL_FALLBACK):
+        self.pool_size = max(1, min(pool_size, mysql.connector.pooling.CNX_POOL_MAXSIZE))
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.fallback = fallback
+        self._pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="hr_pool",
+            pool_size=self.pool_size,
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            database=MYSQL_DATABASE,
+            port=MYSQL_PORT,
+            autocommit=True,
+            charset='utf8mb4',
+            init_command='SET SESSION time_zone = "+00:00"'
+        )
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "errors": 0,
+            "fallbacks": 0,
+            "max_in_use": 0,
+            "max_waiting": 0,
+            "wait_ms_total": 0.0,
+            "hold_ms_total": 0.0
+        }
+        self._wait_histogram = [0] * (len(DB_POOL_WAIT_BUCKETS_MS) + 1)
+
+    def get_connection(self):
+        started = time.monotonic()
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                self._stats["rejected"] += 1
+                logging.error(f"DB pool wait queue full ({self._waiting} waiting)")
+                return self._fallback()
+            self._waiting += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._waiting)
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            logging.error(f"Timed out after {self.timeout}s waiting for a pooled DB connection")
+            return self._fallback()
+
+        try:
+            conn = self._pool.get_connection()
+        except Error as e:
+            self._slots.release()
+            with self._lock:
+                self._stats["errors"] += 1
+            logging.error(f"Failed to get connection from pool: {e}")
+            return self._fallback()
+
+        now = time.monotonic()
+        self._record_checkout((now - started) * 1000)
+        return PooledConnection(conn, self, now)
+
+    def _record_checkout(self, wait_ms):
+        bucket = next((i for i, limit in enumerate(DB_POOL_WAIT_BUCKETS_MS) if wait_ms <= limit),
+                      len(DB_POOL_WAIT_BUCKETS_MS))
+        with self._lock:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["max_in_use"] = max(self._stats["max_in_use"], self._in_use)
+            self._wait_histogram[bucket] += 1
+
+    def _release(self, held_seconds):
+        with self._lock:
+            self._in_use -= 1
+            self._stats["hold_ms_total"] += held_seconds * 1000
+        self._slots.release()
+
+    def _fallback(self):
+        if self.fallback != "direct":
+            return None
+        try:
+            conn = _connect_direct()
+        except Error as e:
+            logging.error(f"Direct connection also failed: {e}")
+            return None
+        with self._lock:
+            self._stats["fallbacks"] += 1
+        return conn
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_use"] = self._in_use
+            stats["waiting"] = self._waiting
+            histogram = list(self._wait_histogram)
+        checkouts = stats["checkouts"]
+        stats["avg_wait_ms"] = round(stats.pop("wait_ms_total") / checkouts, 2) if checkouts else 0
+        stats["avg_hold_ms"] = round(stats.pop("hold_ms_total") / checkouts, 2) if checkouts else 0
+        labels = [f"<={limit}ms" for limit in DB_POOL_WAIT_BUCKETS_MS] + [f">{DB_POOL_WAIT_BUCKETS_MS[-1]}ms"]
+        stats["wait_histogram"] = dict(zip(labels, histogram))
+        stats["config"] = {
+            "pool_size": self.pool_size,
+            "timeout_seconds": self.timeout,
+            "max_waiters": self.max_waiters,
+            "fallback": self.fallback
+        }
+        return stats
+
 
 def get_db_connection():
     global db_pool
     if db_pool is None:
         try:
-            db_pool = mysql.connector.pooling.MySQLConnectionPool(
-                pool_name="hr_pool",
-                pool_size=10,
-                host=MYSQL_HOST,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE,
-                port=MYSQL_PORT,
-                autocommit=True,
-                charset='utf8mb4',
-                init_command='SET SESSION time_zone = "+00:00"'
-            )
-            logging.info("MySQL connection pool created successfully")
+            db_pool = DatabasePool()
+            logging.info(f"MySQL connection pool created successfully (size={db_pool.pool_size})")
         except Error as e:
             logging.critical(f"Failed to create MySQL pool: {e}")
             # DO NOT exit() — just return None and let execute_query handle it
             return None
     
-    try:
-        return db_pool.get_connection()
-    except Error as e:
-        logging.error(f"Failed to get connection from pool: {e}")
-        # Try direct connection as fallback
-        try:
-            return mysql.connector.connect(
-                host=MYSQL_HOST,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE,
-                port=MYSQL_PORT,
-                autocommit=True,
-                charset='utf8mb4',
-                init_command='SET SESSION time_zone = "+00:00"'
-            )
-        except Error as e2:
-            logging.error(f"Direct connection also failed: {e2}")
-            return None
+    return db_pool.get_connection()
             
+# Inside a request, every execute_query shares one pooled connection kept on flask.g and
+# returned to the pool at teardown. Background threads (heartbeat flush, sweeper, timers)
+# have no request context and keep checking out a connection per call.
+def get_request_connection():
+    if not has_request_context():
+        return None
+    conn = g.get('db_conn')
+    if conn is None:
+        conn = get_db_connection()
+        if conn is None:
+            logging.error("No database connection available")
+            raise mysql.connector.Error("Database unavailable")
+        g.db_conn = conn
+    return conn
+
+
+def release_request_connection():
+    """Hand the request's connection back to the pool early (e.g. before a long stream or external call)."""
+    if not has_request_context():
+        return
+    conn = g.pop('db_conn', None)
+    if conn is None:
+        return
+    try:
+        if g.pop('db_transaction_depth', 0):
+            logging.warning("Request ended inside an open transaction - rolling back")
+            conn.rollback()
+    except Exception as e:
+        logging.error(f"Rollback on release failed: {e}")
+    finally:
+        conn.close()
+
+
+@app.teardown_appcontext
+def teardown_request_connection(exception=None):
+    release_request_connection()
+
+
+def _in_transaction():
+    return has_request_context() and g.get('db_transaction_depth', 0) > 0
+
+
+@contextmanager
+def db_transaction():
+    """
+    Run several execute_query calls as one transaction on the request's connection:
+
+        with db_transaction():
+            execute_query(...)
+            execute_query(...)
+
+    Commits when the block exits, rolls back if it raises. Nested blocks join the outer one.
+    """
+    conn = get_request_connection()
+    if conn is None:
+        raise RuntimeError("db_transaction() needs a request context")
+    depth = g.get('db_transaction_depth', 0)
+    if depth == 0:
+        conn.start_transaction()
+    g.db_transaction_depth = depth + 1
+    try:
+        yield conn
+    except Exception:
+        g.db_transaction_depth = depth
+        if depth == 0:
+            conn.rollback()
+        raise
+    else:
+        g.db_transaction_depth = depth
+        if depth == 0:
+            conn.commit()
+
+
 def execute_query(query, params=None, fetch=False, commit=False):
-    conn = get_db_connection()
+    request_conn = get_request_connection()
+    conn = request_conn or get_db_connection()
     if conn is None:
         logging.error("No database connection available")
         raise mysql.connector.Error("Database unavailable")
+    in_transaction = _in_transaction()
+    release = request_conn is None
     
     cursor = conn.cursor(dictionary=True)
     try:
@@ -103,17 +329,21 @@ def execute_query(query, params=None, fetch=False, commit=False):
         result = None
         if fetch:
             result = cursor.fetchall()
-        if commit:
+        if commit and not in_transaction:
             conn.commit()
-        return {"data": result or []}
+        return {"data": result or [], "rowcount": cursor.rowcount}
     except Exception as e:
-        if conn:
+        if conn and not in_transaction:
             conn.rollback()
         logging.error(f"Query failed: {query} | Error: {e}")
+        if not release and not in_transaction and not conn.is_connected():
+            # Don't keep a dead connection around for the rest of the request
+            g.pop('db_conn', None)
+            release = True
         raise e
     finally:
         cursor.close()
-        if conn:
+        if conn and release:
             conn.close()
 
 def format_datetime_for_client(dt):
@@ -144,11 +374,20 @@ CORTEX_API_KEY = os.getenv("CORTEX_API_KEY")
 UPLOAD_DIR = "hr_notification\\uploads"
 VIDEO_DIR = os.path.join(UPLOAD_DIR, "message", "videos")
 IMAGE_DIR = os.path.join(UPLOAD_DIR, "message", "images")
+INCOMING_DIR = "hr_notification\\incoming"   # partial chunked uploads; outside UPLOAD_DIR so /uploads never serves them
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
 
+# Media serving: message media is UUID- or content-hash-named and never rewritten, so it is cached for a year;
+# everything else under /uploads revalidates with its ETag. Set MEDIA_SENDFILE_MODE to let a
+# fronting proxy stream the bytes (nginx: an internal location aliasing UPLOAD_DIR at MEDIA_ACCEL_PREFIX).
+MEDIA_SENDFILE_MODE = os.getenv("MEDIA_SENDFILE_MODE", "none").lower()      # "none", "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd)
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-uploads/")
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_UPLOAD_RE = re.compile(r'^message/(videos|images)/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{64})(_[a-z]+)?\.[a-z0-9]+$', re.IGNORECASE)
+
 
 # Ensure upload directories exist
-for directory in [UPLOAD_DIR, VIDEO_DIR, IMAGE_DIR]:
+for directory in [UPLOAD_DIR, VIDEO_DIR, IMAGE_DIR, INCOMING_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
         logging.info(f"Created directory: {directory}")
@@ -191,28 +430,1294 @@ def verify_file(directory, filename):
     
 # Create storage bucket and set RLS policies if it doesn't exist
 
+# Content-addressed media: uploads are stored as <sha256>.<ext>, so re-sending the same file reuses
+# the stored object (and every client's cached copy). media_objects counts the scheduled_content
+# rows referencing each object; releasing the last reference deletes the file and its derivatives.
+MEDIA_CHUNK_SIZE = 1024 * 1024
+MEDIA_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+MEDIA_DIRS = {'video': (VIDEO_DIR, 'videos'), 'image': (IMAGE_DIR, 'images')}
+
+
+def media_url(kind, filename):
+    return f"{SERVER_URL}/uploads/message/{MEDIA_DIRS[kind][1]}/{filename}"
+
+
+MEDIA_MIME_TYPES = {'mp4': 'video/mp4', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+
+
+def _mp4_boxes(f, start, end):
+    """Yield (type, payload_start, box_end) for the ISO-BMFF boxes between start and end."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def probe_mp4(path):
+    """
+    Duration and display resolution from the moov box (mvhd timescale/duration, the video track's
+    tkhd width/height, swapped for 90/270 degree rotation matrices). Reads only box headers.
+    """
+    info = {"duration_ms": None, "width": None, "height": None}
+    with open(path, 'rb') as f:
+        file_end = os.fstat(f.fileno()).st_size
+        moov = next(((s, e) for t, s, e in _mp4_boxes(f, 0, file_end) if t == b'moov'), None)
+        if not moov:
+            return info
+        for box_type, start, end in list(_mp4_boxes(f, *moov)):
+            if box_type == b'mvhd':
+                f.seek(start)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(start + 20)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.seek(start + 12)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                if timescale:
+                    info["duration_ms"] = int(duration * 1000 / timescale)
+            elif box_type == b'trak' and info["width"] is None:
+                children = {t: (s, e) for t, s, e in _mp4_boxes(f, start, end)}
+                mdia = children.get(b'mdia')
+                tkhd = children.get(b'tkhd')
+                if not mdia or not tkhd:
+                    continue
+                hdlr = next(((s, e) for t, s, e in _mp4_boxes(f, *mdia) if t == b'hdlr'), None)
+                if not hdlr:
+                    continue
+                f.seek(hdlr[0] + 8)
+                if f.read(4) != b'vide':
+                    continue
+                f.seek(tkhd[0])
+                matrix_at = tkhd[0] + (52 if f.read(1)[0] == 1 else 40)
+                f.seek(matrix_at)
+                a, b = struct.unpack('>ii', f.read(8))
+                f.seek(matrix_at + 36)
+                width, height = (v >> 16 for v in struct.unpack('>II', f.read(8)))
+                if a == 0 and abs(b) == 0x10000:
+                    width, height = height, width
+                info["width"], info["height"] = width, height
+    return info
+
+
+def probe_media(path, kind, ext):
+    """MIME type plus image dimensions or MP4 duration/resolution; best effort, never raises."""
+    meta = {"mime_type": MEDIA_MIME_TYPES.get(ext, 'application/octet-stream'), "width": None, "height": None, "duration_ms": None}
+    try:
+        if kind == 'video':
+            meta.update(probe_mp4(path))
+        else:
+            with Image.open(path) as image:
+                width, height = image.size
+                # EXIF orientations 5-8 are displayed rotated by 90 degrees
+                if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                    width, height = height, width
+                meta.update(width=width, height=height, mime_type=Image.MIME.get(image.format, meta["mime_type"]))
+    except Exception as e:
+        logging.warning(f"Could not read {kind} metadata from {path}: {e}")
+    return meta
+
+
+def media_metadata(urls):
+    """{url: {"mime_type", "bytes", "sha256", "width", "height", "duration_ms"}} for content-addressed URLs."""
+    stems = {url: os.path.splitext(url.rsplit('/', 1)[-1])[0] for url in urls if url}
+    stems = {url: stem for url, stem in stems.items() if MEDIA_HASH_RE.match(stem)}
+    if not stems:
+        return {}
+    hashes = list(set(stems.values()))
+    rows = execute_query(f"""
+        SELECT sha256, mime_type, size_bytes, width, height, duration_ms
+        FROM media_objects WHERE sha256 IN ({','.join(['%s'] * len(hashes))})
+    """, tuple(hashes), fetch=True).get("data") or []
+    by_hash = {
+        row['sha256']: {
+            "mime_type": row['mime_type'],
+            "bytes": row['size_bytes'],
+            "sha256": row['sha256'],
+            "width": row['width'],
+            "height": row['height'],
+            "duration_ms": row['duration_ms']
+        }
+        for row in rows
+    }
+    return {url: by_hash[stem] for url, stem in stems.items() if stem in by_hash}
+
+
+def publish_media_file(tmp_path, kind, ext, sha256, size):
+    """
+    Publish an already-hashed temp file as <sha256>.<ext> (dropping it if that object is already
+    stored) and take one reference on the object. Returns its sha256, filename, path and url.
+    """
+    directory = MEDIA_DIRS[kind][0]
+    meta = probe_media(tmp_path, kind, ext)
+    # The upsert locks the object's row until commit, so a concurrent release_media cannot
+    # delete the file between our existence check and the new reference becoming visible
+    with db_transaction():
+        execute_query("""
+            INSERT INTO media_objects
+                (sha256, kind, ext, size_bytes, mime_type, width, height, duration_ms, ref_count, last_acquired_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, NOW())
+            ON DUPLICATE KEY UPDATE
+                ref_count = ref_count + 1,
+                last_acquired_at = NOW(),
+                mime_type = COALESCE(mime_type, VALUES(mime_type)),
+                width = COALESCE(width, VALUES(width)),
+                height = COALESCE(height, VALUES(height)),
+                duration_ms = COALESCE(duration_ms, VALUES(duration_ms))
+        """, (sha256, kind, ext, size, meta['mime_type'], meta['width'], meta['height'], meta['duration_ms']), commit=True)
+        ext = execute_query("SELECT ext FROM media_objects WHERE sha256 = %s", (sha256,), fetch=True)["data"][0]['ext']
+        filename = f"{sha256}.{ext}"
+        path = os.path.join(directory, filename)
+        deduplicated = os.path.exists(path)
+        if not deduplicated:
+            os.replace(tmp_path, path)
+    if not verify_file(directory, filename):
+        raise Exception(f"Media verification failed for {filename}")
+
+    logging.info(f"{kind.capitalize()} stored as {filename} ({size} bytes, {'deduplicated' if deduplicated else 'new object'})")
+    return {"sha256": sha256, "filename": filename, "path": path, "url": media_url(kind, filename), "deduplicated": deduplicated}
+
+
+def store_media_upload(file_storage, kind, ext):
+    """Stream a multipart upload to a temp file while hashing it, then publish it (see publish_media_file)."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=MEDIA_DIRS[kind][0], suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file_storage.stream.read(MEDIA_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if not size:
+            raise ValueError("Uploaded file is empty")
+        return publish_media_file(tmp_path, kind, ext, digest.hexdigest(), size)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def release_media(urls):
+    """
+    Drop one reference per URL (legacy uuid-named files are left alone). Objects reaching zero are
+    deleted together with their files; call inside the transaction that deletes the content rows.
+    """
+    for url in urls:
+        if not url:
+            continue
+        stem = os.path.splitext(url.rsplit('/', 1)[-1])[0]
+        if not MEDIA_HASH_RE.match(stem):
+            continue
+        rows = execute_query(
+            "SELECT kind, ext, ref_count FROM media_objects WHERE sha256 = %s FOR UPDATE", (stem,), fetch=True
+        ).get("data") or []
+        if not rows:
+            continue
+        if rows[0]['ref_count'] > 1:
+            execute_query("UPDATE media_objects SET ref_count = ref_count - 1 WHERE sha256 = %s", (stem,), commit=True)
+            continue
+        execute_query("DELETE FROM media_objects WHERE sha256 = %s", (stem,), commit=True)
+        # Unlinked while the row lock is held: a concurrent upload of the same bytes waits on it,
+        # then finds neither row nor file and publishes its own copy
+        directory = MEDIA_DIRS[rows[0]['kind']][0]
+        for path in [os.path.join(directory, f"{stem}.{rows[0]['ext']}")] + glob.glob(os.path.join(directory, f"{stem}_*")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logging.info(f"Garbage-collected media object {stem}")
+
+# Max rows per multi-row INSERT / IN (...) list when writing recipients
+RECIPIENT_BATCH_SIZE = 1000
+
+
+def batched(items, size):
+    """Yield successive lists of at most `size` items."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_content_recipients(content_id, employees, scheduled_time, display_at=None):
+    """
+    Write one content_recipients row per employee so /content can use an index instead of JSON_CONTAINS.
+    display_at defaults to scheduled_time; rollout waves pass their own release time.
+    """
+    scheduled_time_str = scheduled_time.strftime('%Y-%m-%d %H:%M:%S')
+    display_at_str = (display_at or scheduled_time).strftime('%Y-%m-%d %H:%M:%S')
+    for batch in batched(dict.fromkeys(employees), RECIPIENT_BATCH_SIZE):
+        placeholders = ','.join(['(%s, %s, %s, %s)'] * len(batch))
+        params = []
+        for employee_id in batch:
+            params.extend((content_id, employee_id, scheduled_time_str, display_at_str))
+        execute_query(
+            f"INSERT IGNORE INTO content_recipients (content_id, employee_id, scheduled_time, display_at) VALUES {placeholders}",
+            tuple(params),
+            commit=True
+        )
+
+
+# Delivery planner: content_recipients.display_at is each recipient's effective display time -
+# scheduled_time until the employee picks a delay, then the message_preferences display_time.
+# The (employee_id, display_at) index is the per-employee due-queue /content reads from.
+def plan_delivery(employee_id, content_id, display_time):
+    """Move one recipient's display_at and wake their client when it comes due."""
+    display_time = display_time.astimezone(timezone.utc)
+    execute_query("""
+        UPDATE content_recipients
+        SET display_at = GREATEST(scheduled_time, %s)
+        WHERE content_id = %s AND employee_id = %s
+    """, (display_time.strftime('%Y-%m-%d %H:%M:%S'), content_id, employee_id), commit=True)
+    if display_time > datetime.now(timezone.utc):
+        notification_scheduler.call_at(display_time, publish_due_event, employee_id, content_id, display_time)
+
+
+def publish_due_event(employee_id, content_id, display_time):
+    event_broker.publish('content', {"content_id": content_id, "display_time": format_datetime_for_client(display_time)}, [employee_id])
+
+
+# Rollout waves: a large send can be released to its recipients in waves instead of all at once.
+# Each wave is just a display_at value on its recipients' content_recipients rows, so /content
+# already honors it; notifications and SSE content events are scheduled per wave as well.
+ROLLOUT_MODES = ('fixed', 'percent')
+ROLLOUT_MAX_WAVES = int(os.getenv("ROLLOUT_MAX_WAVES", "100"))
+ROLLOUT_MAX_INTERVAL_MINUTES = 24 * 60
+
+
+def parse_rollout(form):
+    """
+    Optional rollout fields of the send_message form -> None (everyone at once) or a dict with mode,
+    interval (timedelta) and wave_size (fixed: N recipients per wave) or percents (percent: cumulative
+    ramp such as "5,25,50,100"). Raises ValueError with a user-facing message for bad input.
+    """
+    mode = (form.get('rollout_mode') or 'none').strip().lower()
+    if mode in ('', 'none'):
+        return None
+    if mode not in ROLLOUT_MODES:
+        raise ValueError(f"Invalid rollout mode: {mode}")
+    try:
+        interval_minutes = int(form.get('wave_interval_minutes') or 0)
+    except ValueError:
+        raise ValueError("Wave interval must be a whole number of minutes")
+    if not 1 <= interval_minutes <= ROLLOUT_MAX_INTERVAL_MINUTES:
+        raise ValueError(f"Wave interval must be between 1 and {ROLLOUT_MAX_INTERVAL_MINUTES} minutes")
+
+    rollout = {"mode": mode, "interval": timedelta(minutes=interval_minutes)}
+    if mode == 'fixed':
+        try:
+            rollout["wave_size"] = int(form.get('wave_size') or 0)
+        except ValueError:
+            raise ValueError("Wave size must be a whole number")
+        if rollout["wave_size"] < 1:
+            raise ValueError("Wave size must be at least 1")
+    else:
+        try:
+            percents = [float(p) for p in (form.get('wave_percents') or '').split(',') if p.strip()]
+        except ValueError:
+            raise ValueError("Wave percentages must be a comma-separated list of numbers")
+        if not percents or any(not 0 < p <= 100 for p in percents) or percents != sorted(percents):
+            raise ValueError("Wave percentages must be increasing values between 0 and 100")
+        if percents[-1] < 100:
+            percents.append(100.0)
+        if len(percents) > ROLLOUT_MAX_WAVES:
+            raise ValueError(f"A rollout can have at most {ROLLOUT_MAX_WAVES} waves")
+        rollout["percents"] = percents
+    return rollout
+
+
+def plan_rollout_waves(content_id, employees, start, rollout):
+    """
+    Split recipients into [(release_time, [employee_id, ...]), ...]. Recipients are ordered by a hash
+    of (content_id, employee_id) so each send samples the audience evenly rather than by list order.
+    """
+    employees = sorted(dict.fromkeys(employees),
+                       key=lambda e: hashlib.sha1(f"{content_id}:{e}".encode()).hexdigest())
+    total = len(employees)
+    if rollout["mode"] == 'fixed':
+        wave_size = max(rollout["wave_size"], -(-total // ROLLOUT_MAX_WAVES))
+        bounds = list(range(wave_size, total, wave_size)) + [total]
+    else:
+        bounds = [min(total, math.ceil(total * p / 100)) for p in rollout["percents"]]
+
+    waves, released = [], 0
+    for index, bound in enumerate(bounds):
+        if bound > released:
+            waves.append((start + rollout["interval"] * index, employees[released:bound]))
+            released = bound
+    return waves
+
+
+def rollout_progress(content_id):
+    """Released/pending recipient counts and the next wave time for one content."""
+    row = (execute_query("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(display_at <= NOW()), 0) AS released,
+               MIN(CASE WHEN display_at > NOW() THEN display_at END) AS next_release
+        FROM content_recipients
+        WHERE content_id = %s
+    """, (content_id,), fetch=True).get("data") or [{}])[0]
+    total = int(row.get('total') or 0)
+    released = int(row.get('released') or 0)
+    return {
+        "content_id": content_id,
+        "total": total,
+        "released": released,
+        "pending": total - released,
+        "next_release": format_datetime_for_client(row.get('next_release')),
+    }
+
+
+
+# content_stats keeps one row of engagement counters per content so the dashboard never has to
+# scan reactions/feedback/views. Writers bump it incrementally; rebuild_content_stats.py recomputes it.
+CONTENT_STATS_COUNTERS = ('like_count', 'unlike_count', 'heart_count', 'cry_count', 'feedback_count', 'view_count')
+CONTENT_STATS_SELECT = ', '.join(f"COALESCE(cs.{c}, 0) AS {c}" for c in CONTENT_STATS_COUNTERS)
+
+
+def bump_content_stats(content_id, **deltas):
+    """Add signed deltas to content_stats counters, e.g. bump_content_stats(cid, like_count=1, cry_count=-1)."""
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    unknown = set(deltas) - set(CONTENT_STATS_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown content_stats counters: {', '.join(sorted(unknown))}")
+    columns = list(deltas)
+    execute_query(f"""
+        INSERT INTO content_stats (content_id, {', '.join(columns)})
+        VALUES (%s, {', '.join(['GREATEST(%s, 0)'] * len(columns))})
+        ON DUPLICATE KEY UPDATE {', '.join(f'{c} = GREATEST({c} + %s, 0)' for c in columns)}
+    """, (content_id, *deltas.values(), *deltas.values()), commit=True)
+
+NOTIFICATION_LEAD = timedelta(minutes=5)
+
+
 # Schedule a notification 5 minutes before content delivery
 def schedule_notification(content_id, scheduled_time, employees):
+    """Persist the notification job; recipients are read from content_recipients when it fires."""
     try:
-        notify_time = scheduled_time - timedelta(minutes=5)
-        time_to_wait = (notify_time - datetime.now(timezone.utc)).total_seconds()
-        if time_to_wait > 0:
-            threading.Timer(time_to_wait, send_notification, args=(content_id, employees)).start()
+        notify_time = scheduled_time - NOTIFICATION_LEAD
+        if notify_time > datetime.now(timezone.utc):
+            notification_scheduler.schedule(content_id, notify_time)
     except Exception as e:
         logging.error(f"Error scheduling notification for content_id {content_id}: {str(e)}")
 
 
 def send_notification(content_id, employees):
     try:
+        notified_at = datetime.now(timezone.utc)
         execute_query(
             "INSERT INTO notifications (content_id, employees, time) VALUES (%s, %s, %s)",
-            (content_id, json.dumps(employees), datetime.now(timezone.utc)),
+            (content_id, json.dumps(employees), notified_at),
             commit=True
         )
 
+        # Stamp the recipient rows so /content can find notifications by index
+        for batch in batched(employees, RECIPIENT_BATCH_SIZE):
+            placeholders = ','.join(['%s'] * len(batch))
+            execute_query(
+                f"UPDATE content_recipients SET notified_at = %s WHERE content_id = %s AND employee_id IN ({placeholders})",
+                (notified_at.strftime('%Y-%m-%d %H:%M:%S'), content_id, *batch),
+                commit=True
+            )
+
         logging.info(f"Notification sent for content_id: {content_id}")
+        event_broker.publish('notification', {"content_id": content_id, "time": format_datetime_for_client(notified_at)}, employees)
+        return True
     except Exception as e:
         logging.error(f"Error sending notification: {str(e)}")
+        return False
+
+
+# Tell connected clients when scheduled content becomes visible in /content
+def schedule_content_event(content_id, scheduled_time, employees):
+    try:
+        if scheduled_time > datetime.now(timezone.utc):
+            # SSE subscribers live in this process, so this one stays in memory (no DB job)
+            notification_scheduler.call_at(scheduled_time, publish_content_event, content_id, scheduled_time, employees)
+        else:
+            publish_content_event(content_id, scheduled_time, employees)
+    except Exception as e:
+        logging.error(f"Error scheduling content event for content_id {content_id}: {str(e)}")
+
+
+def publish_content_event(content_id, scheduled_time, employees):
+    event_broker.publish('content', {"content_id": content_id, "scheduled_time": format_datetime_for_client(scheduled_time)}, employees)
+
+
+
+# ---------------------------------------------------------------------------
+# Notification scheduler: DB-backed jobs fired by a single loop per process
+# ---------------------------------------------------------------------------
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))            # pick up jobs other workers/nodes inserted
+SCHEDULER_CLAIM_TIMEOUT_SECONDS = int(os.getenv("SCHEDULER_CLAIM_TIMEOUT_SECONDS", "300"))  # reclaim jobs from a worker that died mid-send
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "900"))  # older overdue jobs are marked missed, not sent
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "3"))
+
+
+def fire_notification_job(content_id):
+    # Only recipients not yet notified whose content is about to show, so each rollout wave's job
+    # notifies just its wave (a plain send has a single wave: everyone)
+    horizon = datetime.now(timezone.utc) + NOTIFICATION_LEAD + timedelta(seconds=30)
+    employees = [row['employee_id'] for row in execute_query("""
+        SELECT employee_id FROM content_recipients
+        WHERE content_id = %s AND notified_at IS NULL AND display_at <= %s
+    """, (content_id, horizon.strftime('%Y-%m-%d %H:%M:%S')), fetch=True).get("data", []) or []]
+    if not employees:
+        return True
+    return send_notification(content_id, employees)
+
+
+class NotificationScheduler:
+    """
+    Pending notification_jobs rows sit in a min-heap of due times; one thread sleeps on a condition
+    until the earliest is due (schedule() wakes it early). A due job is claimed with a conditional
+    UPDATE (status pending -> claimed, tagged with a per-claim token), so when several workers or
+    nodes load the same row only the one whose UPDATE matched sends it. Jobs are re-read from MySQL
+    on start and every poll interval, which is also how stale claims are returned to pending.
+    call_at() queues in-memory callbacks on the same heap for things that must run in this process.
+    """
+
+    def __init__(self, handler=fire_notification_job, poll_interval=SCHEDULER_POLL_SECONDS):
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._cond = threading.Condition()
+        self._heap = []            # (due epoch seconds, seq, job_id or None, content_id or callable, args)
+        self._queued = set()       # job ids currently in the heap
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_poll = 0.0
+        self._stats = {"scheduled": 0, "fired": 0, "failed": 0, "missed": 0,
+                       "lost_claims": 0, "callbacks": 0, "max_lateness_ms": 0.0}
+
+    @staticmethod
+    def _epoch(dt):
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
+    def _push(self, due, job_id, target, args=()):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, job_id, target, args))
+        if job_id is not None:
+            self._queued.add(job_id)
+
+    def schedule(self, content_id, due_at):
+        return self.schedule_many([(content_id, due_at)])[0]
+
+    def schedule_many(self, jobs):
+        """Insert (content_id, due_at) jobs and queue them; returns the new job ids."""
+        rows = []
+        for content_id, due_at in jobs:
+            due_at = due_at.replace(tzinfo=timezone.utc) if due_at.tzinfo is None else due_at.astimezone(timezone.utc)
+            rows.append((str(uuid.uuid4()), content_id, due_at.strftime('%Y-%m-%d %H:%M:%S'), due_at))
+        for batch in batched(rows, RECIPIENT_BATCH_SIZE):
+            placeholders = ','.join(["(%s, %s, 'notification', %s)"] * len(batch))
+            execute_query(
+                f"INSERT INTO notification_jobs (id, content_id, kind, due_at) VALUES {placeholders}",
+                tuple(value for row in batch for value in row[:3]),
+                commit=True
+            )
+        with self._cond:
+            for job_id, content_id, _, due_at in rows:
+                self._push(self._epoch(due_at), job_id, content_id)
+            self._stats["scheduled"] += len(rows)
+            self._cond.notify()
+        return [row[0] for row in rows]
+
+    def call_at(self, due_at, func, *args):
+        with self._cond:
+            self._push(self._epoch(due_at), None, func, args)
+            self._cond.notify()
+
+    def load_pending(self):
+        """Queue every pending job from MySQL and hand stale claims back to pending."""
+        execute_query("""
+            UPDATE notification_jobs
+            SET status = 'pending', claimed_by = NULL
+            WHERE status = 'claimed' AND claimed_at < UTC_TIMESTAMP() - INTERVAL %s SECOND
+        """, (SCHEDULER_CLAIM_TIMEOUT_SECONDS,), commit=True)
+        rows = execute_query(
+            "SELECT id, content_id, due_at FROM notification_jobs WHERE status = 'pending' ORDER BY due_at",
+            fetch=True
+        ).get("data", []) or []
+        added = 0
+        with self._cond:
+            for row in rows:
+                if row['id'] not in self._queued:
+                    self._push(self._epoch(row['due_at']), row['id'], row['content_id'])
+                    added += 1
+            if added:
+                self._cond.notify()
+        if added:
+            logging.info(f"Scheduler loaded {added} pending notification jobs")
+
+    def _claim(self, job_ids):
+        """Atomically move pending jobs to claimed; returns the ids this worker won."""
+        token = f"{self.node_id}:{uuid.uuid4().hex[:8]}"
+        placeholders = ','.join(['%s'] * len(job_ids))
+        execute_query(f"""
+            UPDATE notification_jobs
+            SET status = 'claimed', claimed_by = %s, claimed_at = UTC_TIMESTAMP(), attempts = attempts + 1
+            WHERE id IN ({placeholders}) AND status = 'pending'
+        """, (token, *job_ids), commit=True)
+        rows = execute_query(
+            f"SELECT id, attempts FROM notification_jobs WHERE id IN ({placeholders}) AND claimed_by = %s",
+            (*job_ids, token), fetch=True
+        ).get("data", []) or []
+        return {row['id']: row['attempts'] for row in rows}
+
+    def _finish(self, job_id, status, error=None):
+        execute_query("""
+            UPDATE notification_jobs
+            SET status = %s, fired_at = UTC_TIMESTAMP(), last_error = %s
+            WHERE id = %s
+        """, (status, error, job_id), commit=True)
+
+    def _run_due(self, due):
+        now = time.time()
+        jobs = []
+        for due_at, _, job_id, target, args in due:
+            if job_id is None:
+                try:
+                    target(*args)
+                    self._stats["callbacks"] += 1
+                except Exception as e:
+                    logging.error(f"Scheduled callback {getattr(target, '__name__', target)} failed: {e}")
+            else:
+                jobs.append((due_at, job_id, target))
+        if not jobs:
+            return
+
+        missed = [job_id for due_at, job_id, _ in jobs if now - due_at > SCHEDULER_MISFIRE_GRACE_SECONDS]
+        jobs = [job for job in jobs if job[1] not in missed]
+        if missed:
+            claimed = self._claim(missed)
+            for job_id in claimed:
+                self._finish(job_id, 'missed', 'Overdue past the misfire grace period')
+            self._stats["missed"] += len(claimed)
+            logging.warning(f"Scheduler skipped {len(claimed)} notification jobs overdue by more than {SCHEDULER_MISFIRE_GRACE_SECONDS}s")
+        if not jobs:
+            return
+
+        claimed = {}
+        for batch in batched(jobs, RECIPIENT_BATCH_SIZE):
+            claimed.update(self._claim([job_id for _, job_id, _ in batch]))
+        self._stats["lost_claims"] += len(jobs) - len(claimed)
+        for due_at, job_id, content_id in jobs:
+            if job_id not in claimed:
+                continue  # another worker got it
+            lateness_ms = (time.time() - due_at) * 1000
+            self._stats["max_lateness_ms"] = round(max(self._stats["max_lateness_ms"], lateness_ms), 2)
+            try:
+                ok = self.handler(content_id)
+                error = None if ok else "Handler reported failure"
+            except Exception as e:
+                ok, error = False, str(e)
+            if ok:
+                self._finish(job_id, 'done')
+                self._stats["fired"] += 1
+            elif claimed[job_id] < SCHEDULER_MAX_ATTEMPTS:
+                # Back to pending; the next poll re-queues it
+                execute_query(
+                    "UPDATE notification_jobs SET status = 'pending', claimed_by = NULL, last_error = %s WHERE id = %s",
+                    (error, job_id), commit=True
+                )
+            else:
+                self._finish(job_id, 'failed', error)
+                self._stats["failed"] += 1
+                logging.error(f"Notification job {job_id} for content_id {content_id} failed: {error}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if time.monotonic() >= self._next_poll:
+                try:
+                    self.load_pending()
+                except Exception as e:
+                    logging.error(f"Scheduler failed to load pending jobs: {e}")
+                self._next_poll = time.monotonic() + self.poll_interval
+
+            with self._cond:
+                now = time.time()
+                if not self._heap or self._heap[0][0] > now:
+                    wait = self._next_poll - time.monotonic()
+                    if self._heap:
+                        wait = min(wait, self._heap[0][0] - now)
+                    self._cond.wait(timeout=max(wait, 0))
+                    continue
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    entry = heapq.heappop(self._heap)
+                    if entry[2] is not None:
+                        self._queued.discard(entry[2])
+                    due.append(entry)
+            try:
+                self._run_due(due)
+            except Exception as e:
+                # Claimed-but-unfinished jobs are reclaimed after the claim timeout
+                logging.error(f"Scheduler failed to fire due jobs: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="notification-scheduler", daemon=True)
+        self._thread.start()
+        logging.info(f"Notification scheduler {self.node_id} started")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._heap)
+            stats["next_due_in_seconds"] = round(self._heap[0][0] - time.time(), 3) if self._heap else None
+        stats["node_id"] = self.node_id
+        return stats
+
+
+notification_scheduler = NotificationScheduler()
+atexit.register(notification_scheduler.stop)
+
+# ---------------------------------------------------------------------------
+# Server-Sent Events: in-process pub/sub for /events/<employee_id>
+# ---------------------------------------------------------------------------
+SSE_BUFFER_SIZE = int(os.getenv("SSE_BUFFER_SIZE", "1000"))            # events kept for Last-Event-ID replay
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))              # per-connection backlog before forcing a resync
+SSE_HEARTBEAT_SECONDS = int(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))  # comment line so proxies keep idle streams open
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "5000"))
+
+
+class EventSubscription:
+    def __init__(self, employee_id):
+        self.employee_id = employee_id
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBroker:
+    """
+    Single-process pub/sub for the SSE stream. Event ids are "<boot>:<seq>" so a client that
+    reconnects with a Last-Event-ID from another process lifetime (or one that fell out of the
+    replay buffer) is told to resync instead of silently missing events.
+    """
+
+    def __init__(self, buffer_size=SSE_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._boot = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._buffer = deque(maxlen=buffer_size)  # (seq, recipients, frame)
+        self._subscribers = defaultdict(set)      # employee_id -> {EventSubscription}
+
+    @staticmethod
+    def format_frame(event, data, event_id=None):
+        lines = []
+        if event_id:
+            lines.append(f"id: {event_id}")
+        lines.append(f"event: {event}")
+        lines.append(f"data: {json.dumps(data)}")
+        return "\n".join(lines) + "\n\n"
+
+    def publish(self, event, data, employee_ids):
+        recipients = frozenset(employee_ids)
+        with self._lock:
+            self._seq += 1
+            event_id = f"{self._boot}:{self._seq}"
+            frame = self.format_frame(event, data, event_id)
+            self._buffer.append((self._seq, recipients, frame))
+            targets = [sub for emp in recipients for sub in self._subscribers.get(emp, ())]
+        for sub in targets:
+            try:
+                sub.queue.put_nowait(frame)
+            except queue.Full:
+                sub.overflowed = True
+        logging.debug(f"SSE {event} {event_id} -> {len(targets)} connected of {len(recipients)} recipients")
+        return event_id
+
+    def subscribe(self, employee_id, last_event_id=None):
+        """Register a stream. Returns (subscription, replay_frames, needs_resync)."""
+        sub = EventSubscription(employee_id)
+        replay, needs_resync = [], False
+        with self._lock:
+            self._subscribers[employee_id].add(sub)
+            if last_event_id:
+                boot, _, seq = last_event_id.partition(':')
+                try:
+                    seq = int(seq)
+                except ValueError:
+                    seq = None
+                oldest = self._buffer[0][0] if self._buffer else self._seq + 1
+                if boot != self._boot or seq is None or seq < oldest - 1:
+                    needs_resync = True
+                else:
+                    replay = [frame for s, recipients, frame in self._buffer if s > seq and employee_id in recipients]
+        return sub, replay, needs_resync
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.employee_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.employee_id]
+
+    def connected_employee_ids(self):
+        with self._lock:
+            return set(self._subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connected_employees": len(self._subscribers),
+                "streams": sum(len(s) for s in self._subscribers.values()),
+                "buffered_events": len(self._buffer),
+                "last_event_id": f"{self._boot}:{self._seq}"
+            }
+
+
+event_broker = EventBroker()
+
+
+# ---------------------------------------------------------------------------
+# Heartbeat buffer: coalesces /update_status writes and flushes them in batches
+# ---------------------------------------------------------------------------
+HEARTBEAT_FLUSH_SECONDS = float(os.getenv("HEARTBEAT_FLUSH_SECONDS", "5"))  # 0 writes every heartbeat through
+HEARTBEAT_BATCH_SIZE = int(os.getenv("HEARTBEAT_BATCH_SIZE", "500"))
+
+
+class HeartbeatBuffer:
+    """
+    Keeps the latest employee_devices state per employee and the latest device_update_status per
+    (employee_id, device_id). A background thread flushes both as multi-row upserts; update status
+    rows are only written when version/status/error actually changed since the last write.
+    """
+
+    def __init__(self, flush_interval=HEARTBEAT_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._devices = {}          # employee_id -> employee_devices row
+        self._update_status = {}    # (employee_id, device_id) -> (version, status, error_message)
+        self._written_status = {}   # what device_update_status holds for each key, as far as we know
+        self._written_generation = 0  # bumped by forget_written_status so in-flight flushes don't re-cache
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            "flushes": 0,
+            "device_rows_written": 0,
+            "update_rows_written": 0,
+            "update_rows_skipped": 0,
+            "failed_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "last_flush_at": None
+        }
+
+    def add(self, device_row, update_key=None, update_state=None):
+        with self._lock:
+            self._devices[device_row['employee_id']] = device_row
+            if update_key is not None:
+                if self._written_status.get(update_key) == update_state:
+                    # Drop any older state still queued for this device: the newest report wins
+                    self._update_status.pop(update_key, None)
+                    self._stats["update_rows_skipped"] += 1
+                else:
+                    self._update_status[update_key] = update_state
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def add_update_status(self, update_key, update_state):
+        """
+        Queue an explicit update attempt (/record_update_attempt). It goes through the same buffer as
+        heartbeats so whichever arrived last is what gets written, never an older queued heartbeat.
+        """
+        with self._lock:
+            self._update_status[update_key] = update_state
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def forget_written_status(self, keep_status=None):
+        """
+        Drop cached write states after device_update_status rows were deleted behind the buffer's back,
+        so the next unchanged heartbeat is written again. Entries whose status is keep_status survive.
+        """
+        with self._lock:
+            self._written_generation += 1
+            self._written_status = {key: state for key, state in self._written_status.items()
+                                    if keep_status is not None and state[1] == keep_status}
+
+    def depth(self):
+        with self._lock:
+            return len(self._devices) + len(self._update_status)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                devices, self._devices = self._devices, {}
+                statuses, self._update_status = self._update_status, {}
+                generation = self._written_generation
+            if not devices and not statuses:
+                return
+            started = time.monotonic()
+            device_rows = list(devices.values())
+            for batch in batched(device_rows, HEARTBEAT_BATCH_SIZE):
+                self._write_batch(self._write_devices, batch)
+            status_rows = list(statuses.items())
+            for batch in batched(status_rows, HEARTBEAT_BATCH_SIZE):
+                written = self._write_batch(self._write_update_status, batch)
+                with self._lock:
+                    if generation != self._written_generation:
+                        continue  # rows were deleted mid-flush; let the next heartbeat write them again
+                    for key, state in written:
+                        self._written_status[key] = state
+            elapsed_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+                self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 2)
+                self._stats["last_flush_at"] = format_datetime_for_client(datetime.now(timezone.utc))
+            logging.debug(f"Heartbeat flush: {len(device_rows)} devices, {len(status_rows)} update rows in {elapsed_ms:.1f} ms")
+
+    def _write_batch(self, writer, batch):
+        """Write a batch in one statement; if that fails, fall back to row by row so one bad row
+        (e.g. an employee_id that no longer exists) does not drop the others."""
+        try:
+            writer(batch)
+            return batch
+        except Exception as e:
+            logging.warning(f"Heartbeat batch of {len(batch)} failed, retrying row by row: {e}")
+        written = []
+        for row in batch:
+            try:
+                writer([row])
+                written.append(row)
+            except Exception as e:
+                with self._lock:
+                    self._stats["failed_rows"] += 1
+                logging.error(f"Heartbeat row dropped: {row} | Error: {e}")
+        return written
+
+    def _write_devices(self, rows):
+        placeholders = ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+        params = []
+        for row in rows:
+            params.extend((row['employee_id'], row['status'], row['app_running'], row['hostname'],
+                           row['email'], row['last_seen'], row['ip'], row['device_type']))
+        # CRITICAL: active_status is intentionally not part of this upsert (admin setting is preserved)
+        execute_query(f"""
+            INSERT INTO employee_devices
+                (employee_id, status, app_running, hostname, email, last_seen, ip, device_type)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                status = VALUES(status),
+                app_running = VALUES(app_running),
+                hostname = VALUES(hostname),
+                email = VALUES(email),
+                last_seen = VALUES(last_seen),
+                ip = VALUES(ip),
+                device_type = VALUES(device_type)
+        """, tuple(params), commit=True)
+        with self._lock:
+            self._stats["device_rows_written"] += len(rows)
+
+    def _write_update_status(self, rows):
+        placeholders = ','.join(['(%s, %s, %s, %s, %s, %s, %s, NOW())'] * len(rows))
+        params = []
+        for (employee_id, device_id), (version, status, error_message) in rows:
+            params.extend((str(uuid.uuid4()), employee_id, device_id, update_cohort(device_id),
+                           version, status, error_message))
+        execute_query(f"""
+            INSERT INTO device_update_status
+                (id, employee_id, device_id, cohort, version, status, error_message, last_attempted_at)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                cohort = VALUES(cohort),
+                version = VALUES(version),
+                status = VALUES(status),
+                error_message = VALUES(error_message),
+                last_attempted_at = NOW()
+        """, tuple(params), commit=True)
+        invalidate_update_summary()
+        with self._lock:
+            self._stats["update_rows_written"] += len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Heartbeat flush failed: {e}")
+
+    def start(self):
+        if self.flush_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+        self._thread.start()
+        logging.info(f"Heartbeat buffer flushing every {self.flush_interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_devices"] = len(self._devices)
+            stats["pending_update_rows"] = len(self._update_status)
+        stats["depth"] = stats["pending_devices"] + stats["pending_update_rows"]
+        stats["flush_interval_seconds"] = self.flush_interval
+        return stats
+
+
+heartbeat_buffer = HeartbeatBuffer()
+atexit.register(heartbeat_buffer.stop)
+
+
+# ---------------------------------------------------------------------------
+# Presence: online/offline derived from the last heartbeat, kept in memory
+# ---------------------------------------------------------------------------
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "180"))      # ~3 missed heartbeats
+PRESENCE_SWEEP_SECONDS = int(os.getenv("PRESENCE_SWEEP_SECONDS", "30"))
+
+
+class PresenceTracker:
+    """
+    Last-heartbeat time per employee_id. A device is online while its last heartbeat is younger
+    than the TTL. The sweeper thread marks expired devices offline in employee_devices in one
+    statement, so crashed clients stop showing as online without an admin touching them.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL_SECONDS, sweep_interval=PRESENCE_SWEEP_SECONDS):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_seen = {}   # employee_id -> aware UTC datetime of the last heartbeat
+        self._online = set()   # employee_ids currently considered online
+        self._seeded = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"sweeps": 0, "marked_offline": 0, "last_sweep_ms": 0.0}
+
+    def seed(self):
+        """Load the last known state from MySQL once, so presence survives a restart."""
+        rows = execute_query("SELECT employee_id, status, last_seen FROM employee_devices", fetch=True).get("data", []) or []
+        with self._lock:
+            for row in rows:
+                last_seen = row['last_seen']
+                if last_seen is None:
+                    continue
+                if last_seen.tzinfo is None:
+                    last_seen = last_seen.replace(tzinfo=timezone.utc)
+                if row['employee_id'] not in self._last_seen or self._last_seen[row['employee_id']] < last_seen:
+                    self._last_seen[row['employee_id']] = last_seen
+                    if row['status'] == 'online':
+                        self._online.add(row['employee_id'])
+            self._seeded = True
+        logging.info(f"Presence seeded with {len(rows)} devices")
+
+    def heartbeat(self, employee_id, status='online'):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._last_seen[employee_id] = now
+            if status == 'offline':
+                self._online.discard(employee_id)
+            else:
+                self._online.add(employee_id)
+
+    def _is_online(self, employee_id, cutoff):
+        return employee_id in self._online and self._last_seen.get(employee_id, cutoff) > cutoff
+
+    def status(self, employee_id):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        with self._lock:
+            if employee_id not in self._last_seen:
+                return None
+            return 'online' if self._is_online(employee_id, cutoff) else 'offline'
+
+    def snapshot(self):
+        """employee_id -> {"status", "last_seen"} for every device we have heard from."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        with self._lock:
+            return {
+                emp: {"status": 'online' if self._is_online(emp, cutoff) else 'offline', "last_seen": seen}
+                for emp, seen in self._last_seen.items()
+            }
+
+    def online_count(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        with self._lock:
+            return sum(1 for emp in self._online if self._is_online(emp, cutoff))
+
+    def sweep(self):
+        started = time.monotonic()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        with self._lock:
+            expired = [emp for emp in self._online if self._last_seen.get(emp, cutoff) <= cutoff]
+        cutoff_str = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+        marked = 0
+        for batch in batched(expired, HEARTBEAT_BATCH_SIZE):
+            placeholders = ','.join(['%s'] * len(batch))
+            # last_seen = last_seen keeps ON UPDATE CURRENT_TIMESTAMP from overwriting the real last heartbeat;
+            # the last_seen guard skips devices whose fresh heartbeat was flushed in the meantime
+            execute_query(f"""
+                UPDATE employee_devices
+                SET status = 'offline', app_running = 0, last_seen = last_seen
+                WHERE employee_id IN ({placeholders}) AND status = 'online' AND last_seen <= %s
+            """, (*batch, cutoff_str), commit=True)
+            with self._lock:
+                for emp in batch:
+                    if self._last_seen.get(emp, cutoff) <= cutoff:
+                        self._online.discard(emp)
+                        marked += 1
+        with self._lock:
+            self._stats["sweeps"] += 1
+            self._stats["marked_offline"] += marked
+            self._stats["last_sweep_ms"] = round((time.monotonic() - started) * 1000, 2)
+        if marked:
+            logging.info(f"Presence sweep marked {marked} devices offline")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self._seeded:
+                    self.seed()
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Presence sweep failed: {e}")
+            self._stop.wait(self.sweep_interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="presence-sweeper", daemon=True)
+        self._thread.start()
+        logging.info(f"Presence sweeper running every {self.sweep_interval}s (TTL {self.ttl}s)")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked_devices"] = len(self._last_seen)
+            stats["seeded"] = self._seeded
+        stats["online"] = self.online_count()
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+
+presence_tracker = PresenceTracker()
+
+
+# ---------------------------------------------------------------------------
+# Image derivatives: display-size, thumbnail and WebP variants encoded off the request path
+# ---------------------------------------------------------------------------
+IMAGE_DISPLAY_MAX_PX = int(os.getenv("IMAGE_DISPLAY_MAX_PX", "1600"))
+IMAGE_THUMB_MAX_PX = int(os.getenv("IMAGE_THUMB_MAX_PX", "320"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_RECOVERY_DAYS = int(os.getenv("IMAGE_RECOVERY_DAYS", "7"))   # re-queue recent images left unprocessed by a restart
+IMAGE_VARIANTS = ('display', 'thumb', 'webp')
+
+
+def build_image_derivatives(image_path):
+    """
+    Encode the display, thumb and webp variants next to image_path as <stem>_display.jpg (.png with
+    alpha), <stem>_thumb.jpg and <stem>_display.webp (EXIF orientation applied, then every EXIF/ICC
+    tag dropped by re-encoding). Returns {name: {"url", "width", "height", "bytes"}},
+    including the untouched original.
+    """
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    with Image.open(image_path) as source:
+        original_size = source.size
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = {"original": {
+        "url": f"{SERVER_URL}/uploads/message/images/{os.path.basename(image_path)}",
+        "width": original_size[0],
+        "height": original_size[1],
+        "bytes": os.path.getsize(image_path)
+    }}
+
+    def save(name, variant, fmt, ext, suffix=None, **options):
+        filename = f"{stem}_{suffix or name}.{ext}"
+        path = os.path.join(IMAGE_DIR, filename)
+        variant.save(path + ".tmp", fmt, **options)
+        os.replace(path + ".tmp", path)
+        variants[name] = {
+            "url": f"{SERVER_URL}/uploads/message/images/{filename}",
+            "width": variant.width,
+            "height": variant.height,
+            "bytes": os.path.getsize(path)
+        }
+
+    display = image.copy()
+    display.thumbnail((IMAGE_DISPLAY_MAX_PX, IMAGE_DISPLAY_MAX_PX), Image.LANCZOS)
+    thumb = image.copy()
+    thumb.thumbnail((IMAGE_THUMB_MAX_PX, IMAGE_THUMB_MAX_PX), Image.LANCZOS)
+    if has_alpha:
+        save('display', display, 'PNG', 'png', optimize=True)
+        save('thumb', thumb, 'PNG', 'png', optimize=True)
+    else:
+        save('display', display, 'JPEG', 'jpg', quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+        save('thumb', thumb, 'JPEG', 'jpg', quality=IMAGE_JPEG_QUALITY, optimize=True)
+    save('webp', display, 'WEBP', 'webp', suffix='display', quality=IMAGE_WEBP_QUALITY, method=4)
+    return variants
+
+
+def pick_image_variant(item, preference):
+    """
+    Swap item['image_url'] for the variant the client asked for (falls back to the original).
+    Returns the chosen variant's entry, or None when the original is served.
+    """
+    variants = item.pop('image_variants', None)
+    if isinstance(variants, (str, bytes)):
+        variants = json.loads(variants)
+    item['image_variants'] = variants or None
+    if not variants or not item.get('image_url'):
+        return None
+    order = {'webp': ('webp', 'display'), 'thumb': ('thumb', 'display'), 'original': ()}.get(preference, ('display',))
+    for name in order:
+        if name in variants:
+            item['image_url'] = variants[name]['url']
+            return variants[name]
+    return None
+
+
+class ImageDerivativeWorker:
+    """
+    One background thread that encodes image variants for freshly sent content, so send_message
+    returns as soon as the original is on disk. Until a content's image_variants is written,
+    readers keep using the original image_url.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stats = {"processed": 0, "failed": 0, "last_ms": 0.0, "max_ms": 0.0}
+        self._lock = threading.Lock()
+
+    def submit(self, content_id, image_path):
+        self._queue.put((content_id, image_path))
+
+    def recover(self):
+        """Re-queue recent image content whose variants were never recorded (e.g. a restart mid-queue)."""
+        rows = execute_query("""
+            SELECT id, image_url FROM scheduled_content
+            WHERE image_url IS NOT NULL AND image_variants IS NULL
+              AND created_at >= NOW() - INTERVAL %s DAY
+        """, (IMAGE_RECOVERY_DAYS,), fetch=True).get("data", []) or []
+        for row in rows:
+            self.submit(row['id'], os.path.join(IMAGE_DIR, row['image_url'].rsplit('/', 1)[-1]))
+        if rows:
+            logging.info(f"Re-queued {len(rows)} images for derivative encoding")
+
+    def process(self, content_id, image_path):
+        started = time.monotonic()
+        try:
+            variants = build_image_derivatives(image_path)
+            failed = False
+        except Exception as e:
+            # Recorded as {} so it is not retried forever; /content keeps serving the original
+            logging.error(f"Image derivatives failed for {content_id} ({image_path}): {e}")
+            variants, failed = {}, True
+        execute_query(
+            "UPDATE scheduled_content SET image_variants = %s, image_variants_at = NOW() WHERE id = %s",
+            (json.dumps(variants), content_id),
+            commit=True
+        )
+        # Clients already showing the original re-sync (the /content ETag and ?since both see the change)
+        if variants:
+            try:
+                recipients = connected_recipients(content_id, due_only=True)
+                if recipients:
+                    event_broker.publish('content', {"content_id": content_id, "image_variants": True}, recipients)
+            except Exception as e:
+                logging.error(f"Error publishing image variants event for {content_id}: {e}")
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats["failed" if failed else "processed"] += 1
+            self._stats["last_ms"] = round(elapsed_ms, 1)
+            self._stats["max_ms"] = round(max(self._stats["max_ms"], elapsed_ms), 1)
+        if not failed:
+            logging.info(f"Image derivatives for {content_id} ready in {elapsed_ms:.0f}ms")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self.process(*job)
+            except Exception as e:
+                logging.error(f"Image derivative worker error: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="image-derivatives", daemon=True)
+        self._thread.start()
+        try:
+            self.recover()
+        except Exception as e:
+            logging.error(f"Image derivative recovery failed: {e}")
+
+    def stop(self):
+        self._queue.put(None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+image_worker = ImageDerivativeWorker()
+atexit.register(image_worker.stop)
+
+
+# Background threads are started lazily on the first request. Under `app.run(debug=True)` the
+# reloader parent never serves requests, so only the process that actually handles traffic
+# runs them.
+_background_workers_started = False
+_background_workers_lock = threading.Lock()
+
+def start_background_workers():
+    global _background_workers_started
+    if _background_workers_started:
+        return
+    with _background_workers_lock:
+        if _background_workers_started:
+            return
+        heartbeat_buffer.start()
+        presence_tracker.start()
+        notification_scheduler.start()
+        image_worker.start()
+        _background_workers_started = True
+
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
+
 
 
 def login_required(f):
@@ -233,11 +1738,24 @@ def admin_required(f):
     return decorated_function
 
 
+# version.txt is read on every heartbeat; only re-read it when the file actually changes
+_version_cache = {"key": None, "version": None}
+_version_cache_lock = threading.Lock()
+
 def get_current_version():
     version_path = os.path.join(app.config['UPLOAD_FOLDER'], 'version.txt')
     try:
+        stat = os.stat(version_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with _version_cache_lock:
+            if _version_cache["key"] == key:
+                return _version_cache["version"]
         with open(version_path, 'r') as f:
-            return f.read().strip()
+            version_text = f.read().strip()
+        with _version_cache_lock:
+            _version_cache["key"] = key
+            _version_cache["version"] = version_text
+        return version_text
     except Exception:
         return None
 
@@ -245,16 +1763,68 @@ def get_current_version():
 # Serve files from uploads directory
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
+    """
+    Uploads with strong ETag/Last-Modified validators: If-None-Match/If-Modified-Since get a 304,
+    Range requests (the client's video probe, seeking) get a 206 for just the requested bytes.
+    """
+    file_path = None
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(file_path):
-            logging.error(f"File not found: {file_path}")
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if file_path is None or not os.path.isfile(file_path):
+            logging.error(f"File not found: {file_path or filename}")
             return jsonify({"message": "File not found"}), 404
-        logging.info(f"Serving file: {file_path}")
-        return send_file(file_path, as_attachment=False)
+
+        stat = os.stat(file_path)
+        etag = make_etag(filename, stat.st_size, stat.st_mtime_ns)
+        immutable = bool(IMMUTABLE_UPLOAD_RE.match(filename.replace('\\', '/')))
+
+        if MEDIA_SENDFILE_MODE in ('x-accel', 'x-sendfile'):
+            return offload_uploaded_file(filename, file_path, stat, etag, immutable)
+
+        logging.debug(f"Serving file: {file_path}")
+        response = send_file(
+            file_path,
+            as_attachment=False,
+            conditional=True,
+            etag=etag,
+            last_modified=stat.st_mtime,
+            max_age=MEDIA_IMMUTABLE_MAX_AGE if immutable else 0
+        )
+        if immutable:
+            response.cache_control.immutable = True
+        return response
     except Exception as e:
-        logging.error(f"Error serving file {file_path}: {str(e)}")
+        logging.error(f"Error serving file {file_path or filename}: {str(e)}")
         return jsonify({"message": f"Error serving file: {str(e)}"}), 500
+
+
+def offload_uploaded_file(filename, file_path, stat, etag, immutable):
+    """
+    Answer validators here but hand the body to the fronting proxy (X-Accel-Redirect / X-Sendfile),
+    which also serves Range requests, so large MP4s never occupy a Flask worker.
+    """
+    response = app.response_class(mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = stat.st_mtime
+    response.headers['Accept-Ranges'] = 'bytes'
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = MEDIA_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    if MEDIA_SENDFILE_MODE == 'x-accel':
+        response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + urllib.parse.quote(filename.replace('\\', '/'))
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(file_path)
+        response.content_length = stat.st_size
+        response.direct_passthrough = True
+    logging.debug(f"Offloading file to proxy ({MEDIA_SENDFILE_MODE}): {file_path}")
+    return response
     
 @app.route('/login', methods=['GET'])
 def login():
@@ -420,7 +1990,7 @@ def messages_page():
     try:
         # Fetch all messages from scheduled_content
         contents_result = execute_query("""
-            SELECT id, title, text, image_url, url, scheduled_time, created_at 
+            SELECT id, title, text, image_url, image_variants, url, scheduled_time, created_at 
             FROM scheduled_content 
             ORDER BY scheduled_time DESC
         """, fetch=True)
@@ -428,6 +1998,8 @@ def messages_page():
         
         formatted_messages = []
         for c in contents:
+            # Browsers all decode WebP; the cards never need the full-resolution upload
+            pick_image_variant(c, 'webp')
             # Format date
             dt = c.get('scheduled_time') or c.get('created_at')
             if dt:
@@ -521,6 +2093,94 @@ def welcome():
 
 
 
+DASHBOARD_PAGE_SIZE = 10
+DASHBOARD_TZ = timezone(timedelta(hours=5, minutes=30))  # dashboard dates are Sri Lanka dates
+
+
+def parse_dashboard_date_range(args):
+    """?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive, dashboard dates) -> (start, end) naive UTC bounds, end exclusive."""
+    bounds = []
+    for key, shift in (('start', 0), ('end', 1)):
+        value = args.get(key)
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=DASHBOARD_TZ) + timedelta(days=shift)
+        except ValueError:
+            bounds.append(None)
+            continue
+        bounds.append(day.astimezone(timezone.utc).replace(tzinfo=None))
+    return tuple(bounds)
+
+
+def encode_page_cursor(row):
+    return f"{row['scheduled_time'].strftime('%Y-%m-%d %H:%M:%S')}|{row['id']}"
+
+
+def decode_page_cursor(cursor):
+    if not cursor:
+        return None
+    scheduled_time, _, content_id = cursor.partition('|')
+    try:
+        return datetime.strptime(scheduled_time, '%Y-%m-%d %H:%M:%S'), content_id
+    except ValueError:
+        return None
+
+
+def fetch_content_stats_page(columns, page=1, after=None, before=None, start=None, end=None, page_size=DASHBOARD_PAGE_SIZE):
+    """
+    One page of scheduled_content joined to content_stats, newest first. Prev/next links carry a
+    (scheduled_time, id) cursor so they seek through idx_time; a bare ?page=N falls back to OFFSET.
+    """
+    filters, params = [], []
+    if start:
+        filters.append("sc.scheduled_time >= %s")
+        params.append(start)
+    if end:
+        filters.append("sc.scheduled_time < %s")
+        params.append(end)
+
+    count_where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    total_items = execute_query(
+        f"SELECT COUNT(*) AS count FROM scheduled_content sc {count_where}", tuple(params), fetch=True
+    ).get("data", [{}])[0].get("count", 0)
+    total_pages = max(1, (total_items + page_size - 1) // page_size)
+    page = min(max(page, 1), total_pages)
+
+    order, offset, reverse = "DESC", (page - 1) * page_size, False
+    after, before = decode_page_cursor(after), decode_page_cursor(before)
+    if after:
+        filters.append("(sc.scheduled_time < %s OR (sc.scheduled_time = %s AND sc.id < %s))")
+        params.extend((after[0], after[0], after[1]))
+        offset = 0
+    elif before:
+        filters.append("(sc.scheduled_time > %s OR (sc.scheduled_time = %s AND sc.id > %s))")
+        params.extend((before[0], before[0], before[1]))
+        order, offset, reverse = "ASC", 0, True
+
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    rows = execute_query(f"""
+        SELECT {columns}, {CONTENT_STATS_SELECT}
+        FROM scheduled_content sc
+        LEFT JOIN content_stats cs ON cs.content_id = sc.id
+        {where}
+        ORDER BY sc.scheduled_time {order}, sc.id {order}
+        LIMIT %s OFFSET %s
+    """, (*params, page_size, offset), fetch=True).get("data", []) or []
+    if reverse:
+        rows.reverse()
+
+    return {
+        "rows": rows,
+        "current_page": page,
+        "total_pages": total_pages,
+        "total_items": total_items,
+        "next_cursor": encode_page_cursor(rows[-1]) if rows and page < total_pages else None,
+        "prev_cursor": encode_page_cursor(rows[0]) if rows and page > 1 else None
+    }
+
+
 @app.route('/home')
 @login_required
 def home():
@@ -538,35 +2198,23 @@ def home():
             WHERE active_status = 1
         """, fetch=True)
         active_devices = active_devices_result.get("data", [{}])[0].get("count", 0)
+        online_devices = presence_tracker.online_count()
+
+        # 3. One page of scheduled content with its engagement counters from the content_stats rollup
+        start_date, end_date = parse_dashboard_date_range(request.args)
+        page_data = fetch_content_stats_page(
+            "sc.id, sc.title, sc.scheduled_time, sc.created_at",
+            page=request.args.get('page', 1, type=int),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            start=start_date,
+            end=end_date
+        )
 
-        # 3. Fetch all scheduled content with created_at or scheduled_time
-        contents_result = execute_query("""
-            SELECT id, title, text, scheduled_time, created_at 
-            FROM scheduled_content 
-            ORDER BY scheduled_time DESC
-        """, fetch=True)
-        contents = contents_result.get("data", []) or []
-
-        content_stats = []
-        for content in contents:
+        paginated_stats = []
+        for content in page_data["rows"]:
             content_id = content['id']
 
-            # Reactions
-            reactions_result = execute_query("""
-                SELECT reaction FROM reactions WHERE content_id = %s
-            """, (content_id,), fetch=True)
-            reaction_data = reactions_result.get("data", []) or []
-            reaction_counts = {k: sum(1 for r in reaction_data if r['reaction'] == k) 
-                              for k in ['like', 'unlike', 'heart', 'cry']}
-
-            # Feedback count
-            feedback_result = execute_query("SELECT id FROM feedback WHERE content_id = %s", (content_id,), fetch=True)
-            feedback_count = len(feedback_result.get("data", []) or [])
-
-            # Unique views
-            views_result = execute_query("SELECT employee_id FROM views WHERE content_id = %s", (content_id,), fetch=True)
-            view_count = len(set(v['employee_id'] for v in views_result.get("data", []) or []))
-
             # Format sent date (use scheduled_time, fallback to created_at)
             sent_date = content.get('scheduled_time') or content.get('created_at')
             if sent_date:
@@ -581,39 +2229,33 @@ def home():
                 sent_date_str = "—"
 
             sent_date_str = sent_date.strftime("%d %b %Y, %I:%M %p")  # One line format
-            content_stats.append({
+            paginated_stats.append({
                 'id': content_id,
                 'title': content.get('title', 'No title'),
-                'like_count': reaction_counts.get('like', 0),
-                'unlike_count': reaction_counts.get('unlike', 0),
-                'heart_count': reaction_counts.get('heart', 0),
-                'cry_count': reaction_counts.get('cry', 0),
-                'feedback_count': feedback_count,
-                'view_count': view_count,
+                **{column: int(content[column]) for column in CONTENT_STATS_COUNTERS},
                 'sent_date_one_line': sent_date_str,           # ← New: One line
                 'sent_date_raw': sent_date.isoformat() if sent_date else ''  # ← For filter
             })
 
-        # Pagination
-        items_per_page = 10
-        page = int(request.args.get('page', 1))
-        total_items = len(content_stats)
-        total_pages = (total_items + items_per_page - 1) // items_per_page
-        start_idx = (page - 1) * items_per_page
-        end_idx = start_idx + items_per_page
-        paginated_stats = content_stats[start_idx:end_idx]
-
-        # 4. Update Status Summary
-        update_summary_res = get_update_status_summary()
-        update_stats = update_summary_res.get_json() if hasattr(update_summary_res, 'get_json') else {}
+        # 4. Update Status Summary (cached, see update_status_summary)
+        try:
+            update_stats = update_status_summary()
+        except Exception as e:
+            logging.error(f"Error fetching update summary: {str(e)}")
+            update_stats = {}
 
         return render_template('home.html',
                               employee_count=employee_count,
                               active_devices=active_devices,
-                              content_stats=content_stats,
+                              online_devices=online_devices,
+                              content_stats=paginated_stats,
                               paginated_stats=paginated_stats,
-                              current_page=page,
-                              total_pages=total_pages,
+                              current_page=page_data["current_page"],
+                              total_pages=page_data["total_pages"],
+                              next_cursor=page_data["next_cursor"],
+                              prev_cursor=page_data["prev_cursor"],
+                              filter_start=request.args.get('start', ''),
+                              filter_end=request.args.get('end', ''),
                               update_stats=update_stats)
 
     except Exception as e:
@@ -621,6 +2263,7 @@ def home():
         return render_template('home.html',
                               employee_count=0,
                               active_devices=0,
+                              online_devices=0,
                               content_stats=[],
                               paginated_stats=[],
                               current_page=1,
@@ -632,53 +2275,30 @@ def home():
 @admin_required
 def get_paginated_stats():
     try:
-        # Fetch all scheduled content (ordered by time — most logical)
-        contents_result = execute_query(
-            "SELECT * FROM scheduled_content ORDER BY scheduled_time DESC",
-            fetch=True
+        # One page of scheduled content (newest first) with its content_stats counters
+        start_date, end_date = parse_dashboard_date_range(request.args)
+        page_data = fetch_content_stats_page(
+            "sc.id, sc.title, sc.text, sc.scheduled_time",
+            page=request.args.get('page', 1, type=int),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            start=start_date,
+            end=end_date
         )
-        contents = contents_result.get("data", []) or []
-        content_stats = []
-        for content in contents:
-            content_id = content['id']
-            reactions_result = execute_query("""
-                SELECT reaction 
-                FROM reactions 
-                WHERE content_id = %s
-            """, (content_id,), fetch=True)
-            reaction_data = reactions_result.get("data", []) or []
-            reaction_counts = {k: sum(1 for r in reaction_data if r['reaction'] == k) for k in ['like', 'unlike', 'heart', 'cry']}
-            feedback_result = execute_query("SELECT id FROM feedback WHERE content_id = %s", (content_id,), fetch=True)
-            feedback_count = len(feedback_result.get("data", []) or [])
-            views_result = execute_query("SELECT employee_id FROM views WHERE content_id = %s", (content_id,), fetch=True)
-            view_count = len(set(view['employee_id'] for view in views_result.get("data", []) or []))
-            content_stats.append({
-                'id': content_id,
-                'title': content.get('title', 'No title'),
-                'text': content.get('text', 'No text'),
-                'like_count': reaction_counts.get('like', 0),
-                'unlike_count': reaction_counts.get('unlike', 0),
-                'heart_count': reaction_counts.get('heart', 0),
-                'cry_count': reaction_counts.get('cry', 0),
-                'feedback_count': feedback_count,
-                'view_count': view_count
-            })
-
-
-        # Pagination logic
-        items_per_page = 10
-        page = int(request.args.get('page', 1))
-        total_items = len(content_stats)
-        total_pages = (total_items + items_per_page - 1) // items_per_page
-        start_idx = (page - 1) * items_per_page
-        end_idx = start_idx + items_per_page
-        paginated_stats = content_stats[start_idx:end_idx]
-
+        paginated_stats = [{
+            'id': content['id'],
+            'title': content.get('title', 'No title'),
+            'text': content.get('text', 'No text'),
+            **{column: int(content[column]) for column in CONTENT_STATS_COUNTERS}
+        } for content in page_data["rows"]]
 
         return jsonify({
             'paginated_stats': paginated_stats,
-            'current_page': page,
-            'total_pages': total_pages
+            'current_page': page_data["current_page"],
+            'total_pages': page_data["total_pages"],
+            'total_items': page_data["total_items"],
+            'next_cursor': page_data["next_cursor"],
+            'prev_cursor': page_data["prev_cursor"]
         })
     except Exception as e:
         logging.error(f"Error fetching paginated stats: {str(e)}")
@@ -705,6 +2325,312 @@ def get_employees():
 
 
 
+# ---------------------------------------------------------------------------
+# Update deltas: when a build is uploaded, binary patches from the previous few builds are generated
+# in the background so clients download only what changed. Chunks are cut at content-defined
+# boundaries (so an insertion early in the exe does not shift every later chunk) and matched by hash
+# against the old build; the patch is a copy/insert op stream, LZMA-compressed.
+#
+#   HRDELTA1 | target size (>Q) | target sha256 (32 bytes) | lzma( ops )
+#   ops: b'C' + >QI (old offset, length)   copy from the old build
+#        b'I' + >I (length) + bytes        insert literal bytes
+# ---------------------------------------------------------------------------
+DELTA_MAGIC = b'HRDELTA1'
+DELTA_SOURCE_VERSIONS = int(os.getenv("DELTA_SOURCE_VERSIONS", "3"))   # patch from this many previous builds
+DELTA_MAX_RATIO = float(os.getenv("DELTA_MAX_RATIO", "0.6"))           # patches bigger than this share of the exe are dropped
+DELTA_MIN_CHUNK = 2 * 1024
+DELTA_MAX_CHUNK = 64 * 1024
+DELTA_BOUNDARY_RE = re.compile(rb'\x00\x00|\xff\xff')
+VERSION_RE = re.compile(r'^\d+\.\d+\.\d+$')
+
+
+def update_backup_dir():
+    return os.path.join(app.config['UPLOAD_FOLDER'], "backups")
+
+
+def update_delta_dir():
+    return os.path.join(app.config['UPLOAD_FOLDER'], "deltas")
+
+
+def update_delta_path(from_version, to_version):
+    return os.path.join(update_delta_dir(), f"app_{from_version}_{to_version}.delta")
+
+
+def file_sha256(path):
+    """SHA-256 of a file, cached in a <path>.sha256 sidecar keyed by size and mtime."""
+    stat = os.stat(path)
+    key = f"{stat.st_size} {stat.st_mtime_ns}"
+    sidecar = path + ".sha256"
+    try:
+        with open(sidecar, 'r') as f:
+            digest, _, cached_key = f.read().strip().partition(' ')
+        if cached_key == key:
+            return digest
+    except (OSError, ValueError):
+        pass
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MEDIA_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with open(sidecar, 'w') as f:
+        f.write(f"{digest} {key}")
+    return digest
+
+
+def _delta_chunks(data):
+    """Yield (start, end) content-defined chunks of data."""
+    start, size = 0, len(data)
+    while start < size:
+        match = DELTA_BOUNDARY_RE.search(data, start + DELTA_MIN_CHUNK, start + DELTA_MAX_CHUNK)
+        end = min(match.end() if match else start + DELTA_MAX_CHUNK, size)
+        yield start, end
+        start = end
+
+
+def build_update_delta(old_path, new_path, delta_path):
+    """Write a patch turning old_path into new_path; returns its size, or None if it saves too little."""
+    with open(old_path, 'rb') as f:
+        old = f.read()
+    with open(new_path, 'rb') as f:
+        new = f.read()
+    old_view, new_view = memoryview(old), memoryview(new)
+    index = {}
+    for start, end in _delta_chunks(old):
+        index.setdefault(hashlib.sha1(old_view[start:end]).digest(), start)
+
+    tmp_path = delta_path + ".tmp"
+    compressor = lzma.LZMACompressor(preset=6)
+    with open(tmp_path, 'wb') as out:
+        out.write(DELTA_MAGIC + struct.pack('>Q', len(new)) + bytes.fromhex(file_sha256(new_path)))
+        copy_from, copy_len, literal = None, 0, bytearray()
+
+        def flush():
+            nonlocal copy_from, copy_len, literal
+            if copy_len:
+                out.write(compressor.compress(b'C' + struct.pack('>QI', copy_from, copy_len)))
+            if literal:
+                out.write(compressor.compress(b'I' + struct.pack('>I', len(literal)) + bytes(literal)))
+            copy_from, copy_len, literal = None, 0, bytearray()
+
+        for start, end in _delta_chunks(new):
+            old_start = index.get(hashlib.sha1(new_view[start:end]).digest())
+            if old_start is not None and old_view[old_start:old_start + end - start] == new_view[start:end]:
+                if literal or (copy_len and copy_from + copy_len != old_start):
+                    flush()
+                if not copy_len:
+                    copy_from = old_start
+                copy_len += end - start
+            else:
+                if copy_len:
+                    flush()
+                literal += new_view[start:end]
+        flush()
+        out.write(compressor.flush())
+
+    delta_size = os.path.getsize(tmp_path)
+    if delta_size > len(new) * DELTA_MAX_RATIO:
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, delta_path)
+    return delta_size
+
+
+def version_key(version_text):
+    return tuple(int(part) for part in version_text.split('.'))
+
+
+def generate_update_deltas(new_version):
+    """Patches to new_version from the DELTA_SOURCE_VERSIONS newest older builds kept in backups/."""
+    backup_dir = update_backup_dir()
+    new_path = os.path.join(backup_dir, f"app_{new_version}.exe")
+    os.makedirs(update_delta_dir(), exist_ok=True)
+    older = []
+    for name in os.listdir(backup_dir):
+        match = re.match(r'^app_(\d+\.\d+\.\d+)\.exe$', name)
+        if match and version_key(match.group(1)) < version_key(new_version):
+            older.append(match.group(1))
+    for old_version in sorted(older, key=version_key, reverse=True)[:DELTA_SOURCE_VERSIONS]:
+        started = time.monotonic()
+        try:
+            size = build_update_delta(os.path.join(backup_dir, f"app_{old_version}.exe"), new_path,
+                                      update_delta_path(old_version, new_version))
+            if size is None:
+                logger.info(f"Delta {old_version} -> {new_version} skipped (saves too little)")
+            else:
+                logger.info(f"Delta {old_version} -> {new_version}: {size} bytes in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Delta {old_version} -> {new_version} failed: {e}")
+
+
+def remove_update_deltas(version_text):
+    if not VERSION_RE.match(version_text or ''):
+        return
+    for path in glob.glob(os.path.join(update_delta_dir(), f"app_{version_text}_*.delta")) + \
+            glob.glob(os.path.join(update_delta_dir(), f"app_*_{version_text}.delta")):
+        os.remove(path)
+
+
+# ---------------------------------------------------------------------------
+# Update rollout: a percentage ramp over hashed device cohorts, plus a cap on concurrent downloads
+# ---------------------------------------------------------------------------
+UPDATE_COHORTS = 100
+UPDATE_ROLLOUT_PERCENTS = os.getenv("UPDATE_ROLLOUT_PERCENTS", "10,50,100")  # default ramp for new uploads
+UPDATE_ROLLOUT_INTERVAL_MINUTES = int(os.getenv("UPDATE_ROLLOUT_INTERVAL_MINUTES", "30"))
+UPDATE_MAX_CONCURRENT_DOWNLOADS = int(os.getenv("UPDATE_MAX_CONCURRENT_DOWNLOADS", "20"))  # per process; 0 = no cap
+UPDATE_BUSY_RETRY_SECONDS = (30, 120)  # Retry-After window for clients turned away by the cap (jittered)
+UPDATE_ROLLOUT_CACHE_SECONDS = 15
+_update_rollout_cache = {"key": None, "rollout": None, "expires": 0.0}
+_update_rollout_lock = threading.Lock()
+_update_downloads = {"active": 0, "peak": 0, "rejected_busy": 0, "rejected_cohort": 0}
+_update_downloads_lock = threading.Lock()
+
+
+def update_cohort(device_id):
+    """Stable cohort 0-99 for a device, so the same devices always go first in every ramp."""
+    digest = hashlib.sha256(str(device_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % UPDATE_COHORTS
+
+
+def parse_rollout_percents(text):
+    """'10,50,100' -> [10, 50, 100]. Steps must be 0-100 and non-decreasing; raises ValueError."""
+    try:
+        percents = [int(part) for part in str(text).replace(' ', '').split(',') if part != '']
+    except ValueError:
+        raise ValueError("Rollout steps must be whole percentages, e.g. 10,50,100")
+    if not percents:
+        raise ValueError("Rollout needs at least one step")
+    if any(p < 0 or p > 100 for p in percents):
+        raise ValueError("Rollout steps must be between 0 and 100")
+    if percents != sorted(percents):
+        raise ValueError("Rollout steps must not decrease")
+    return percents
+
+
+def parse_rollout_interval(value):
+    interval = int(value or UPDATE_ROLLOUT_INTERVAL_MINUTES)
+    if interval < 1:
+        raise ValueError("Rollout interval must be at least one minute")
+    return interval
+
+
+def invalidate_update_rollout():
+    with _update_rollout_lock:
+        _update_rollout_cache["expires"] = 0.0
+
+
+def current_update_rollout():
+    """
+    Ramp of the live build from version_history: steps, interval and how far it has got. Elapsed time
+    is measured by MySQL (NOW() vs the stored start) and advanced locally between short-lived reads.
+    A build without ramp settings (uploaded before rollouts existed) is open to every cohort.
+    """
+    version_text = get_current_version()
+    now = time.monotonic()
+    with _update_rollout_lock:
+        if _update_rollout_cache["key"] == version_text and now < _update_rollout_cache["expires"]:
+            cached = dict(_update_rollout_cache["rollout"])
+            cached["elapsed_seconds"] += now - cached.pop("_fetched")
+            return cached
+
+    row = (execute_query("""
+        SELECT rollout_percents, rollout_interval_minutes,
+               TIMESTAMPDIFF(SECOND, COALESCE(rollout_started_at, uploaded_at), NOW()) AS elapsed_seconds
+        FROM version_history
+        WHERE version = %s
+    """, (version_text,), fetch=True).get("data") or [{}])[0]
+    try:
+        percents = parse_rollout_percents(row['rollout_percents']) if row.get('rollout_percents') else [100]
+    except ValueError:
+        percents = [100]
+    rollout = {
+        "version": version_text,
+        "percents": percents,
+        "interval_minutes": row.get('rollout_interval_minutes') or UPDATE_ROLLOUT_INTERVAL_MINUTES,
+        "elapsed_seconds": float(row.get('elapsed_seconds') or 0)
+    }
+    with _update_rollout_lock:
+        _update_rollout_cache.update(key=version_text, rollout=dict(rollout, _fetched=now),
+                                     expires=now + UPDATE_ROLLOUT_CACHE_SECONDS)
+    return rollout
+
+
+def rollout_percent(rollout):
+    step = int(rollout["elapsed_seconds"] // (rollout["interval_minutes"] * 60))
+    return rollout["percents"][min(step, len(rollout["percents"]) - 1)]
+
+
+def rollout_wait_seconds(rollout, cohort):
+    """Seconds until the ramp reaches this cohort (0 if it already has, None if it never will)."""
+    for step, percent in enumerate(rollout["percents"]):
+        if cohort < percent:
+            return max(0, math.ceil(step * rollout["interval_minutes"] * 60 - rollout["elapsed_seconds"]))
+    return None
+
+
+def update_device_id():
+    """Device id an update request is keyed on; clients that don't send one are keyed by address."""
+    return request.args.get('device_id') or request.remote_addr or 'unknown'
+
+
+def release_update_download():
+    with _update_downloads_lock:
+        _update_downloads["active"] -= 1
+
+
+def update_throttled(f):
+    """
+    Admission for update downloads. A device whose cohort the ramp hasn't reached, or any device while
+    UPDATE_MAX_CONCURRENT_DOWNLOADS are already streaming, gets a 429 with Retry-After. An admitted
+    download holds its slot until the response body has been sent (or the client hangs up).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('is_admin'):
+            return f(*args, **kwargs)  # the dashboard's "Download Current Output" link
+        cohort = update_cohort(update_device_id())
+        rollout = current_update_rollout()
+        wait = rollout_wait_seconds(rollout, cohort)
+        if wait != 0:
+            with _update_downloads_lock:
+                _update_downloads["rejected_cohort"] += 1
+            # Jitter so a cohort that opens up does not come back in one burst
+            retry_after = (wait if wait is not None else rollout["interval_minutes"] * 60) + random.randint(0, 60)
+            response = jsonify({"message": "Update not yet released to this device", "cohort": cohort,
+                                "rollout_percent": rollout_percent(rollout), "retry_after": retry_after})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+        with _update_downloads_lock:
+            busy = 0 < UPDATE_MAX_CONCURRENT_DOWNLOADS <= _update_downloads["active"]
+            if busy:
+                _update_downloads["rejected_busy"] += 1
+            else:
+                _update_downloads["active"] += 1
+                _update_downloads["peak"] = max(_update_downloads["peak"], _update_downloads["active"])
+        if busy:
+            retry_after = random.randint(*UPDATE_BUSY_RETRY_SECONDS)
+            response = jsonify({"message": "Too many update downloads in progress", "cohort": cohort,
+                                "retry_after": retry_after})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+        try:
+            response = f(*args, **kwargs)
+        except Exception:
+            release_update_download()
+            raise
+        response = app.make_response(response)
+        if response.status_code in (200, 206):
+            response.call_on_close(release_update_download)
+        else:
+            release_update_download()
+        return response
+    return decorated_function
+
+
 # Updated /updates/version
 @app.route('/updates/version', methods=['GET'])
 def get_version():
@@ -716,6 +2642,11 @@ def get_version():
             return jsonify({"message": "Version file not found", "version": "unknown"}), 404
 
 
+        stat = os.stat(version_path)
+        etag = make_etag('version', stat.st_mtime_ns, stat.st_size)
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
         with open(version_path, 'r') as f:
             version_text = f.read().strip()
             if not version_text:
@@ -724,13 +2655,16 @@ def get_version():
 
 
         logger.info(f"Served version: {version_text}")
-        return version_text, 200, {'Content-Type': 'text/plain'}
+        response = app.response_class(version_text, status=200, mimetype='text/plain')
+        response.set_etag(etag)
+        return response
     except Exception as e:
         logger.error(f"Error serving version.txt: {str(e)}")
         return jsonify({"message": f"Error serving version: {str(e)}", "version": "unknown"}), 500
     
 # Updated /updates/app
 @app.route('/updates/app', methods=['GET'])
+@update_throttled
 def get_app():
     """Serve the app.exe file with integrity check."""
     try:
@@ -747,13 +2681,117 @@ def get_app():
             return jsonify({'error': 'Invalid app executable'}), 400
 
 
+        # Strong ETag = content hash, so Range + If-Range resumes only ever splice bytes of the same build
         logger.info(f"Serving app.exe: {exe_path}, size: {file_size} bytes")
-        return send_file(exe_path, as_attachment=True, download_name='app.exe')
+        sha256 = file_sha256(exe_path)
+        response = send_file(exe_path, as_attachment=True, download_name='app.exe', conditional=True, etag=sha256, max_age=0)
+        response.headers['X-Target-SHA256'] = sha256
+        return response
     except Exception as e:
         logger.error(f"Error serving app executable: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/updates/patch/<from_version>', methods=['GET'])
+@update_throttled
+def get_update_patch(from_version):
+    """
+    Patch from the client's current_version to the live build when one was generated, otherwise the
+    full app.exe. X-Update-Format says which; X-Target-SHA256 is what the rebuilt exe must hash to.
+    """
+    try:
+        exe_path = os.path.join(app.config['UPLOAD_FOLDER'], 'app.exe')
+        current_version = get_current_version()
+        if not current_version or not os.path.exists(exe_path):
+            logger.error(f"App executable not found: {exe_path}")
+            return jsonify({'error': 'App executable not found'}), 404
+
+        delta_path = update_delta_path(from_version, current_version)
+        if VERSION_RE.match(from_version) and from_version != current_version and os.path.exists(delta_path):
+            response = send_file(delta_path, as_attachment=True, download_name=os.path.basename(delta_path),
+                                 conditional=True, etag=file_sha256(delta_path), max_age=0)
+            response.headers['X-Update-Format'] = 'delta'
+            logger.info(f"Serving delta {from_version} -> {current_version} ({os.path.getsize(delta_path)} bytes)")
+        else:
+            response = send_file(exe_path, as_attachment=True, download_name='app.exe',
+                                 conditional=True, etag=file_sha256(exe_path), max_age=0)
+            response.headers['X-Update-Format'] = 'full'
+            logger.info(f"No delta from {from_version} to {current_version}, serving full app.exe")
+        response.headers['X-Target-Version'] = current_version
+        response.headers['X-Target-SHA256'] = file_sha256(exe_path)
+        return response
+    except Exception as e:
+        logger.error(f"Error serving update patch from {from_version}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+def release_manifest(version_text):
+    """
+    Size, SHA-256 and available patches for one kept build (None if unknown). Patch and download
+    paths are only given for the live build, since /updates/* always serves that one.
+    """
+    if not VERSION_RE.match(version_text or ''):
+        return None
+    is_current = version_text == get_current_version()
+    if is_current:
+        exe_path = os.path.join(app.config['UPLOAD_FOLDER'], 'app.exe')
+    else:
+        exe_path = os.path.join(update_backup_dir(), f"app_{version_text}.exe")
+    if not os.path.exists(exe_path):
+        return None
+
+    deltas = []
+    for path in glob.glob(os.path.join(update_delta_dir(), f"app_*_{version_text}.delta")):
+        from_version = os.path.basename(path)[len("app_"):-len(f"_{version_text}.delta")]
+        if not VERSION_RE.match(from_version):
+            continue
+        deltas.append({
+            "from_version": from_version,
+            "size": os.path.getsize(path),
+            "sha256": file_sha256(path),
+            "path": f"/updates/patch/{from_version}" if is_current else None
+        })
+    deltas.sort(key=lambda d: version_key(d['from_version']), reverse=True)
+
+    stat = os.stat(exe_path)
+    return {
+        "version": version_text,
+        "size": stat.st_size,
+        "sha256": file_sha256(exe_path),
+        "published_at": format_datetime_for_client(datetime.fromtimestamp(stat.st_mtime, timezone.utc)),
+        "path": "/updates/app" if is_current else None,
+        "deltas": deltas
+    }
+
+
+@app.route('/updates/manifest', methods=['GET'])
+@app.route('/updates/manifest/<version_text>', methods=['GET'])
+def get_release_manifest(version_text=None):
+    """
+    JSON release manifest (latest build by default) with an ETag, so unchanged polls get a 304. With
+    ?device_id= the live build's manifest also says whether that device's rollout cohort is admitted.
+    """
+    try:
+        manifest = release_manifest(version_text or get_current_version())
+        if not manifest:
+            return jsonify({"message": "Release not found"}), 404
+        if manifest["path"] and request.args.get('device_id'):
+            # Only changes when the ramp passes a step, so unchanged polls still get a 304
+            rollout = current_update_rollout()
+            cohort = update_cohort(request.args['device_id'])
+            manifest["rollout"] = {"cohort": cohort, "percent": rollout_percent(rollout),
+                                   "admitted": rollout_wait_seconds(rollout, cohort) == 0}
+        etag = make_etag('manifest', json.dumps(manifest, sort_keys=True))
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+        response = jsonify(manifest)
+        response.set_etag(etag)
+        return response
+    except Exception as e:
+        logger.error(f"Error building release manifest for {version_text}: {str(e)}")
+        return jsonify({"message": f"Error building release manifest: {str(e)}"}), 500
+
+
 @app.route('/update_status', methods=['POST'])
 def update_status():
     try:
@@ -787,21 +2825,9 @@ def update_status():
 
         # CRITICAL: DO NOT TOUCH active_status in this route!
         # Note: active_status is intentionally excluded — admin setting is preserved forever
-        execute_query("""
-            INSERT INTO employee_devices 
-                (employee_id, status, app_running, hostname, email, last_seen, ip, device_type)
-            VALUES 
-                (%(employee_id)s, %(status)s, %(app_running)s, %(hostname)s, %(email)s, %(last_seen)s, %(ip)s, %(device_type)s)
-            ON DUPLICATE KEY UPDATE
-                status = VALUES(status),
-                app_running = VALUES(app_running),
-                hostname = VALUES(hostname),
-                email = VALUES(email),
-                last_seen = VALUES(last_seen),
-                ip = VALUES(ip),
-                device_type = VALUES(device_type)
-        """, update_data, commit=True)
-        
+        # The row is buffered and written by the heartbeat flusher together with everyone else's
+        update_key, update_state_row = None, None
+
         # Old client compatibility: Record update device status if provided
         try:
             device_id = data.get('device_id', employee_id)
@@ -817,23 +2843,16 @@ def update_status():
                 
             error_message = data.get('error_message') if update_state == 'failed' else None
             
-            # Record it (similar to `/record_update_attempt`)
-            record_id = str(uuid.uuid4())
-            execute_query("""
-                INSERT INTO device_update_status 
-                    (id, employee_id, device_id, version, status, error_message, last_attempted_at)
-                VALUES 
-                    (%s, %s, %s, %s, %s, %s, NOW())
-                ON DUPLICATE KEY UPDATE
-                    version = VALUES(version),
-                    status = VALUES(status),
-                    error_message = VALUES(error_message),
-                    last_attempted_at = NOW()
-            """, (record_id, employee_id, device_id, current_version, update_state, error_message), commit=True)
+            # Record it (similar to `/record_update_attempt`) - only written if it changed
+            update_key = (employee_id, device_id)
+            update_state_row = (current_version, update_state, error_message)
         except Exception as e:
             logging.warning(f"Failed to process old client update_status metrics (non-critical): {e}")
 
-        logging.debug(f"Device status updated for {employee_id}")
+        heartbeat_buffer.add(update_data, update_key, update_state_row)
+        presence_tracker.heartbeat(employee_id, update_data['status'])
+
+        logging.debug(f"Device status buffered for {employee_id}")
         return jsonify({'message': 'Status updated', 'active_status': 1})
 
     except Exception as e:
@@ -856,9 +2875,6 @@ def record_update_attempt():
         if not all([device_id, version, status]):
              return jsonify({'error': 'Missing required fields'}), 400
 
-        # Unique ID for the record (or update existing)
-        record_id = str(uuid.uuid4())
-
         # Use INSERT ... ON DUPLICATE KEY UPDATE
         # Note: The table device_update_status has a UNIQUE KEY on (employee_id, device_id)
         # But wait, employee_id might be unknown or null if not logged in? 
@@ -866,17 +2882,8 @@ def record_update_attempt():
         # If the client is not logged in, we might have an issue.
         # However, the client should send employee_id if possible.
 
-        execute_query("""
-            INSERT INTO device_update_status 
-                (id, employee_id, device_id, version, status, error_message, last_attempted_at)
-            VALUES 
-                (%s, %s, %s, %s, %s, %s, NOW())
-            ON DUPLICATE KEY UPDATE
-                version = VALUES(version),
-                status = VALUES(status),
-                error_message = VALUES(error_message),
-                last_attempted_at = NOW()
-        """, (record_id, employee_id, device_id, version, status, error_message), commit=True)
+        # Written by the heartbeat flusher (upsert on that key), ordered with the device's heartbeats
+        heartbeat_buffer.add_update_status((employee_id, device_id), (version, status, error_message))
 
         return jsonify({'message': 'Update attempt recorded'}), 200
     except Exception as e:
@@ -884,48 +2891,132 @@ def record_update_attempt():
         return jsonify({'error': str(e)}), 500
 
 
+# The dashboard asks for the fleet update summary on every load; keep it for a short TTL and drop it
+# whenever device_update_status or the published version changes.
+UPDATE_SUMMARY_TTL_SECONDS = float(os.getenv("UPDATE_SUMMARY_TTL_SECONDS", "30"))
+_update_summary_cache = {"key": None, "summary": None, "expires": 0.0}
+_update_summary_lock = threading.Lock()
+
+
+def invalidate_update_summary():
+    with _update_summary_lock:
+        _update_summary_cache["expires"] = 0.0
+
+
+def update_status_summary():
+    """successful/pending/failed over each employee's latest device_update_status row."""
+    server_version = get_current_version() or 'unknown'
+    now = time.monotonic()
+    with _update_summary_lock:
+        if _update_summary_cache["key"] == server_version and now < _update_summary_cache["expires"]:
+            return dict(_update_summary_cache["summary"])
+
+    # One pass over idx_employee_attempt (employee_id, last_attempted_at, status, version): the window
+    # picks each employee's latest row straight from the index, then conditional sums classify it.
+    # A row that isn't failed counts as successful only when it's on the server version.
+    counts = execute_query("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(status = 'failed'), 0) AS failed,
+               COALESCE(SUM(NOT (status <=> 'failed') AND version = %s), 0) AS successful
+        FROM (
+            SELECT status, version,
+                   ROW_NUMBER() OVER (PARTITION BY employee_id ORDER BY last_attempted_at DESC) AS rn
+            FROM device_update_status
+        ) latest
+        WHERE rn = 1
+    """, (server_version,), fetch=True).get("data", [{}])[0]
+
+    failed = int(counts.get('failed') or 0)
+    successful = int(counts.get('successful') or 0)
+    summary = {
+        'successful': successful,
+        'pending': int(counts.get('total') or 0) - failed - successful,
+        'failed': failed,
+        'latest_version': server_version
+    }
+    with _update_summary_lock:
+        _update_summary_cache.update(key=server_version, summary=summary, expires=now + UPDATE_SUMMARY_TTL_SECONDS)
+    return dict(summary)
+
+
+@app.route('/heartbeat/stats', methods=['GET'])
+@login_required
+@admin_required
+def heartbeat_stats():
+    stats = heartbeat_buffer.stats()
+    stats["presence"] = presence_tracker.stats()
+    return jsonify(stats)
+
+
 @app.route('/update_status/summary', methods=['GET'])
 @login_required
 @admin_required
 def get_update_status_summary():
     try:
-        server_version = get_current_version() or 'unknown'
-        
-        query = """
-            SELECT d1.status, d1.version 
-            FROM device_update_status d1
-            INNER JOIN (
-                SELECT employee_id, MAX(last_attempted_at) as max_time 
-                FROM device_update_status 
-                GROUP BY employee_id
-            ) d2 ON d1.employee_id = d2.employee_id AND d1.last_attempted_at = d2.max_time
-        """
-        response = execute_query(query, fetch=True)
-        
-        successful = 0
-        pending = 0
-        failed = 0
-        
-        for record in response.get("data", []):
-            if record['status'] == 'failed':
-                failed += 1
-            elif record['version'] == server_version:
-                successful += 1
-            else:
-                # If status is 'pending' OR 'success' but version is old
-                pending += 1
-                
-        return jsonify({
-            'successful': successful,
-            'pending': pending,
-            'failed': failed,
-            'latest_version': server_version
-        })
+        return jsonify(update_status_summary())
     except Exception as e:
         logging.error(f"Error fetching update summary: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+def update_rollout_progress():
+    """Live ramp position, download slots and per-side counts of devices inside/outside the admitted cohorts."""
+    rollout = current_update_rollout()
+    percent = rollout_percent(rollout)
+    rows = execute_query("""
+        SELECT cohort < %s AS admitted, COUNT(*) AS devices,
+               COALESCE(SUM(status = 'success' AND version = %s), 0) AS updated
+        FROM device_update_status
+        WHERE cohort IS NOT NULL
+        GROUP BY admitted
+    """, (percent, rollout["version"]), fetch=True).get("data", []) or []
+    sides = {bool(row['admitted']): {"devices": int(row['devices']), "updated": int(row['updated'])} for row in rows}
+    step = int(rollout["elapsed_seconds"] // (rollout["interval_minutes"] * 60))
+    next_step_in = None
+    if step + 1 < len(rollout["percents"]):
+        next_step_in = math.ceil((step + 1) * rollout["interval_minutes"] * 60 - rollout["elapsed_seconds"])
+    with _update_downloads_lock:
+        downloads = dict(_update_downloads)
+    return {
+        "version": rollout["version"],
+        "percents": rollout["percents"],
+        "interval_minutes": rollout["interval_minutes"],
+        "percent": percent,
+        "next_step_in_seconds": next_step_in,
+        "admitted": sides.get(True, {"devices": 0, "updated": 0}),
+        "waiting": sides.get(False, {"devices": 0, "updated": 0}),
+        "downloads": dict(downloads, max_concurrent=UPDATE_MAX_CONCURRENT_DOWNLOADS)
+    }
+
+
+@app.route('/updates/rollout', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def update_rollout():
+    """GET: ramp progress for the dashboard. POST {percents, interval_minutes}: restart the live build's ramp."""
+    try:
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            try:
+                percents = parse_rollout_percents(data.get('percents', ''))
+                interval = parse_rollout_interval(data.get('interval_minutes'))
+            except ValueError as e:
+                return jsonify({"message": str(e)}), 400
+            result = execute_query("""
+                UPDATE version_history
+                SET rollout_percents = %s, rollout_interval_minutes = %s, rollout_started_at = NOW()
+                WHERE version = %s
+            """, (','.join(map(str, percents)), interval, get_current_version()), commit=True)
+            if not result.get("rowcount"):
+                return jsonify({"message": "Live version not found in version history"}), 404
+            invalidate_update_rollout()
+            logger.info(f"Rollout of {get_current_version()} set to {percents} every {interval} min by {session.get('user_email', 'unknown')}")
+        return jsonify(update_rollout_progress())
+    except Exception as e:
+        logging.error(f"Error handling update rollout: {str(e)}")
+        return jsonify({"message": f"Error handling update rollout: {str(e)}"}), 500
+
+
 @app.route('/update_status/all', methods=['GET'])
 @login_required
 @admin_required
@@ -958,10 +3049,129 @@ def get_all_update_statuses():
         
         return jsonify(rows)
     except Exception as e:
-        logging.error(f"Error fetching all update statuses: {str(e)}")
+        logging.error(f"Error fetching all update statuses: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+
+# ---------------------------------------------------------------------------
+# Update-status explorer: one page of device_update_status rows, newest attempt first
+# ---------------------------------------------------------------------------
+UPDATE_EXPLORER_PAGE_SIZE = 50
+UPDATE_EXPLORER_MAX_PAGE_SIZE = 500
+UPDATE_STATUSES = ('success', 'pending', 'failed')
+
+
+def parse_utc_param(value):
+    """ISO-8601 query parameter -> naive UTC datetime (None if missing or unparseable)."""
+    if not value:
+        return None
+    try:
+        parsed = parser.isoparse(value)
+    except (ValueError, OverflowError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def encode_update_cursor(row):
+    return f"{row['last_attempted_at'].strftime('%Y-%m-%d %H:%M:%S')}|{row['id']}"
+
+
+def decode_update_cursor(cursor):
+    if not cursor:
+        return None
+    attempted_at, _, row_id = cursor.partition('|')
+    try:
+        return datetime.strptime(attempted_at, '%Y-%m-%d %H:%M:%S'), row_id
+    except ValueError:
+        return None
+
+
+def query_update_statuses(args, status=None):
+    """
+    Keyset-paginated device_update_status rows. Filters: status, version, email (prefix),
+    since/until (last_attempted_at window); paging: limit + cursor from the previous page.
+    Ordered by (last_attempted_at, id) DESC so each filter seeks through its idx_*_attempt index.
+    """
+    status = status or args.get('status')
+    if status and status not in UPDATE_STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+    limit = min(max(args.get('limit', UPDATE_EXPLORER_PAGE_SIZE, type=int), 1), UPDATE_EXPLORER_MAX_PAGE_SIZE)
+
+    filters, params = [], []
+    if status:
+        filters.append("d.status = %s")
+        params.append(status)
+    if args.get('version'):
+        filters.append("d.version = %s")
+        params.append(args['version'])
+    if args.get('email'):
+        # Escape LIKE wildcards so the prefix stays a range scan on employees.idx_email
+        prefix = re.sub(r'([\\%_])', r'\\\1', args['email'])
+        filters.append("e.email LIKE %s")
+        params.append(prefix + '%')
+    since, until = parse_utc_param(args.get('since')), parse_utc_param(args.get('until'))
+    if since:
+        filters.append("d.last_attempted_at >= %s")
+        params.append(since)
+    if until:
+        filters.append("d.last_attempted_at < %s")
+        params.append(until)
+
+    from_clause = """
+        FROM device_update_status d
+        LEFT JOIN employees e ON e.id = d.employee_id
+    """
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    # The employees join only matters to COUNT(*) when filtering by email
+    count_from = from_clause if args.get('email') else "FROM device_update_status d"
+    total = execute_query(f"SELECT COUNT(*) AS count {count_from} {where}", tuple(params), fetch=True) \
+        .get("data", [{}])[0].get("count", 0)
+
+    cursor = decode_update_cursor(args.get('cursor'))
+    if cursor:
+        filters.append("(d.last_attempted_at < %s OR (d.last_attempted_at = %s AND d.id < %s))")
+        params.extend((cursor[0], cursor[0], cursor[1]))
+        where = f"WHERE {' AND '.join(filters)}"
+
+    rows = execute_query(f"""
+        SELECT d.id, COALESCE(e.email, ed.email, d.employee_id) AS email, d.employee_id, d.device_id,
+               d.cohort, d.version, d.status, d.last_attempted_at, d.error_message
+        {from_clause}
+        LEFT JOIN employee_devices ed ON ed.employee_id = d.employee_id
+        {where}
+        ORDER BY d.last_attempted_at DESC, d.id DESC
+        LIMIT %s
+    """, (*params, limit + 1), fetch=True).get("data", []) or []
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_update_cursor(rows[-1]) if has_more and rows else None
+    for row in rows:
+        if row.get('last_attempted_at'):
+            row['last_attempted_at'] = row['last_attempted_at'].isoformat()
+    return {
+        'items': rows,
+        'total': total,
+        'limit': limit,
+        'next_cursor': next_cursor
+    }
+
+
+@app.route('/update_status/devices', methods=['GET'])
+@login_required
+@admin_required
+def get_update_status_devices():
+    try:
+        return jsonify(query_update_statuses(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error fetching update status page: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-
             
 # Updated /upload_version
 @app.route('/upload_version', methods=['GET', 'POST'])
@@ -985,6 +3195,14 @@ def upload_version():
     version_file = request.files['version_file']
     exe_file = request.files['exe_file']
 
+    try:
+        rollout_percents = parse_rollout_percents(request.form.get('rollout_percents') or UPDATE_ROLLOUT_PERCENTS)
+        rollout_interval = parse_rollout_interval(request.form.get('rollout_interval_minutes'))
+    except ValueError as e:
+        history_result = execute_query("SELECT version, uploaded_at, uploaded_by FROM version_history ORDER BY uploaded_at DESC", fetch=True)
+        version_history = history_result.get("data", [])
+        return render_template('upload_version.html', error=str(e), current_version=current_version, version_history=version_history)
+
 
     if not version_file.filename.endswith('.txt') or not exe_file.filename.endswith('.exe'):
         logger.error("Invalid file types uploaded")
@@ -1042,15 +3260,29 @@ def upload_version():
             DELETE FROM device_update_status 
             WHERE status IS NULL OR status != 'success'
         """, commit=True)
+        heartbeat_buffer.forget_written_status(keep_status='success')
+        invalidate_update_summary()
 
         # Record in version history
+        # The ramp starts now: clients ask for the build, only admitted cohorts get to download it
         execute_query("""
-            INSERT INTO version_history (version, uploaded_at, uploaded_by)
-            VALUES (%s, NOW(), %s)
-            ON DUPLICATE KEY UPDATE uploaded_at = NOW(), uploaded_by = %s
-        """, (new_version, session.get('user_email', 'unknown'), session.get('user_email', 'unknown')), commit=True)
+            INSERT INTO version_history
+                (version, uploaded_at, uploaded_by, rollout_percents, rollout_interval_minutes, rollout_started_at)
+            VALUES (%s, NOW(), %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                uploaded_at = NOW(),
+                uploaded_by = VALUES(uploaded_by),
+                rollout_percents = VALUES(rollout_percents),
+                rollout_interval_minutes = VALUES(rollout_interval_minutes),
+                rollout_started_at = NOW()
+        """, (new_version, session.get('user_email', 'unknown'), ','.join(map(str, rollout_percents)), rollout_interval), commit=True)
+        invalidate_update_rollout()
 
         logger.info(f"New version {new_version} uploaded by {session.get('user_email', 'unknown')}")
+
+        # Patches from older builds are generated off the request; clients get the full exe until they exist
+        file_sha256(exe_path)
+        threading.Thread(target=generate_update_deltas, args=(new_version,), name="update-deltas", daemon=True).start()
         
         history_result = execute_query("SELECT version, uploaded_at, uploaded_by FROM version_history ORDER BY uploaded_at DESC", fetch=True)
         version_history = history_result.get("data", [])
@@ -1065,6 +3297,26 @@ def upload_version():
             if 'temp_version_path' in locals() and os.path.exists(temp_file):
                 os.remove(temp_file)
 
+@app.route('/delete_message/<content_id>', methods=['POST'])
+@login_required
+@admin_required
+def delete_message(content_id):
+    """Delete a message (recipients, reactions, views... cascade) and release its media references."""
+    try:
+        with db_transaction():
+            rows = execute_query(
+                "SELECT url, image_url FROM scheduled_content WHERE id = %s FOR UPDATE", (content_id,), fetch=True
+            ).get("data") or []
+            if not rows:
+                return jsonify({"message": "Message not found"}), 404
+            execute_query("DELETE FROM scheduled_content WHERE id = %s", (content_id,), commit=True)
+            release_media([rows[0]['url'], rows[0]['image_url']])
+        logging.info(f"Message {content_id} deleted by {session['user_email']}")
+        return jsonify({"message": "Deleted"}), 200
+    except Exception as e:
+        logging.error(f"Error deleting message {content_id}: {e}")
+        return jsonify({"message": "Error deleting message"}), 500
+
 @app.route('/delete_version', methods=['POST'])
 @login_required
 @admin_required
@@ -1084,6 +3336,8 @@ def delete_version():
         if os.path.exists(version_txt_backup):
             os.remove(version_txt_backup)
 
+        remove_update_deltas(version)
+
         # Also remove from version_history DB table if you have one
         execute_query("DELETE FROM version_history WHERE version = %s", (version,), commit=True)
 
@@ -1129,8 +3383,7 @@ def download_version(version):
 @admin_required
 def update_status_success():
     try:
-        response = execute_query("SELECT employee_id, device_id, version, last_attempted_at FROM device_update_status WHERE status = 'success'")
-        return jsonify(response.get("data", [])), 200
+        return jsonify(query_update_statuses(request.args, status='success')), 200
     except Exception as e:
         logger.error(f"Error fetching successful updates: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1141,8 +3394,7 @@ def update_status_success():
 @admin_required
 def update_status_pending():
     try:
-        response = execute_query("SELECT employee_id, device_id, version, last_attempted_at FROM device_update_status WHERE status = 'pending'")
-        return jsonify(response.get("data", [])), 200
+        return jsonify(query_update_statuses(request.args, status='pending')), 200
     except Exception as e:
         logger.error(f"Error fetching pending updates: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1153,8 +3405,7 @@ def update_status_pending():
 @admin_required
 def update_status_failed():
     try:
-        response = execute_query("SELECT employee_id, device_id, version, last_attempted_at, error_message FROM device_update_status WHERE status = 'failed'")
-        return jsonify(response.get("data", [])), 200
+        return jsonify(query_update_statuses(request.args, status='failed')), 200
     except Exception as e:
         logger.error(f"Error fetching failed updates: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1182,7 +3433,7 @@ def view_reactions(content_id):
     try:
         # Fixed: Select 'url', not 'image_url' twice!
         content_result = execute_query(
-            "SELECT title, text, image_url, url, type FROM scheduled_content WHERE id = %s",
+            "SELECT title, text, image_url, image_variants, url, type FROM scheduled_content WHERE id = %s",
             (content_id,), fetch=True
         )
         content_data = content_result.get("data", [])
@@ -1190,6 +3441,7 @@ def view_reactions(content_id):
             content = {'title': 'Not Found', 'text': '', 'image_url': None, 'url': None, 'type': 'text'}
         else:
             content = content_data[0]
+            pick_image_variant(content, 'webp')
 
         views_result = execute_query("""
             SELECT v.viewed_duration, v.timestamp, COALESCE(e.email, v.employee_id) as email
@@ -1518,10 +3770,18 @@ def monitor_devices():
         logging.debug(f"Cortex ip map keys: {list(cortex_ip_map.keys())}")
 
 
+        # Online/offline and last heartbeat come from the in-memory presence tracker, which is
+        # ahead of the table (heartbeats are flushed in batches, expiry is swept periodically)
+        presence = presence_tracker.snapshot()
+
         # Process devices with verification
         processed_devices = []
         for device in devices:
             employee_id = device['employee_id']
+            live = presence.get(employee_id)
+            if live:
+                device['status'] = live['status']
+                device['last_seen'] = live['last_seen'].strftime('%Y-%m-%d %H:%M:%S')
             hostname = (device.get('hostname') or '').lower().strip()
             # Prefer email from employees table, fallback to device email
             email = employee_map.get(employee_id, device.get('email', '')).lower().strip()
@@ -1570,6 +3830,317 @@ def monitor_devices():
         logging.error(f"Unexpected error in monitor_devices route: {str(e)}")
         return render_template('monitor_devices.html', active_devices=[], inactive_devices=[], error=f"Unexpected error: {str(e)}")
                     
+# ---------------------------------------------------------------------------
+# Chunked media uploads: create a session, PUT numbered chunks, finalize, then send_message
+# references the upload id. Chunks are streamed to INCOMING_DIR and hashed as they arrive; a
+# dropped connection resumes from GET /media_uploads/<id> (next_chunk).
+# ---------------------------------------------------------------------------
+MEDIA_UPLOAD_CHUNK_BYTES = int(os.getenv("MEDIA_UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+MEDIA_UPLOAD_MAX_BYTES = int(os.getenv("MEDIA_UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+MEDIA_UPLOAD_TTL_HOURS = int(os.getenv("MEDIA_UPLOAD_TTL_HOURS", "24"))   # open sessions idle this long are discarded
+MEDIA_UPLOAD_TYPES = {'video': ('mp4',), 'image': ('jpg', 'jpeg', 'png')}
+
+# Running SHA-256 per open upload (upload_id -> (hash, bytes hashed)). Per process: if a chunk lands
+# on another worker, or after a restart, the hash is rebuilt from the partial file once.
+_upload_hashers = {}
+_upload_hashers_lock = threading.Lock()
+
+
+def upload_part_path(upload_id):
+    return os.path.join(INCOMING_DIR, f"{upload_id}.part")
+
+
+def upload_state(upload):
+    return {
+        "upload_id": upload['id'],
+        "kind": upload['kind'],
+        "status": upload['status'],
+        "total_bytes": upload['total_bytes'],
+        "chunk_bytes": upload['chunk_bytes'],
+        "received_bytes": upload['received_bytes'],
+        "next_chunk": upload['received_bytes'] // upload['chunk_bytes'],
+        "chunk_count": -(-upload['total_bytes'] // upload['chunk_bytes']),
+        "sha256": upload['sha256']
+    }
+
+
+def read_media_upload(upload_id):
+    rows = execute_query("SELECT * FROM media_uploads WHERE id = %s", (upload_id,), fetch=True).get("data") or []
+    return rows[0] if rows else None
+
+
+def lock_media_upload(upload_id):
+    rows = execute_query("SELECT * FROM media_uploads WHERE id = %s FOR UPDATE", (upload_id,), fetch=True).get("data") or []
+    return rows[0] if rows else None
+
+
+def upload_hasher(upload_id, offset):
+    """A SHA-256 object holding exactly the first `offset` bytes of the upload."""
+    with _upload_hashers_lock:
+        entry = _upload_hashers.get(upload_id)
+    if entry and entry[1] == offset:
+        return entry[0].copy()
+    digest = hashlib.sha256()
+    if offset:
+        with open(upload_part_path(upload_id), 'rb') as part:
+            remaining = offset
+            while remaining:
+                chunk = part.read(min(MEDIA_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ValueError("Partial upload is shorter than recorded")
+                digest.update(chunk)
+                remaining -= len(chunk)
+    return digest
+
+
+def discard_upload_part(upload_id):
+    with _upload_hashers_lock:
+        _upload_hashers.pop(upload_id, None)
+    if os.path.exists(upload_part_path(upload_id)):
+        os.remove(upload_part_path(upload_id))
+
+
+def expire_media_uploads():
+    """Drop open sessions nobody has touched for MEDIA_UPLOAD_TTL_HOURS, with their partial files."""
+    rows = execute_query("""
+        SELECT id FROM media_uploads
+        WHERE status = 'open' AND updated_at < NOW() - INTERVAL %s HOUR
+    """, (MEDIA_UPLOAD_TTL_HOURS,), fetch=True).get("data") or []
+    for row in rows:
+        discard_upload_part(row['id'])
+        execute_query("UPDATE media_uploads SET status = 'aborted' WHERE id = %s AND status = 'open'", (row['id'],), commit=True)
+    if rows:
+        logging.info(f"Expired {len(rows)} abandoned media uploads")
+
+
+def attach_media_upload(upload_id, kind):
+    """
+    Hand a finalized upload's media reference to new content. The first attach takes over the
+    reference finalize acquired; attaching the same upload again takes another one.
+    """
+    with db_transaction():
+        upload = lock_media_upload(upload_id)
+        if not upload or upload['kind'] != kind or upload['status'] not in ('finalized', 'attached'):
+            raise ValueError(f"{kind.capitalize()} upload {upload_id} is not finalized")
+        objects = execute_query(
+            "SELECT ext FROM media_objects WHERE sha256 = %s FOR UPDATE", (upload['sha256'],), fetch=True
+        ).get("data") or []
+        if not objects:
+            raise ValueError(f"{kind.capitalize()} upload {upload_id} is no longer stored")
+        if upload['status'] == 'attached':
+            execute_query("UPDATE media_objects SET ref_count = ref_count + 1, last_acquired_at = NOW() WHERE sha256 = %s",
+                          (upload['sha256'],), commit=True)
+        else:
+            execute_query("UPDATE media_objects SET last_acquired_at = NOW() WHERE sha256 = %s", (upload['sha256'],), commit=True)
+            execute_query("UPDATE media_uploads SET status = 'attached' WHERE id = %s", (upload_id,), commit=True)
+    filename = f"{upload['sha256']}.{objects[0]['ext']}"
+    return {"url": media_url(kind, filename), "path": os.path.join(MEDIA_DIRS[kind][0], filename)}
+
+
+@app.route('/media_uploads', methods=['POST'])
+@login_required
+@admin_required
+def create_media_upload():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    filename = data.get('filename') or ''
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    try:
+        total_bytes = int(data.get('size') or 0)
+    except (TypeError, ValueError):
+        total_bytes = 0
+    if kind not in MEDIA_UPLOAD_TYPES or ext not in MEDIA_UPLOAD_TYPES[kind]:
+        return jsonify({"message": "Only MP4 videos and JPG/PNG images are supported"}), 400
+    if not 0 < total_bytes <= MEDIA_UPLOAD_MAX_BYTES:
+        return jsonify({"message": f"File size must be between 1 byte and {MEDIA_UPLOAD_MAX_BYTES} bytes"}), 400
+
+    try:
+        expire_media_uploads()
+        upload_id = str(uuid.uuid4())
+        execute_query("""
+            INSERT INTO media_uploads (id, kind, ext, filename, total_bytes, chunk_bytes, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (upload_id, kind, ext, filename[:255], total_bytes, MEDIA_UPLOAD_CHUNK_BYTES, session.get('user_email')), commit=True)
+        open(upload_part_path(upload_id), 'wb').close()
+        upload = execute_query("SELECT * FROM media_uploads WHERE id = %s", (upload_id,), fetch=True)["data"][0]
+        logging.info(f"Media upload {upload_id} created: {kind} {filename} ({total_bytes} bytes)")
+        return jsonify(upload_state(upload)), 201
+    except Exception as e:
+        logging.error(f"Error creating media upload: {e}")
+        return jsonify({"message": "Error creating upload"}), 500
+
+
+@app.route('/media_uploads/<upload_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_media_upload(upload_id):
+    upload = read_media_upload(upload_id)
+    if not upload:
+        return jsonify({"message": "Upload not found"}), 404
+    return jsonify(upload_state(upload))
+
+
+@app.route('/media_uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+@admin_required
+def put_media_upload_chunk(upload_id, index):
+    """
+    Chunk `index` covers bytes [index * chunk_bytes, ...) and must be sent in order. Re-sending a
+    chunk the server already has is a no-op, so a client that lost the response can simply retry.
+    The body is spooled to disk with no DB connection held; only appending it to the partial file
+    and bumping received_bytes happen under the row lock.
+    """
+    spool_path = None
+    try:
+        upload = read_media_upload(upload_id)
+        if not upload:
+            return jsonify({"message": "Upload not found"}), 404
+        if upload['status'] != 'open':
+            return jsonify({"message": f"Upload is {upload['status']}", **upload_state(upload)}), 409
+        expected = upload['received_bytes'] // upload['chunk_bytes']
+        if index < expected:
+            return jsonify(upload_state(upload))
+        if index > expected or upload['received_bytes'] >= upload['total_bytes']:
+            return jsonify({"message": f"Expected chunk {expected}", **upload_state(upload)}), 409
+
+        offset = upload['received_bytes']
+        length = min(upload['chunk_bytes'], upload['total_bytes'] - offset)
+        if request.content_length is not None and request.content_length != length:
+            return jsonify({"message": f"Chunk {index} must be {length} bytes", **upload_state(upload)}), 400
+
+        # A slow client must not pin a pooled connection while its body trickles in
+        release_request_connection()
+        digest = upload_hasher(upload_id, offset)
+        spool_path = os.path.join(INCOMING_DIR, f"{upload_id}.{index}.{uuid.uuid4().hex}.chunk")
+        written = 0
+        with open(spool_path, 'wb') as spool:
+            while written < length:
+                chunk = request.stream.read(min(MEDIA_CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                spool.write(chunk)
+                written += len(chunk)
+        if written < length:
+            return jsonify({"message": f"Chunk {index} incomplete ({written}/{length} bytes)", **upload_state(upload)}), 400
+
+        with db_transaction():
+            upload = lock_media_upload(upload_id)
+            if not upload or upload['status'] != 'open':
+                return jsonify({"message": "Upload is no longer open"}), 409
+            if upload['received_bytes'] != offset:
+                # A concurrent retry of the same chunk got there first
+                if upload['received_bytes'] > offset:
+                    return jsonify(upload_state(upload))
+                return jsonify({"message": f"Expected chunk {upload['received_bytes'] // upload['chunk_bytes']}",
+                                **upload_state(upload)}), 409
+            with open(upload_part_path(upload_id), 'r+b') as part, open(spool_path, 'rb') as spool:
+                # Drop whatever a previously interrupted attempt left past the last complete chunk
+                part.truncate(offset)
+                part.seek(offset)
+                shutil.copyfileobj(spool, part, MEDIA_CHUNK_SIZE)
+            upload['received_bytes'] = offset + written
+            execute_query("UPDATE media_uploads SET received_bytes = %s WHERE id = %s",
+                          (upload['received_bytes'], upload_id), commit=True)
+        with _upload_hashers_lock:
+            _upload_hashers[upload_id] = (digest, upload['received_bytes'])
+        return jsonify(upload_state(upload))
+    except Exception as e:
+        logging.error(f"Error writing chunk {index} of upload {upload_id}: {e}")
+        return jsonify({"message": "Error writing chunk"}), 500
+    finally:
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+@app.route('/media_uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+@admin_required
+def finalize_media_upload(upload_id):
+    """
+    Check the upload is complete (and matches the client's sha256, if sent) and publish it to the
+    media store. Hashing and publishing run without the upload's row lock: the partial file is first
+    renamed to a private path, so only one finalize can publish it, and the status is then flipped in
+    a short transaction (handing the reference back if the upload was aborted meanwhile).
+    """
+    expected_sha = ((request.get_json(silent=True) or {}).get('sha256') or '').lower() or None
+    staged_path = None
+    try:
+        upload = read_media_upload(upload_id)
+        if not upload:
+            return jsonify({"message": "Upload not found"}), 404
+        if upload['status'] in ('finalized', 'attached'):
+            return jsonify(upload_state(upload))
+        if upload['status'] != 'open' or upload['received_bytes'] != upload['total_bytes']:
+            return jsonify({"message": "Upload is not complete", **upload_state(upload)}), 409
+        release_request_connection()
+
+        staged_path = f"{upload_part_path(upload_id)}.{uuid.uuid4().hex}.final"
+        try:
+            os.replace(upload_part_path(upload_id), staged_path)
+        except FileNotFoundError:
+            staged_path = None
+            return jsonify({"message": "Upload is already being finalized", **upload_state(upload)}), 409
+        with _upload_hashers_lock:
+            entry = _upload_hashers.pop(upload_id, None)
+        if entry and entry[1] == upload['total_bytes']:
+            sha256 = entry[0].hexdigest()
+        else:
+            digest = hashlib.sha256()
+            with open(staged_path, 'rb') as staged:
+                for chunk in iter(lambda: staged.read(MEDIA_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+
+        if expected_sha and expected_sha != sha256:
+            os.remove(staged_path)
+            staged_path = None
+            execute_query("UPDATE media_uploads SET status = 'aborted' WHERE id = %s AND status = 'open'",
+                          (upload_id,), commit=True)
+            return jsonify({"message": "Checksum mismatch, upload discarded"}), 422
+
+        stored = publish_media_file(staged_path, upload['kind'], upload['ext'], sha256, upload['total_bytes'])
+        staged_path = None
+        with db_transaction():
+            upload = lock_media_upload(upload_id)
+            if upload and upload['status'] == 'open':
+                execute_query("UPDATE media_uploads SET status = 'finalized', sha256 = %s WHERE id = %s",
+                              (sha256, upload_id), commit=True)
+                upload.update(status='finalized', sha256=sha256)
+            else:
+                release_media([stored['url']])
+                return jsonify({"message": "Upload was aborted"}), 409
+        return jsonify(upload_state(upload))
+    except Exception as e:
+        logging.error(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({"message": "Error finalizing upload"}), 500
+    finally:
+        # Not published: put the partial file back so the client can retry finalize
+        if staged_path and os.path.exists(staged_path):
+            os.replace(staged_path, upload_part_path(upload_id))
+
+
+@app.route('/media_uploads/<upload_id>', methods=['DELETE'])
+@login_required
+@admin_required
+def abort_media_upload(upload_id):
+    try:
+        with db_transaction():
+            upload = lock_media_upload(upload_id)
+            if not upload:
+                return jsonify({"message": "Upload not found"}), 404
+            if upload['status'] == 'attached':
+                return jsonify({"message": "Upload is already used by a message"}), 409
+            if upload['status'] == 'finalized':
+                release_media([media_url(upload['kind'], f"{upload['sha256']}.{upload['ext']}")])
+            execute_query("UPDATE media_uploads SET status = 'aborted' WHERE id = %s", (upload_id,), commit=True)
+        discard_upload_part(upload_id)
+        return jsonify({"message": "Aborted"})
+    except Exception as e:
+        logging.error(f"Error aborting upload {upload_id}: {e}")
+        return jsonify({"message": "Error aborting upload"}), 500
+
+
 @app.route('/send_message', methods=['POST'])
 @login_required
 @admin_required
@@ -1622,71 +4193,56 @@ def send_message():
         else:
             scheduled_time = datetime.now(timezone.utc)
 
+        try:
+            rollout = parse_rollout(request.form)
+        except ValueError as e:
+            logging.error(f"Invalid rollout settings: {e}")
+            return jsonify({"message": str(e)}), 400
+
 
         video_url = None
-        if 'video' in request.files and request.files['video'].filename:
+        if request.form.get('video_upload_id'):
+            try:
+                video_url = attach_media_upload(request.form['video_upload_id'], 'video')['url']
+            except ValueError as e:
+                logging.error(f"Invalid video upload: {e}")
+                return jsonify({"message": str(e)}), 400
+        elif 'video' in request.files and request.files['video'].filename:
             video = request.files['video']
             if not video.filename.lower().endswith('.mp4'):
                 logging.error("Invalid video format. Only MP4 supported")
                 return jsonify({"message": "Only MP4 videos are supported"}), 400
             
-            video_id = str(uuid.uuid4())
-            video_filename = secure_filename(f"{video_id}.mp4")
-            video_path = os.path.join(VIDEO_DIR, video_filename)
-            
             try:
-                retries = 3
-                for attempt in range(retries):
-                    try:
-                        video.save(video_path)
-                        if not verify_file(VIDEO_DIR, video_filename):
-                            raise Exception(f"Video save verification failed for {video_filename}")
-                        video_url = f"{SERVER_URL}/uploads/message/videos/{video_filename}"
-                        logging.info(f"Video saved successfully: {video_url}")
-                        break
-                    except Exception as e:
-                        logging.error(f"Video save attempt {attempt + 1} failed: {str(e)}")
-                        if attempt == retries - 1:
-                            if os.path.exists(video_path):
-                                os.remove(video_path)
-                            raise Exception(f"Failed to save video after {retries} attempts: {str(e)}")
-                        time.sleep(2)
+                video_url = store_media_upload(video, 'video', 'mp4')['url']
             except Exception as e:
                 logging.error(f"Video save failed: {str(e)}")
                 return jsonify({"message": f"Failed to save video: {str(e)}"}), 500
 
 
         image_url = None
-        if 'image' in request.files and request.files['image'].filename:
+        if request.form.get('image_upload_id'):
+            try:
+                attached_image = attach_media_upload(request.form['image_upload_id'], 'image')
+                image_url, image_path = attached_image['url'], attached_image['path']
+            except ValueError as e:
+                logging.error(f"Invalid image upload: {e}")
+                with db_transaction():
+                    release_media([video_url])
+                return jsonify({"message": str(e)}), 400
+        elif 'image' in request.files and request.files['image'].filename:
             image = request.files['image']
             if not image.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
                 logging.error("Invalid image format. Only JPG/PNG supported")
                 return jsonify({"message": "Only JPG/PNG images are supported"}), 400
             
-            image_id = str(uuid.uuid4())
-            image_ext = image.filename.rsplit('.', 1)[1].lower()
-            image_filename = secure_filename(f"{image_id}.{image_ext}")
-            image_path = os.path.join(IMAGE_DIR, image_filename)
-            
             try:
-                retries = 3
-                for attempt in range(retries):
-                    try:
-                        image.save(image_path)
-                        if not verify_file(IMAGE_DIR, image_filename):
-                            raise Exception(f"Image save verification failed for {image_filename}")
-                        image_url = f"{SERVER_URL}/uploads/message/images/{image_filename}"
-                        logging.info(f"Image saved successfully: {image_url}")
-                        break
-                    except Exception as e:
-                        logging.error(f"Image save attempt {attempt + 1} failed: {str(e)}")
-                        if attempt == retries - 1:
-                            if os.path.exists(image_path):
-                                os.remove(image_path)
-                            raise Exception(f"Failed to save image after {retries} attempts: {str(e)}")
-                        time.sleep(2)
+                stored_image = store_media_upload(image, 'image', image.filename.rsplit('.', 1)[1].lower())
+                image_url, image_path = stored_image['url'], stored_image['path']
             except Exception as e:
                 logging.error(f"Image save failed: {str(e)}")
+                with db_transaction():
+                    release_media([video_url])
                 return jsonify({"message": f"Failed to save image: {str(e)}"}), 500
         
         # Determine content type
@@ -1728,15 +4284,36 @@ def send_message():
             'employees': json.dumps(content['employees'])
         }, commit=True)
 
+        if rollout:
+            waves = plan_rollout_waves(content_id, valid_employees, scheduled_time, rollout)
+        else:
+            waves = [(scheduled_time, valid_employees)]
+        for release_time, wave_employees in waves:
+            insert_content_recipients(content_id, wave_employees, scheduled_time, display_at=release_time)
+
         logging.info(f"Content inserted successfully: {content['id']}")
 
-        if not send_now and scheduled_time > datetime.now(timezone.utc):
-            schedule_notification(content_id, scheduled_time, valid_employees)
+        if image_url:
+            image_worker.submit(content_id, image_path)
+
+        for release_time, wave_employees in waves:
+            if release_time - NOTIFICATION_LEAD > datetime.now(timezone.utc):
+                schedule_notification(content_id, release_time, wave_employees)
+            else:
+                send_notification(content_id, wave_employees)
+            schedule_content_event(content_id, release_time, wave_employees)
+
+        if rollout:
+            logging.info(f"Message rollout planned: {content_id}, {len(valid_employees)} employees in {len(waves)} waves "
+                         f"until {waves[-1][0].isoformat()}")
         else:
-            send_notification(content_id, valid_employees)
-        
-        logging.info(f"Message scheduled successfully: {content_id}, employees: {valid_employees}")
-        return jsonify({"message": "Message scheduled successfully", "content_id": content_id})
+            logging.info(f"Message scheduled successfully: {content_id}, employees: {valid_employees}")
+        return jsonify({
+            "message": "Message scheduled successfully",
+            "content_id": content_id,
+            "waves": [{"release_time": format_datetime_for_client(release_time), "recipients": len(wave_employees)}
+                      for release_time, wave_employees in waves],
+        })
     
     except mysql.connector.Error as e:
             logging.error(f"MySQL error in send_message: {e}")
@@ -1758,97 +4335,89 @@ def update_bulk_device_status():
             return jsonify({"message": "Invalid or missing data"}), 400
 
 
-        success_count = 0
+        # Validate and de-duplicate the submitted rows (last one wins, like the old per-row loop)
+        results = {}
+        requested = {}
         for update in data:
-            employee_id = update.get('employee_id')
-            
-            active_status = update.get('active_status')
-            if active_status is None:
+            employee_id = update.get('employee_id') if isinstance(update, dict) else None
+            active_status = update.get('active_status') if isinstance(update, dict) else None
+            if active_status is None and isinstance(update, dict):
                 active_status = update.get('status')
-            logging.debug(f"Processing update for employee_id: {employee_id}, active_status: {active_status}")
             if not employee_id or active_status is None:
                 logging.error(f"Missing required fields for employee_id: {employee_id}")
+                if employee_id:
+                    results[employee_id] = {"employee_id": employee_id, "result": "skipped", "reason": "missing active_status"}
                 continue
+            requested[employee_id] = 1 if active_status in [True, 1, '1', 'true'] else 0
+
+        with db_transaction():
+            # Step 1: one joined read for emails (required, NOT NULL) and any existing device rows
+            known = {}
+            for batch in batched(requested, RECIPIENT_BATCH_SIZE):
+                placeholders = ','.join(['%s'] * len(batch))
+                rows = execute_query(f"""
+                    SELECT e.id AS employee_id, e.email, ed.employee_id AS device_employee_id,
+                           ed.status, ed.app_running, ed.ip, ed.device_type, ed.hostname
+                    FROM employees e
+                    LEFT JOIN employee_devices ed ON ed.employee_id = e.id
+                    WHERE e.id IN ({placeholders})
+                """, tuple(batch), fetch=True).get("data", [])
+                for row in rows:
+                    known[row['employee_id']] = row
+
+            # Step 2: build every row in memory, keeping existing device fields where present
+            last_seen = datetime.now(timezone.utc).isoformat()
+            rows = []
+            for employee_id, active_status in requested.items():
+                row = known.get(employee_id)
+                if not row:
+                    logging.error(f"Employee {employee_id} not found in employees table")
+                    results[employee_id] = {"employee_id": employee_id, "result": "skipped", "reason": "employee not found"}
+                    continue
+                exists = row['device_employee_id'] is not None
+                rows.append((
+                    employee_id,
+                    row['status'] if exists and row['status'] else 'online',
+                    active_status,
+                    row['hostname'] if exists and row['hostname'] else 'unknown-host',
+                    row['email'],
+                    last_seen,
+                    row['app_running'] if exists and row['app_running'] is not None else False,
+                    row['ip'] if exists else None,
+                    row['device_type'] if exists else None
+                ))
+                results[employee_id] = {
+                    "employee_id": employee_id,
+                    "result": "updated" if exists else "created",
+                    "active_status": active_status
+                }
 
-
-            # Step 1: Fetch employee email (required for NOT NULL)
-            employee_result = execute_query(
-                "SELECT email FROM employees WHERE id = %s LIMIT 1",
-                (employee_id,),
-                fetch=True
-            )
-
-            if not employee_result.get("data"):
-                logging.error(f"Employee {employee_id} not found in employees table")
-                continue
-            
-            email = employee_result["data"][0]["email"]
-            logging.debug(f"Fetched email for {employee_id}: {email}")
-
-            # Step 2: Fetch existing device data (with safe check)
-            existing_result = execute_query("""
-                SELECT status, app_running, ip, device_type, hostname 
-                FROM employee_devices 
-                WHERE employee_id = %s 
-                LIMIT 1
-            """, (employee_id,), fetch=True)
-
-            existing_device = existing_result.get("data", [])
-
-            if existing_device:
-                existing = existing_device[0]
-                status = existing.get('status', 'online')
-                app_running = existing.get('app_running', False)
-                ip = existing.get('ip')
-                device_type = existing.get('device_type')
-                hostname = existing.get('hostname', 'unknown-host')  # Fallback if somehow null
-                logging.debug(f"Found existing device for {employee_id}: hostname={hostname}")
-            else:
-                # Defaults for new records (NO NULLs for required fields)
-                status = 'online'
-                app_running = False
-                ip = None  # Optional
-                device_type = None  # Optional
-                hostname = 'unknown-host'  # FIXED: Required, always string
-                logging.warning(f"No existing device for {employee_id}; using defaults, email={email}")
-
-
-            # Step 3: Build device_data with ALL required fields (no None for NOT NULL)
-            device_data = {
-                "employee_id": employee_id,
-                "status": status,  # NOT NULL
-                "active_status": 1 if active_status in [True, 1, '1', 'true'] else 0,  # NOT NULL
-                "hostname": hostname,  # NOT NULL, guaranteed string
-                "email": email,  # NOT NULL, from employees
-                "last_seen": datetime.now(timezone.utc).isoformat(),  # NOT NULL
-                "app_running": app_running,  # NOT NULL
-                # Optional fields (can be None)
-                "ip": ip,
-                "device_type": device_type,
-            }
-            # FIXED: DON'T filter None for required fields—only optionals if needed (but here, all required are set)
-
-            execute_query("""
-                INSERT INTO employee_devices 
-                    (employee_id, status, active_status, hostname, email, last_seen, app_running, ip, device_type)
-                VALUES 
-                    (%(employee_id)s, %(status)s, %(active_status)s, %(hostname)s, %(email)s, %(last_seen)s, %(app_running)s, %(ip)s, %(device_type)s)
-                ON DUPLICATE KEY UPDATE
-                    status = VALUES(status),
-                    active_status = VALUES(active_status),
-                    hostname = VALUES(hostname),
-                    email = VALUES(email),
-                    last_seen = VALUES(last_seen),
-                    app_running = VALUES(app_running),
-                    ip = VALUES(ip),
-                    device_type = VALUES(device_type)
-            """, device_data, commit=True)
-
-            success_count += 1
-            logging.info(f"Device status updated for employee: {employee_id} to active_status: {active_status}, hostname: {device_data.get('hostname')}, email: {email}")
-
-
-        return jsonify({"message": f"Bulk device status updated successfully ({success_count} devices)"})
+            # Step 3: one multi-row upsert per batch, all inside the same transaction
+            for batch in batched(rows, RECIPIENT_BATCH_SIZE):
+                placeholders = ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(batch))
+                execute_query(f"""
+                    INSERT INTO employee_devices 
+                        (employee_id, status, active_status, hostname, email, last_seen, app_running, ip, device_type)
+                    VALUES {placeholders}
+                    ON DUPLICATE KEY UPDATE
+                        status = VALUES(status),
+                        active_status = VALUES(active_status),
+                        hostname = VALUES(hostname),
+                        email = VALUES(email),
+                        last_seen = VALUES(last_seen),
+                        app_running = VALUES(app_running),
+                        ip = VALUES(ip),
+                        device_type = VALUES(device_type)
+                """, tuple(value for row in batch for value in row), commit=True)
+
+        success_count = len(rows)
+        logging.info(f"Bulk device status: {success_count} devices written, {len(results) - success_count} skipped")
+        return jsonify({
+            "message": f"Bulk device status updated successfully ({success_count} devices)",
+            "updated": success_count,
+            "skipped": len(results) - success_count,
+            "results": list(results.values())
+        })
     except mysql.connector.Error as e:
         logging.error(f"MySQL error updating bulk device status: {e}")
         return jsonify({"message": f"Database error: {e}"}), 500
@@ -1856,89 +4425,237 @@ def update_bulk_device_status():
         logging.error(f"Unexpected error updating bulk device status: {str(e)}")
         return jsonify({"message": f"Unexpected error: {str(e)}"}), 500
     
+def make_etag(*parts):
+    """Short, stable ETag value from the pieces of state a response depends on."""
+    return hashlib.sha1("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()[:24]
+
+def not_modified(etag):
+    """304 reply for a conditional GET whose If-None-Match still matches."""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+def employee_content_etag(employee_id):
+    """
+    Version token for /content/<employee_id>: changes whenever content comes due (or is deferred),
+    a notification is stamped, image variants are recorded for due content, or a reaction on the
+    employee's content changes.
+    Returns None for unknown employees so the caller falls through to its normal 404.
+    """
+    result = execute_query("""
+        SELECT
+            (SELECT COUNT(*) FROM employees WHERE id = %s) AS employee_exists,
+            (SELECT CONCAT(COUNT(*), '/', COALESCE(MAX(display_at), '-'))
+               FROM content_recipients
+               WHERE employee_id = %s AND display_at <= NOW()) AS content_state,
+            (SELECT COALESCE(MAX(notified_at), '-')
+               FROM content_recipients
+               WHERE employee_id = %s) AS notified_state,
+            (SELECT COALESCE(MAX(sc.image_variants_at), '-')
+               FROM content_recipients cr
+               JOIN scheduled_content sc ON sc.id = cr.content_id
+               WHERE cr.employee_id = %s AND cr.display_at <= NOW()) AS variants_state,
+            (SELECT CONCAT(COUNT(*), '/', COALESCE(MAX(r.timestamp), '-'), '/', COALESCE(SUM(r.reaction + 0), 0))
+               FROM content_recipients cr
+               JOIN reactions r ON r.content_id = cr.content_id
+               WHERE cr.employee_id = %s AND cr.display_at <= NOW()) AS reaction_state
+    """, (employee_id, employee_id, employee_id, employee_id, employee_id), fetch=True)
+    rows = result.get("data") or []
+    if not rows or not rows[0]['employee_exists']:
+        return None
+    row = rows[0]
+    return make_etag('content', employee_id, row['content_state'], row['notified_state'],
+                     row['variants_state'], row['reaction_state'])
+
+# /content?since= cursors are re-read with this much overlap, so rows committed a moment after
+# the previous poll (e.g. send_now content written in the same second) are never skipped.
+# Clients de-duplicate by content id.
+CONTENT_CURSOR_OVERLAP = timedelta(seconds=60)
+
+def parse_content_cursor(since):
+    """Turn a /content `since` cursor into a naive UTC datetime (with overlap), or None to do a full sync."""
+    if not since:
+        return None
+    try:
+        since_dt = parser.isoparse(since)
+    except (ValueError, OverflowError):
+        logging.warning(f"Ignoring invalid content cursor: {since}")
+        return None
+    if since_dt.tzinfo is not None:
+        since_dt = since_dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return since_dt - CONTENT_CURSOR_OVERLAP
+
+def format_reaction_counts(counts):
+    return {
+        'like': int(counts.get('like_count') or 0),
+        'unlike': int(counts.get('unlike_count') or 0),
+        'heart': int(counts.get('heart_count') or 0),
+        'cry': int(counts.get('cry_count') or 0)
+    }
+
 @app.route('/content/<employee_id>', methods=['GET'])
 def get_content(employee_id):
     try:
         logging.debug(f"Fetching content for employee_id: {employee_id}")
 
-        # Get content visible to this employee and already scheduled
-        # FIRST: Verify employee exists
-        emp_check = execute_query("SELECT id FROM employees WHERE id = %s", (employee_id,), fetch=True)
-        if not emp_check.get("data"):
-            return jsonify({"message": "User not found"}), 404
-
-        content_result = execute_query("""
-            SELECT id, type, title, text, image_url, url, scheduled_time, employees
-            FROM scheduled_content
-            WHERE JSON_CONTAINS(employees, %s)
-              AND scheduled_time <= NOW()
-            ORDER BY scheduled_time DESC
-        """, (json.dumps([employee_id]),), fetch=True)
+        # The token describes the employee's whole state, so a match means "nothing changed",
+        # whatever cursor the client is on
+        # ?image=webp|display|thumb|original picks the image variant each item's image_url points at
+        image_preference = request.args.get('image', 'display')
+        etag = employee_content_etag(employee_id)
+        if etag:
+            etag = make_etag(etag, image_preference)
+        if etag and request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        since = parse_content_cursor(request.args.get('since'))
+
+        # Content that is due for this employee: display_at is scheduled_time, or the display_time
+        # of the delay they picked (see plan_delivery). LEFT JOIN from employees so the same round
+        # trip tells us whether the employee exists (no row at all -> unknown user). NOW() and the
+        # next wake-up are read in the same statement so the cursor lines up with what was returned.
+        content_query = """
+            SELECT e.id AS employee_id, NOW() AS server_now,
+                   (SELECT MIN(nx.display_at) FROM content_recipients nx
+                     WHERE nx.employee_id = e.id AND nx.display_at > NOW()) AS next_wakeup,
+                   sc.id, sc.type, sc.title, sc.text, sc.image_url, sc.image_variants, sc.url,
+                   sc.scheduled_time, sc.employees,
+                   mp.delay_choice, mp.display_time
+            FROM employees e
+            LEFT JOIN content_recipients cr
+                   ON cr.employee_id = e.id AND cr.display_at <= NOW() {since_filter}
+            LEFT JOIN scheduled_content sc ON sc.id = cr.content_id
+            LEFT JOIN message_preferences mp ON mp.employee_id = cr.employee_id AND mp.content_id = cr.content_id
+            WHERE e.id = %s
+            ORDER BY cr.scheduled_time DESC
+        """
+        if since:
+            # Items that came due since the cursor, plus older ones whose image variants were recorded since
+            content_result = execute_query(content_query.format(since_filter="""
+                AND (cr.display_at >= %s OR cr.content_id IN (
+                    SELECT id FROM scheduled_content WHERE image_variants_at >= %s))"""),
+                (since, since, employee_id), fetch=True)
+        else:
+            content_result = execute_query(content_query.format(since_filter=""), (employee_id,), fetch=True)
 
-        employee_content = content_result.get("data", []) or []
+        rows = content_result.get("data", []) or []
+        if not rows:
+            return jsonify({"message": "User not found"}), 404
+        cursor = format_datetime_for_client(rows[0]['server_now'])
+        next_wakeup = format_datetime_for_client(rows[0]['next_wakeup'])
+        employee_content = [row for row in rows if row['id'] is not None]
+        # One lookup for every item's stored media, so clients can lay out and validate video and
+        # images without probing the files first
+        metadata = media_metadata([u for item in employee_content for u in (item['url'], item['image_url'])])
+        for item in employee_content:
+            item.pop('employee_id', None)
+            item.pop('server_now', None)
+            item.pop('next_wakeup', None)
+            # Clients no longer fetch /message_preferences per item; the planned delivery rides along
+            item['display_time'] = format_datetime_for_client(item['display_time'])
+            image_meta = metadata.get(item['image_url'])
+            variant = pick_image_variant(item, image_preference)
+            if variant:
+                image_meta = {
+                    "mime_type": MEDIA_MIME_TYPES.get(variant['url'].rsplit('.', 1)[-1].lower()),
+                    "bytes": variant.get('bytes'),
+                    "sha256": None,
+                    "width": variant.get('width'),
+                    "height": variant.get('height'),
+                    "duration_ms": None
+                }
+            item['media'] = {"video": metadata.get(item['url']), "image": image_meta}
+
+        # Reaction counts and the user's own reaction in one aggregated query. On a full sync this
+        # covers every visible item; with a cursor only items whose reactions changed since then.
+        reactions_query = """
+            SELECT r.content_id,
+                   SUM(r.reaction = 'like') AS like_count,
+                   SUM(r.reaction = 'unlike') AS unlike_count,
+                   SUM(r.reaction = 'heart') AS heart_count,
+                   SUM(r.reaction = 'cry') AS cry_count,
+                   MAX(CASE WHEN r.employee_id = %s THEN r.reaction END) AS user_reaction
+            FROM content_recipients cr
+            JOIN reactions r ON r.content_id = cr.content_id
+            WHERE cr.employee_id = %s
+              AND cr.display_at <= NOW() {since_filter}
+            GROUP BY r.content_id
+        """
+        if since:
+            reactions_result = execute_query(reactions_query.format(
+                since_filter="AND cr.content_id IN (SELECT content_id FROM reactions WHERE timestamp >= %s)"),
+                (employee_id, employee_id, since), fetch=True)
+        else:
+            reactions_result = execute_query(reactions_query.format(since_filter=""),
+                                             (employee_id, employee_id), fetch=True)
+        reactions_map = {r['content_id']: r for r in reactions_result.get("data", []) or []}
 
-        # CRITICAL FIX: Format scheduled_time properly and fetch reactions
         for item in employee_content:
             if item['scheduled_time']:
                 item['scheduled_time'] = format_datetime_for_client(item['scheduled_time'])
             else:
                 item['scheduled_time'] = None
 
-            # Fetch reaction counts for this content
-            reaction_counts_res = execute_query("""
-                SELECT reaction, COUNT(*) as count 
-                FROM reactions 
-                WHERE content_id = %s 
-                GROUP BY reaction
-            """, (item['id'],), fetch=True)
-            
-            counts_list = reaction_counts_res.get("data", [])
-            counts_map = {r['reaction']: r['count'] for r in counts_list}
-            item['reaction_counts'] = {
-                'like': counts_map.get('like', 0),
-                'unlike': counts_map.get('unlike', 0),
-                'heart': counts_map.get('heart', 0),
-                'cry': counts_map.get('cry', 0)
+            counts = reactions_map.get(item['id'], {})
+            item['reaction_counts'] = format_reaction_counts(counts)
+            item['user_reaction'] = counts.get('user_reaction')
+
+        # Count changes for items the client already has
+        returned_ids = {item['id'] for item in employee_content}
+        reaction_updates = [
+            {
+                "id": content_id,
+                "reaction_counts": format_reaction_counts(counts),
+                "user_reaction": counts.get('user_reaction')
             }
-            
-            # Fetch current user's specific reaction (if any)
-            user_reaction_res = execute_query("""
-                SELECT reaction FROM reactions 
-                WHERE content_id = %s AND employee_id = %s 
-                LIMIT 1
-            """, (item['id'], employee_id), fetch=True)
-            user_react_data = user_reaction_res.get("data", [])
-            item['user_reaction'] = user_react_data[0]['reaction'] if user_react_data else None
+            for content_id, counts in reactions_map.items()
+            if since and content_id not in returned_ids
+        ]
 
-        # Notifications (last 7 days)
+        # Notifications (last 7 days, or since the cursor) - the index on (employee_id, notified_at)
+        # narrows the rows, JSON_CONTAINS only re-checks the handful that are left
+        notif_since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=7)
+        if since and since > notif_since:
+            notif_since = since
         notif_result = execute_query("""
-            SELECT *
-            FROM notifications
-            WHERE JSON_CONTAINS(employees, %s)
-              AND time >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-            ORDER BY time DESC
-        """, (json.dumps([employee_id]),), fetch=True)
+            SELECT n.*, sc.title AS content_title, sc.text AS content_text
+            FROM content_recipients cr
+            JOIN notifications n ON n.content_id = cr.content_id
+            JOIN scheduled_content sc ON sc.id = cr.content_id
+            WHERE cr.employee_id = %s
+              AND cr.notified_at >= %s
+              AND n.time >= %s
+              AND JSON_CONTAINS(n.employees, %s)
+            ORDER BY n.time DESC
+        """, (employee_id, notif_since, notif_since, json.dumps([employee_id])), fetch=True)
 
         employee_notifications = notif_result.get("data", []) or []
 
         # Add readable text to notifications
         for notif in employee_notifications:
-            content = next((c for c in employee_content if c['id'] == notif['content_id']), None)
-            if content:
-                notif['text'] = f"New content: {content.get('title', 'No title')} - {content.get('text', 'No text')}"
+            title = notif.pop('content_title', None)
+            text = notif.pop('content_text', None)
+            if title is not None:
+                notif['text'] = f"New content: {title or 'No title'} - {text or 'No text'}"
             else:
                 notif['text'] = f"Notification at {notif.get('time', 'unknown time')}"
 
-        logging.info(f"Returning {len(employee_content)} contents for employee {employee_id}")
-        return jsonify({
+        logging.info(f"Returning {len(employee_content)} contents and {len(reaction_updates)} reaction updates for employee {employee_id}")
+        response = jsonify({
             "content": employee_content,
-            "notifications": employee_notifications
+            "notifications": employee_notifications,
+            "reaction_updates": reaction_updates,
+            "cursor": cursor,
+            "next_wakeup": next_wakeup
         })
+        if etag:
+            response.set_etag(etag)
+        return response
 
     except Exception as e:
         logging.error(f"Error in get_content for {employee_id}: {str(e)}", exc_info=True)
         return jsonify({"content": [], "notifications": []}), 500
-                    
+
 @app.route('/devices')
 @login_required
 @admin_required
@@ -2113,19 +4830,21 @@ def set_message_delay():
             display_time = display_time.replace(tzinfo=local_tz)
         display_time_utc = display_time.astimezone(timezone.utc)
 
-        # Save to DB
-        execute_query("""
-            INSERT INTO message_preferences (employee_id, content_id, delay_choice, display_time)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                delay_choice = VALUES(delay_choice),
-                display_time = VALUES(display_time)
-        """, (
-            employee_id,
-            content_id,
-            delay_choice,
-            display_time_utc.strftime('%Y-%m-%d %H:%M:%S')
-        ), commit=True)
+        # Save to DB, and move the recipient's slot in the delivery plan with it
+        with db_transaction():
+            execute_query("""
+                INSERT INTO message_preferences (employee_id, content_id, delay_choice, display_time)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    delay_choice = VALUES(delay_choice),
+                    display_time = VALUES(display_time)
+            """, (
+                employee_id,
+                content_id,
+                delay_choice,
+                display_time_utc.strftime('%Y-%m-%d %H:%M:%S')
+            ), commit=True)
+            plan_delivery(employee_id, content_id, display_time_utc)
 
         logging.info(f"Delay set successfully: {employee_id} → {content_id} → {delay_choice}")
         return jsonify({"message": "Delay set successfully"})
@@ -2147,8 +4866,16 @@ def get_message_preference(employee_id, content_id):
 
         preference = preference_result.get("data", [])
 
+        # A single primary-key row, so hash it directly rather than keeping a separate token
+        etag = make_etag('preference', employee_id, content_id,
+                         *((preference[0]['delay_choice'], preference[0]['display_time']) if preference else ()))
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
         logging.info(f"Fetched preference for employee {employee_id}, content {content_id}: {preference}")
-        return jsonify({"preference": preference[0] if preference else {}})
+        response = jsonify({"preference": preference[0] if preference else {}})
+        response.set_etag(etag)
+        return response
     except mysql.connector.Error as e:
         logging.error(f"MySQL error fetching preference for employee {employee_id}, content {content_id}: {e}")
         return jsonify({"message": f"Error fetching preference: {e}", "preference": {}}), 500
@@ -2161,16 +4888,18 @@ def receive_feedback():
     try:
         data = request.json
         logging.debug(f"Received feedback data: {data}")
-        execute_query("""
-            INSERT INTO feedback 
-                (content_id, employee_id, feedback, timestamp)
-            VALUES 
-                (%s, %s, %s, NOW())
-        """, (
-            data['content_id'],
-            data['employee_id'],
-            data['feedback']
-        ), commit=True)
+        with db_transaction():
+            execute_query("""
+                INSERT INTO feedback 
+                    (content_id, employee_id, feedback, timestamp)
+                VALUES 
+                    (%s, %s, %s, NOW())
+            """, (
+                data['content_id'],
+                data['employee_id'],
+                data['feedback']
+            ), commit=True)
+            bump_content_stats(data['content_id'], feedback_count=1)
 
         logging.info(f"Feedback received for content: {data['content_id']} from employee: {data['employee_id']}")
        
@@ -2197,73 +4926,180 @@ def record_reaction():
             return jsonify({"message": "Invalid reaction type"}), 400
 
 
-        # Check if a reaction already exists for this content_id and employee_id
+        try:
+            apply_reaction(content_id, employee_id, reaction)
+        except mysql.connector.Error as e:
+            if "Duplicate entry" not in str(e):
+                raise
+            # Another request inserted this employee's reaction concurrently - its row exists now
+            logging.warning(f"Duplicate reaction entry detected for content_id {content_id}, employee_id {employee_id}. Retrying update.")
+            apply_reaction(content_id, employee_id, reaction)
+        logging.info(f"Reaction recorded: {reaction} for content_id {content_id}, employee_id {employee_id}")
+
+        publish_reaction_event(content_id)
+
+        return jsonify({"message": "Reaction recorded successfully"})
+    except mysql.connector.Error as e:
+        logging.error(f"MySQL error recording reaction: {e}")
+        return jsonify({"message": f"Database error: {e}"}), 500
+    except Exception as e:
+        logging.error(f"Unexpected error recording reaction: {str(e)}")
+        return jsonify({"message": f"Unexpected error: {str(e)}"}), 500
+    
+def apply_reaction(content_id, employee_id, reaction):
+    """Insert or switch an employee's reaction and move the matching content_stats counters in one transaction."""
+    with db_transaction():
         existing_reaction = execute_query("""
-            SELECT id, reaction, timestamp 
+            SELECT id, reaction 
             FROM reactions 
             WHERE content_id = %s AND employee_id = %s 
             LIMIT 1
+            FOR UPDATE
         """, (content_id, employee_id), fetch=True).get("data", [])
 
         if existing_reaction:
-            # Update the existing reaction
-            reaction_id = existing_reaction[0]['id']
-
+            previous = existing_reaction[0]['reaction']
             execute_query("""
                 UPDATE reactions 
                 SET reaction = %s, timestamp = NOW()
                 WHERE id = %s
-            """, (reaction, reaction_id), commit=True)
+            """, (reaction, existing_reaction[0]['id']), commit=True)
+            if previous != reaction:
+                deltas = {f"{reaction}_count": 1}
+                if f"{previous}_count" in CONTENT_STATS_COUNTERS:
+                    deltas[f"{previous}_count"] = -1
+                bump_content_stats(content_id, **deltas)
+        else:
+            execute_query("""
+                INSERT INTO reactions 
+                    (id, content_id, employee_id, reaction, timestamp)
+                VALUES 
+                    (%s, %s, %s, %s, %s)
+            """, (
+                str(uuid.uuid4()),
+                content_id,
+                employee_id,
+                reaction,
+                datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            ), commit=True)
+            bump_content_stats(content_id, **{f"{reaction}_count": 1})
+
+
+def connected_recipients(content_id, due_only=False):
+    """Recipients of content_id that currently have an SSE stream open (only those it is due for, if due_only)."""
+    connected = event_broker.connected_employee_ids()
+    recipients = []
+    due_filter = "AND display_at <= NOW()" if due_only else ""
+    for batch in batched(connected, RECIPIENT_BATCH_SIZE):
+        placeholders = ','.join(['%s'] * len(batch))
+        rows = execute_query(
+            f"SELECT employee_id FROM content_recipients WHERE content_id = %s {due_filter} AND employee_id IN ({placeholders})",
+            (content_id, *batch),
+            fetch=True
+        ).get("data", []) or []
+        recipients.extend(row['employee_id'] for row in rows)
+    return recipients
 
-            logging.info(f"Reaction updated: {reaction} for content_id {content_id}, employee_id {employee_id}")
 
-        else:
-            # Insert a new reaction if none exists
-            try:
-                execute_query("""
-                    INSERT INTO reactions 
-                        (id, content_id, employee_id, reaction, timestamp)
-                    VALUES 
-                        (%s, %s, %s, %s, %s)
-                """, (
-                    str(uuid.uuid4()),
-                    content_id,
-                    employee_id,
-                    reaction,
-                    datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-                ), commit=True)
+def publish_reaction_event(content_id):
+    """Push fresh counts to the content's recipients that currently have an SSE stream open."""
+    try:
+        recipients = connected_recipients(content_id)
+        if not recipients:
+            return
+        counts = execute_query("""
+            SELECT SUM(reaction = 'like') AS like_count,
+                   SUM(reaction = 'unlike') AS unlike_count,
+                   SUM(reaction = 'heart') AS heart_count,
+                   SUM(reaction = 'cry') AS cry_count
+            FROM reactions
+            WHERE content_id = %s
+        """, (content_id,), fetch=True).get("data") or [{}]
+        event_broker.publish('reactions', {"content_id": content_id, "reaction_counts": format_reaction_counts(counts[0])}, recipients)
+    except Exception as e:
+        logging.error(f"Error publishing reaction event for content_id {content_id}: {str(e)}")
 
-            except mysql.connector.Error as e:
-                if "Duplicate entry" in str(e):
-                    logging.warning(f"Duplicate reaction entry detected for content_id {content_id}, employee_id {employee_id}. Retrying update.")
-                    # If a duplicate entry error occurs, it means another reaction was inserted concurrently
-                    existing_reaction = execute_query("""
-                        SELECT id 
-                        FROM reactions 
-                        WHERE content_id = %s AND employee_id = %s 
-                        LIMIT 1
-                    """, (content_id, employee_id), fetch=True).get("data", [])
-                    if existing_reaction:
-                        reaction_id = existing_reaction[0]['id']
-                        execute_query("""
-                            UPDATE reactions 
-                            SET reaction = %s, timestamp = NOW()
-                            WHERE id = %s
-                        """, (reaction, reaction_id), commit=True)
-                        logging.info(f"Reaction updated after duplicate entry: {reaction} for content_id {content_id}, employee_id {employee_id}")
-                else:
-                    raise
-            logging.info(f"Reaction recorded: {reaction} for content_id {content_id}, employee_id {employee_id}")
 
+@app.route('/events/<employee_id>', methods=['GET'])
+def stream_events(employee_id):
+    """SSE stream of 'content', 'notification' and 'reactions' events for one employee."""
+    try:
+        emp_check = execute_query("SELECT id FROM employees WHERE id = %s", (employee_id,), fetch=True)
+        if not emp_check.get("data"):
+            return jsonify({"message": "User not found"}), 404
+    except Exception as e:
+        logging.error(f"Error opening event stream for {employee_id}: {str(e)}")
+        return jsonify({"message": "Event stream unavailable"}), 503
 
-        return jsonify({"message": "Reaction recorded successfully"})
-    except mysql.connector.Error as e:
-        logging.error(f"MySQL error recording reaction: {e}")
-        return jsonify({"message": f"Database error: {e}"}), 500
+    # Don't pin a pooled connection for the lifetime of the stream
+    release_request_connection()
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    sub, replay, needs_resync = event_broker.subscribe(employee_id, last_event_id)
+    logging.info(f"SSE stream opened for {employee_id} (last_event_id={last_event_id}, replay={len(replay)}, resync={needs_resync})")
+
+    def generate():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            if needs_resync:
+                yield EventBroker.format_frame('resync', {})
+            for frame in replay:
+                yield frame
+            while True:
+                if sub.overflowed:
+                    # Client fell too far behind - have it do a normal /content sync instead
+                    sub.overflowed = False
+                    yield EventBroker.format_frame('resync', {})
+                try:
+                    frame = sub.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield frame
+        finally:
+            event_broker.unsubscribe(sub)
+            logging.info(f"SSE stream closed for {employee_id}")
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/db/pool_stats', methods=['GET'])
+@login_required
+@admin_required
+def db_pool_stats():
+    if db_pool is None:
+        return jsonify({"message": "Pool not initialised"}), 503
+    return jsonify(db_pool.stats())
+
+
+@app.route('/scheduler/stats', methods=['GET'])
+@login_required
+@admin_required
+def scheduler_stats():
+    return jsonify(notification_scheduler.stats())
+
+
+@app.route('/rollout/<content_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_rollout_progress(content_id):
+    try:
+        return jsonify(rollout_progress(content_id))
     except Exception as e:
-        logging.error(f"Unexpected error recording reaction: {str(e)}")
-        return jsonify({"message": f"Unexpected error: {str(e)}"}), 500
-    
+        logging.error(f"Error reading rollout progress for {content_id}: {str(e)}")
+        return jsonify({"message": "Error reading rollout progress"}), 500
+
+
+@app.route('/events/stats', methods=['GET'])
+@login_required
+@admin_required
+def event_stats():
+    return jsonify(event_broker.stats())
+
+
 @app.route('/update_device_status', methods=['POST'])
 def update_device_status():
     try:
@@ -2383,42 +5219,45 @@ def record_view():
             logging.error("Missing required fields in record_view: content_id or employee_id")
             return jsonify({"message": "Missing required fields"}), 400
         
-        # Check if view already exists
-        existing_view = execute_query("""
-            SELECT id, viewed_duration 
-            FROM views 
-            WHERE content_id = %s AND employee_id = %s 
-            LIMIT 1
-        """, (content_id, employee_id), fetch=True).get("data", [])
+        with db_transaction():
+            # Check if view already exists
+            existing_view = execute_query("""
+                SELECT id, viewed_duration 
+                FROM views 
+                WHERE content_id = %s AND employee_id = %s 
+                LIMIT 1
+                FOR UPDATE
+            """, (content_id, employee_id), fetch=True).get("data", [])
 
-        if existing_view:
-            # Update existing view with new duration (e.g., max of current and new duration)
-            current_duration = existing_view[0]['viewed_duration']
-            new_duration = max(current_duration, viewed_duration)  # Keep longest duration
-            execute_query("""
-                UPDATE views 
-                SET viewed_duration = %s, timestamp = NOW()
-                WHERE id = %s
-            """, (new_duration, existing_view[0]['id']), commit=True)
+            if existing_view:
+                # Update existing view with new duration (e.g., max of current and new duration)
+                current_duration = existing_view[0]['viewed_duration']
+                new_duration = max(current_duration, viewed_duration)  # Keep longest duration
+                execute_query("""
+                    UPDATE views 
+                    SET viewed_duration = %s, timestamp = NOW()
+                    WHERE id = %s
+                """, (new_duration, existing_view[0]['id']), commit=True)
 
-            logging.info(f"Updated view for content_id {content_id} by employee_id {employee_id} with duration {new_duration}")
+                logging.info(f"Updated view for content_id {content_id} by employee_id {employee_id} with duration {new_duration}")
 
-            
-        else:
-            # Insert new view
-            execute_query("""
-                INSERT INTO views 
-                    (id, content_id, employee_id, viewed_duration, timestamp)
-                VALUES 
-                    (%s, %s, %s, %s, NOW())
-            """, (
-                str(uuid.uuid4()),
-                content_id,
-                employee_id,
-                viewed_duration
-            ), commit=True)
+                
+            else:
+                # Insert new view - first view by this employee, so it counts towards unique views
+                execute_query("""
+                    INSERT INTO views 
+                        (id, content_id, employee_id, viewed_duration, timestamp)
+                    VALUES 
+                        (%s, %s, %s, %s, NOW())
+                """, (
+                    str(uuid.uuid4()),
+                    content_id,
+                    employee_id,
+                    viewed_duration
+                ), commit=True)
+                bump_content_stats(content_id, view_count=1)
 
-            logging.info(f"New view recorded for content_id {content_id} by employee_id {employee_id} with duration {viewed_duration}")
+                logging.info(f"New view recorded for content_id {content_id} by employee_id {employee_id} with duration {viewed_duration}")
 
         return jsonify({"message": "View recorded successfully"})
     except mysql.connector.Error as e:
@@ -2433,6 +5272,17 @@ def record_view():
 def get_employee_views(employee_id):
     try:
         logging.debug(f"Fetching views for employee_id: {employee_id}")
+
+        # Cheap aggregate over the (employee_id, timestamp, viewed_duration) index
+        state = execute_query("""
+            SELECT COUNT(*) AS view_count, MAX(timestamp) AS last_view, COALESCE(SUM(viewed_duration), 0) AS total_duration
+            FROM views
+            WHERE employee_id = %s
+        """, (employee_id,), fetch=True).get("data") or [{}]
+        etag = make_etag('views', employee_id, state[0].get('view_count'), state[0].get('last_view'), state[0].get('total_duration'))
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
         views_result = execute_query("""
             SELECT content_id, viewed_duration, timestamp 
             FROM views 
@@ -2443,7 +5293,9 @@ def get_employee_views(employee_id):
         views = views_result.get("data", []) or []
 
         logging.info(f"Fetched {len(views)} views for employee_id {employee_id}")
-        return jsonify({"views": views})
+        response = jsonify({"views": views})
+        response.set_etag(etag)
+        return response
     except mysql.connector.Error as e:
         logging.error(f"MySQL error fetching views for employee {employee_id}: {e}")
         return jsonify({"message": f"Error fetching views: {e}", "views": []}), 500
@@ -0,0 +1,82 @@
+import mysql.connector
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+
+def backfill_content_recipients():
+    """One-off: populate content_recipients from the scheduled_content.employees JSON arrays."""
+    try:
+        conn = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            database=MYSQL_DATABASE,
+            port=MYSQL_PORT
+        )
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS content_recipients (
+                content_id VARCHAR(36) NOT NULL,
+                employee_id VARCHAR(36) NOT NULL,
+                scheduled_time DATETIME NOT NULL,
+                display_at DATETIME NOT NULL,
+                notified_at DATETIME NULL,
+                PRIMARY KEY (content_id, employee_id),
+                FOREIGN KEY (content_id) REFERENCES scheduled_content(id) ON DELETE CASCADE,
+                INDEX idx_employee_time (employee_id, scheduled_time),
+                INDEX idx_employee_display (employee_id, display_at),
+                INDEX idx_employee_notified (employee_id, notified_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+
+        # 1. One row per (content, recipient) - INSERT IGNORE makes re-runs safe
+        cursor.execute("""
+            INSERT IGNORE INTO content_recipients (content_id, employee_id, scheduled_time, display_at)
+            SELECT sc.id, jt.employee_id, sc.scheduled_time, sc.scheduled_time
+            FROM scheduled_content sc,
+                 JSON_TABLE(sc.employees, '$[*]' COLUMNS (employee_id VARCHAR(36) PATH '$')) jt
+            WHERE jt.employee_id IS NOT NULL AND jt.employee_id != ''
+        """)
+        print(f"Inserted {cursor.rowcount} recipient rows.")
+
+        # 2. Carry over the latest notification time for each recipient
+        cursor.execute("""
+            UPDATE content_recipients cr
+            JOIN (
+                SELECT n.content_id, jt.employee_id, MAX(n.time) AS notified_at
+                FROM notifications n,
+                     JSON_TABLE(n.employees, '$[*]' COLUMNS (employee_id VARCHAR(36) PATH '$')) jt
+                GROUP BY n.content_id, jt.employee_id
+            ) latest ON latest.content_id = cr.content_id AND latest.employee_id = cr.employee_id
+            SET cr.notified_at = latest.notified_at
+            WHERE cr.notified_at IS NULL OR cr.notified_at < latest.notified_at
+        """)
+        print(f"Stamped notified_at on {cursor.rowcount} recipient rows.")
+
+        # 3. Delivery plan: recipients who already picked a delay are due at their display_time
+        cursor.execute("""
+            UPDATE content_recipients cr
+            JOIN message_preferences mp ON mp.content_id = cr.content_id AND mp.employee_id = cr.employee_id
+            SET cr.display_at = GREATEST(cr.scheduled_time, mp.display_time)
+        """)
+        print(f"Planned display_at for {cursor.rowcount} recipient rows.")
+
+        conn.commit()
+        print("content_recipients backfill complete.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if 'conn' in locals() and conn.is_connected():
+            cursor.close()
+            conn.close()
+
+if __name__ == "__main__":
+    backfill_content_recipients()
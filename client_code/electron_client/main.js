@@ -2,6 +2,7 @@ const { app, BrowserWindow, Tray, Menu, ipcMain, screen, dialog, net } = require
 const path = require('path');
 const fs = require('fs');
 const os = require('os');
+const crypto = require('crypto');
 const { exec, spawn } = require('child_process');
 
 let mainWindow;
@@ -71,44 +72,122 @@ function registerDevice() {
     request.end();
 }
 
+// ETag and body of the last /updates/manifest answer, so unchanged checks come back as 304
+let manifestCache = null;
+// Version currently being downloaded, so the hourly check does not start a second download
+let downloadingVersion = null;
+
 function checkForUpdates() {
     console.log("Checking for updates...");
-    const request = net.request(`${SERVER_URL}updates/version`);
+    const request = net.request(`${SERVER_URL}updates/manifest?device_id=${encodeURIComponent(hostname)}`);
+    if (manifestCache) request.setHeader('If-None-Match', manifestCache.etag);
     request.on('response', (response) => {
-        response.on('data', (chunk) => {
-            const remoteVersion = chunk.toString().trim();
-            console.log(`Current: ${APP_VERSION}, Remote: ${remoteVersion}`);
-
-            // Simple version check: if string differs and is not 'unknown'
-            if (remoteVersion && remoteVersion !== APP_VERSION && remoteVersion !== 'unknown') {
-                console.log("New version found! Initiating update...");
-
-                // Report pending
-                reportUpdateStatus(remoteVersion, 'pending');
-
-                // Start download
-                performUpdate(remoteVersion);
+        if (response.statusCode === 304 && manifestCache) {
+            handleManifest(manifestCache.manifest);
+            return;
+        }
+        if (response.statusCode !== 200) return;
+        const chunks = [];
+        response.on('data', (chunk) => chunks.push(chunk));
+        response.on('end', () => {
+            let manifest;
+            try {
+                manifest = JSON.parse(Buffer.concat(chunks).toString());
+            } catch (err) {
+                console.log("Invalid update manifest:", err.message);
+                return;
             }
+            const etag = response.headers['etag'];
+            if (etag) manifestCache = { etag: Array.isArray(etag) ? etag[0] : etag, manifest };
+            handleManifest(manifest);
         });
     });
     request.on('error', (err) => console.log("Update check failed:", err.message));
     request.end();
 }
 
-function performUpdate(version) {
-    const downloadPath = path.join(os.tmpdir(), `app_${version}.exe`);
+function handleManifest(manifest) {
+    const remoteVersion = manifest.version;
+    console.log(`Current: ${APP_VERSION}, Remote: ${remoteVersion}`);
+
+    // The server ramps releases by device cohort; wait until ours is let in
+    if (manifest.rollout && manifest.rollout.admitted === false) {
+        console.log(`Version ${remoteVersion} not released to cohort ${manifest.rollout.cohort} yet (${manifest.rollout.percent}%)`);
+        return;
+    }
 
-    // Create write stream
-    const file = fs.createWriteStream(downloadPath);
+    // Simple version check: if string differs and is not 'unknown'
+    if (remoteVersion && remoteVersion !== APP_VERSION && remoteVersion !== 'unknown' && downloadingVersion !== remoteVersion) {
+        console.log("New version found! Initiating update...");
 
-    const request = net.request(`${SERVER_URL}updates/app`);
+        // Report pending
+        reportUpdateStatus(remoteVersion, 'pending');
+
+        // Start download
+        performUpdate(manifest);
+    }
+}
+
+function sha256File(filePath) {
+    return new Promise((resolve, reject) => {
+        const hash = crypto.createHash('sha256');
+        fs.createReadStream(filePath)
+            .on('data', (chunk) => hash.update(chunk))
+            .on('end', () => resolve(hash.digest('hex')))
+            .on('error', reject);
+    });
+}
+
+// Downloads into <exe>.part and resumes it with Range + If-Range after a dropped connection or a
+// restart; the finished file is checked against the manifest's sha256 before it is offered.
+function performUpdate(manifest) {
+    const version = manifest.version;
+    const downloadPath = path.join(os.tmpdir(), `app_${version}.exe`);
+    const partPath = downloadPath + '.part';
+    const etagPath = downloadPath + '.etag';
+    downloadingVersion = version;
+
+    let offset = 0;
+    try {
+        offset = fs.statSync(partPath).size;
+    } catch (err) {
+        offset = 0;
+    }
+
+    const request = net.request(`${SERVER_URL}updates/app?device_id=${encodeURIComponent(hostname)}`);
+    if (offset > 0 && fs.existsSync(etagPath)) {
+        request.setHeader('Range', `bytes=${offset}-`);
+        request.setHeader('If-Range', fs.readFileSync(etagPath, 'utf8').trim());
+    }
 
     request.on('response', (response) => {
-        if (response.statusCode !== 200) {
+        if (response.statusCode === 429) {
+            // Over the rollout quota or the server's download cap: come back when it says to
+            const retryAfter = parseInt(response.headers['retry-after'], 10) || 300;
+            console.log(`Update download deferred for ${retryAfter}s`);
+            reportUpdateStatus(version, 'pending', `Deferred by server for ${retryAfter}s`);
+            downloadingVersion = null;
+            setTimeout(checkForUpdates, retryAfter * 1000);
+            return;
+        }
+        if (response.statusCode === 416) {
+            // Stale partial (e.g. the build was replaced): drop it and start over on the next check
+            fs.unlink(partPath, () => { });
+            downloadingVersion = null;
+            return;
+        }
+        if (response.statusCode !== 200 && response.statusCode !== 206) {
             reportUpdateStatus(version, 'failed', `Server returned ${response.statusCode}`);
+            downloadingVersion = null;
             return;
         }
 
+        const etag = response.headers['etag'];
+        if (etag) fs.writeFileSync(etagPath, Array.isArray(etag) ? etag[0] : etag);
+
+        // 206 continues the partial file; 200 means the server sent the whole file again
+        const file = fs.createWriteStream(partPath, { flags: response.statusCode === 206 ? 'a' : 'w' });
+
         response.on('data', (chunk) => {
             file.write(chunk);
         });
@@ -116,43 +195,78 @@ function performUpdate(version) {
         response.on('end', () => {
             file.end();
         });
-    });
 
-    file.on('finish', () => {
-        file.close(() => {
-            console.log("Update downloaded to " + downloadPath);
-            reportUpdateStatus(version, 'success');
-
-            // Notify user
-            dialog.showMessageBox(mainWindow, {
-                type: 'info',
-                buttons: ['Update Now', 'Later'],
-                title: 'AcornHUB v1.1.8 Available',
-                message: `Version ${version} is ready to install.`,
-                detail: 'The application will close and the installer will run.'
-            }).then(({ response }) => {
-                if (response === 0) { // Update Now
-                    spawn(downloadPath, [], {
-                        detached: true,
-                        stdio: 'ignore'
-                    }).unref();
-                    app.quit();
-                }
-            });
+        response.on('error', (err) => {
+            // Keep the partial file; the next check resumes from where this one stopped
+            file.end();
+            reportUpdateStatus(version, 'failed', "Download error: " + err.message);
+            downloadingVersion = null;
+        });
+
+        file.on('finish', () => {
+            file.close(() => finishUpdate(manifest, partPath, etagPath, downloadPath));
         });
-    });
 
-    file.on('error', (err) => {
-        reportUpdateStatus(version, 'failed', "File write error: " + err.message);
-        fs.unlink(downloadPath, () => { }); // Delete partial file
+        file.on('error', (err) => {
+            reportUpdateStatus(version, 'failed', "File write error: " + err.message);
+            fs.unlink(partPath, () => { }); // Delete partial file
+            downloadingVersion = null;
+        });
     });
 
     request.on('error', (err) => {
         reportUpdateStatus(version, 'failed', "Download error: " + err.message);
+        downloadingVersion = null;
     });
     request.end();
 }
 
+async function finishUpdate(manifest, partPath, etagPath, downloadPath) {
+    const version = manifest.version;
+    try {
+        const size = fs.statSync(partPath).size;
+        if (manifest.size && size < manifest.size) {
+            // Connection closed early; leave the partial file for the next check to resume
+            reportUpdateStatus(version, 'failed', `Incomplete download: ${size} of ${manifest.size} bytes`);
+            return;
+        }
+        const digest = await sha256File(partPath);
+        if (manifest.sha256 && digest !== manifest.sha256) {
+            fs.unlink(partPath, () => { });
+            fs.unlink(etagPath, () => { });
+            reportUpdateStatus(version, 'failed', `SHA-256 mismatch: expected ${manifest.sha256}, got ${digest}`);
+            return;
+        }
+        fs.renameSync(partPath, downloadPath);
+        fs.unlink(etagPath, () => { });
+    } catch (err) {
+        reportUpdateStatus(version, 'failed', "Verification error: " + err.message);
+        return;
+    } finally {
+        downloadingVersion = null;
+    }
+
+    console.log("Update downloaded to " + downloadPath);
+    reportUpdateStatus(version, 'success');
+
+    // Notify user
+    dialog.showMessageBox(mainWindow, {
+        type: 'info',
+        buttons: ['Update Now', 'Later'],
+        title: 'AcornHUB v1.1.8 Available',
+        message: `Version ${version} is ready to install.`,
+        detail: 'The application will close and the installer will run.'
+    }).then(({ response }) => {
+        if (response === 0) { // Update Now
+            spawn(downloadPath, [], {
+                detached: true,
+                stdio: 'ignore'
+            }).unref();
+            app.quit();
+        }
+    });
+}
+
 function reportUpdateStatus(version, status, errorMsg = '') {
     const postData = JSON.stringify({
         employee_id: employeeId,
@@ -22,6 +22,7 @@ try {
 // Configuration
 const SERVER_URL = "http://localhost:5000/";
 const POLL_INTERVAL = 60000;
+const SSE_FALLBACK_POLL_INTERVAL = 300000; // full /content sync interval while the event stream is up
 const REG_CHECK_INTERVAL = 3000;
 const APP_VERSION = "1.1.8";
 
@@ -41,7 +42,15 @@ let state = {
     pending_display: {}, // content_id -> timeout
     device_id: null,
     polling_timer: null,
-    notified_ids: new Set()
+    notified_ids: new Set(),
+    content_cursor: null, // server cursor from the last /content sync, sent back as ?since=
+    wakeup_timer: null, // fires a /content sync when the server's next planned delivery comes due
+    http_cache: {}, // cacheKey -> { etag, body } for conditional GETs
+    event_source: null,
+    sse_open: false,
+    sse_wake: false, // an event asked for a /content sync
+    last_content_sync: 0,
+    checking: false
 };
 
 // Elements
@@ -502,32 +511,95 @@ async function registerDevice() {
     }
 }
 
+// Conditional GET: sends If-None-Match and hands back the cached body on 304
+async function cachedFetch(url, cacheKey, parse) {
+    const cached = state.http_cache[cacheKey];
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    const response = await fetch(url, { headers, cache: 'no-store' });
+    if (response.status === 304 && cached) {
+        return { body: cached.body, notModified: true };
+    }
+    if (!response.ok) throw new Error("Server Error: " + response.status);
+    const body = await parse(response);
+    const etag = response.headers.get('ETag');
+    if (etag) state.http_cache[cacheKey] = { etag, body };
+    return { body, notModified: false };
+}
+
 // Polling
 function startPolling() {
     if (state.polling_timer) clearInterval(state.polling_timer);
     state.polling_timer = setInterval(checkContent, POLL_INTERVAL);
+    startEventStream();
     checkContent();
 }
 
+// Push channel: EventSource reconnects on its own and resends Last-Event-ID
+function startEventStream() {
+    if (state.event_source || !state.employee_id || typeof EventSource === 'undefined') return;
+    const es = new EventSource(`${SERVER_URL}events/${state.employee_id}`);
+    state.event_source = es;
+
+    es.onopen = () => {
+        console.log("Event stream connected");
+        state.sse_open = true;
+    };
+    es.onerror = () => {
+        if (state.sse_open) state.sse_wake = true; // catch up on anything sent while reconnecting
+        state.sse_open = false;
+        if (es.readyState === EventSource.CLOSED) {
+            // Server refused the stream (e.g. 404/503): back to plain polling, try again later
+            state.event_source = null;
+            setTimeout(startEventStream, POLL_INTERVAL);
+        }
+    };
+    ['content', 'notification', 'reactions', 'resync'].forEach(type => {
+        es.addEventListener(type, (e) => {
+            console.log(`Server event ${type}:`, e.data);
+            state.sse_wake = true;
+            checkContent();
+        });
+    });
+}
+
 async function checkContent() {
     if (!state.employee_id) return;
+    if (state.checking) return; // the running check picks up sse_wake when it finishes
+    state.checking = true;
     const statusBanner = document.getElementById('connection-status');
     const statusMsg = document.getElementById('status-msg');
 
     try {
-        const response = await fetch(`${SERVER_URL}content/${state.employee_id}`);
-        if (!response.ok) throw new Error("Server Error: " + response.status);
-
-        const resData = await response.json();
+        // With the event stream up, /content is only fetched when an event says so (plus a slow
+        // safety sync); heartbeat and pending display checks keep the normal pace
+        const syncDue = state.sse_wake || !state.sse_open || Date.now() - state.last_content_sync >= SSE_FALLBACK_POLL_INTERVAL;
+        let resData = { content: [] };
+        if (syncDue) {
+            state.sse_wake = false;
+            // Chromium decodes WebP, so ask for the smaller WebP image variant
+            const since = state.content_cursor ? `&since=${encodeURIComponent(state.content_cursor)}` : '';
+            const { body, notModified } = await cachedFetch(`${SERVER_URL}content/${state.employee_id}?image=webp${since}`, 'content', r => r.json());
+            state.last_content_sync = Date.now();
+
+            // 304: nothing changed server-side, so treat it as an empty delta
+            if (!notModified) resData = body;
+        }
         const { content } = resData;
+        const reactionUpdates = resData.reaction_updates || [];
 
         state.last_poll_successful = true;
         if (navigator.onLine) statusBanner.classList.remove('show');
 
-        const newMessages = content.filter(c =>
-            !state.processed_content_ids.has(c.id) &&
-            (state.viewed_durations[c.id] || 0) <= 30
-        );
+        // Reaction count changes for messages we already hold
+        reactionUpdates.forEach(u => {
+            const existingIdx = state.all_content.findIndex(existing => existing.id === u.id);
+            if (existingIdx === -1) return;
+            state.all_content[existingIdx].reaction_counts = u.reaction_counts;
+            state.all_content[existingIdx].user_reaction = u.user_reaction;
+            if (state.current_content_index === existingIdx) {
+                renderReactions(state.all_content[existingIdx]);
+            }
+        });
 
         let updated = false;
         content.forEach(c => {
@@ -536,9 +608,15 @@ async function checkContent() {
                 state.all_content.push(c);
                 updated = true;
             } else {
-                // Update reaction counts and user reaction for existing content
+                // Update reaction counts, user reaction and planned delivery for existing content
                 state.all_content[existingIdx].reaction_counts = c.reaction_counts;
                 state.all_content[existingIdx].user_reaction = c.user_reaction;
+                state.all_content[existingIdx].delay_choice = c.delay_choice;
+                state.all_content[existingIdx].display_time = c.display_time;
+                // Re-sent once the server has encoded the image variants
+                state.all_content[existingIdx].image_url = c.image_url;
+                state.all_content[existingIdx].image_variants = c.image_variants;
+                state.all_content[existingIdx].media = c.media;
 
                 // If this is the currently displayed message, refresh the reaction UI
                 if (state.current_content_index === existingIdx) {
@@ -558,6 +636,15 @@ async function checkContent() {
             renderHistory();
         }
 
+        if (resData.cursor) state.content_cursor = resData.cursor;
+        if ('next_wakeup' in resData) scheduleWakeup(resData.next_wakeup);
+
+        // Incremental syncs only carry the delta, so pending messages are picked from everything we hold
+        const newMessages = state.all_content.filter(c =>
+            !state.processed_content_ids.has(c.id) &&
+            (state.viewed_durations[c.id] || 0) <= 30
+        );
+
         // Sync employee ID to main process for update reporting
         if (state.employee_id && ipcRenderer) {
             ipcRenderer.send('set-employee-id', state.employee_id);
@@ -565,16 +652,14 @@ async function checkContent() {
 
         if (newMessages.length > 0) {
             const msg = newMessages[0];
-            const pref = await checkPreference(msg.id);
 
-            // Check if pref actually contains data (display_time)
-            if (pref && pref.display_time) {
-                const displayTime = new Date(pref.display_time);
-                if (displayTime <= new Date()) {
+            // /content carries the delay preference; the server only re-sends a delayed message once it is due
+            if (msg.delay_choice) {
+                if (!msg.display_time || new Date(msg.display_time) <= new Date()) {
                     notifyNewContent(msg, true);
                 }
             } else {
-                // If pref is null or an empty object {}, show the delay dialog
+                // No preference yet, show the delay dialog
                 notifyNewContent(msg, false);
             }
         }
@@ -604,17 +689,24 @@ async function checkContent() {
         } else {
             updateNetworkStatus(); // Ensure offline message is shown
         }
+    } finally {
+        state.checking = false;
+        if (state.sse_wake) setTimeout(checkContent, 0);
     }
 }
 
-async function checkPreference(contentId) {
-    try {
-        const response = await fetch(`${SERVER_URL}message_preferences/${state.employee_id}/${contentId}`);
-        const data = await response.json();
-        return data && data.preference ? data.preference : null;
-    } catch {
-        return null;
-    }
+// Sync exactly when the next delayed message comes due instead of waiting for the next poll
+function scheduleWakeup(nextWakeup) {
+    if (state.wakeup_timer) clearTimeout(state.wakeup_timer);
+    state.wakeup_timer = null;
+    if (!nextWakeup) return;
+    // With the event stream up the regular poll no longer syncs /content, so always arm the timer
+    const delay = Math.min(Math.max(1000, new Date(nextWakeup) - Date.now()), 24 * 60 * 60 * 1000);
+    state.wakeup_timer = setTimeout(() => {
+        state.wakeup_timer = null;
+        state.sse_wake = true;
+        checkContent();
+    }, delay);
 }
 
 function notifyNewContent(content, immediate) {
@@ -643,6 +735,8 @@ async function handleDelayChoice(content, choice) {
     else if (choice.includes("3 hours")) delayMs = 3 * 60 * 60 * 1000;
 
     const displayTime = new Date(Date.now() + delayMs).toISOString();
+    content.delay_choice = choice;
+    content.display_time = displayTime;
     try {
         await fetch(`${SERVER_URL}set_message_delay`, {
             method: 'POST',
@@ -1010,16 +1104,18 @@ function setupTitleBar() {
 async function checkForUpdates() {
     console.log("Checking for updates...");
     try {
-        const response = await fetch(`${SERVER_URL}updates/version`);
-        if (!response.ok) return;
-
-        const serverVersion = (await response.text()).trim();
+        const { body: manifest } = await cachedFetch(`${SERVER_URL}updates/manifest?device_id=${encodeURIComponent(state.device_id)}`, 'manifest', r => r.json());
+        const serverVersion = manifest.version;
+        if (manifest.rollout && manifest.rollout.admitted === false) {
+            console.log(`Update ${serverVersion} not released to cohort ${manifest.rollout.cohort} yet (${manifest.rollout.percent}%)`);
+            return;
+        }
         console.log(`Server version: ${serverVersion}, Local version: ${APP_VERSION}`);
 
         if (compareVersions(serverVersion, APP_VERSION) > 0) {
             console.log(`Update available: ${serverVersion}`);
             if (confirm(`A new version (${serverVersion}) is available. Update now?`)) {
-                downloadAndInstall(serverVersion);
+                downloadAndInstall(manifest);
             }
         }
     } catch (e) {
@@ -1039,7 +1135,13 @@ function compareVersions(v1, v2) {
     return 0;
 }
 
-async function downloadAndInstall(version) {
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function downloadAndInstall(manifest) {
+    const version = manifest.version;
     const debugStatus = document.getElementById('debug-status');
     if (debugStatus) {
         debugStatus.textContent = "Downloading Update...";
@@ -1049,13 +1151,56 @@ async function downloadAndInstall(version) {
     try {
         updateUpdateStatus(version, 'pending');
 
-        const response = await fetch(`${SERVER_URL}updates/app`);
+        // Resume a partial download left by an earlier attempt (If-Range makes the server send
+        // the whole file instead if the build changed since)
+        const tempPath = path.join(os.tmpdir(), `app_installer_${version}.exe`);
+        const partPath = tempPath + '.part';
+        const etagPath = tempPath + '.etag';
+        const offset = fs.existsSync(partPath) ? fs.statSync(partPath).size : 0;
+        const headers = {};
+        if (offset > 0 && fs.existsSync(etagPath)) {
+            headers['Range'] = `bytes=${offset}-`;
+            headers['If-Range'] = fs.readFileSync(etagPath, 'utf8').trim();
+        }
+
+        const response = await fetch(`${SERVER_URL}updates/app?device_id=${encodeURIComponent(state.device_id)}`, { headers });
+        if (response.status === 429) {
+            // Over the rollout quota or the server's download cap; ask again after Retry-After
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 300;
+            updateUpdateStatus(version, 'pending', `Deferred by server for ${retryAfter}s`);
+            if (debugStatus) debugStatus.textContent = `Update queued, retrying in ${Math.ceil(retryAfter / 60)} min`;
+            setTimeout(() => downloadAndInstall(manifest), retryAfter * 1000);
+            return;
+        }
+        if (response.status === 416) {
+            fs.unlinkSync(partPath);
+            throw new Error("Partial download is stale, please retry");
+        }
         if (!response.ok) throw new Error("Download failed");
+        const etag = response.headers.get('ETag');
+        if (etag) fs.writeFileSync(etagPath, etag);
 
-        const buffer = await response.arrayBuffer();
-        const tempPath = path.join(os.tmpdir(), `app_installer_${version}.exe`);
+        // Stream to disk so a dropped connection keeps what already arrived
+        const reader = response.body.getReader();
+        const fd = fs.openSync(partPath, response.status === 206 ? 'a' : 'w');
+        try {
+            for (;;) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                fs.writeSync(fd, value);
+            }
+        } finally {
+            fs.closeSync(fd);
+        }
 
-        fs.writeFileSync(tempPath, Buffer.from(buffer));
+        const buffer = fs.readFileSync(partPath);
+        const digest = await sha256Hex(buffer);
+        if (manifest.sha256 && digest !== manifest.sha256) {
+            fs.unlinkSync(partPath);
+            throw new Error(`SHA-256 mismatch: expected ${manifest.sha256}, got ${digest}`);
+        }
+        fs.renameSync(partPath, tempPath);
+        if (fs.existsSync(etagPath)) fs.unlinkSync(etagPath);
         console.log("Installer downloaded to:", tempPath);
 
         if (debugStatus) debugStatus.textContent = "Installing...";
@@ -11,6 +11,9 @@ import threading
 import winreg
 import os
 import json
+import hashlib
+import lzma
+import struct
 from PIL import Image, ImageFilter
 from datetime import datetime, timezone, timedelta
 from random import randint
@@ -47,6 +50,12 @@ def create_blurred_image(input_path, output_path, blur_radius=5):
         logging.error(f"Failed to create blurred image: {str(e)}")
         return False
 
+class UpdateDeferred(Exception):
+    """The server turned an update download away (429); try again after retry_after seconds."""
+    def __init__(self, retry_after, message):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -57,8 +66,12 @@ logging.basicConfig(
 class StudentApp(QMainWindow):
     APP_VERSION = "1.1.2"
     SERVER_URL = "https://hrnotification.acorngroup.lk"
+    POLL_INTERVAL = 60  # seconds between heartbeat / pending-display checks
+    SSE_FALLBACK_POLL_INTERVAL = 300  # full /content sync interval while the event stream is up
     new_content_signal = Signal(dict)
     update_scroll_signal = Signal()
+    update_ready_signal = Signal(str, str)  # new_version, verified exe path
+    update_check_done_signal = Signal(int)  # seconds until the next update check
 
     def __init__(self):
         super().__init__()
@@ -85,12 +98,21 @@ class StudentApp(QMainWindow):
         self.hostname = self.get_hostname()
         self.host_email = self.get_host_email()
         self.device_id = self.load_device_id()
+        self.update_retry_after = 0  # seconds the server asked us to wait before the next update attempt
+        self.update_thread = None
+        self.update_download_failures = {}  # download path -> interrupted attempts in a row
         self.content_thread = None
+        self.event_thread = None
+        self.content_wakeup = threading.Event()  # set by the event stream to sync /content right away
+        self.sse_connected = False
+        self.last_event_id = None
         self.running = True
         self.media_player = None
         self.video_widget = None
         self.audio_output = None
         self.update_scroll_signal.connect(self.update_scroll_area)
+        self.update_ready_signal.connect(self.install_update)
+        self.update_check_done_signal.connect(self.schedule_update_check)
         self.tray_icon = None
         self.all_content = []
         self.current_content_index = 0
@@ -107,6 +129,9 @@ class StudentApp(QMainWindow):
             'cry': '😢'
         }
         self.notifications = []
+        self.content_cursor = None  # server cursor from the last /content sync, sent back as ?since=
+        self.next_wakeup = None  # when the server's next planned delivery for us comes due (from /content)
+        self.http_cache = {}  # cache_key -> (etag, parsed body) for conditional GETs
         self.pending_display = {}
         self.play_again_button = None
         self.countdown_timer = None
@@ -392,17 +417,43 @@ class StudentApp(QMainWindow):
         except Exception as e:
             logging.error(f"Failed to add to registry: {str(e)}")
 
+    def cached_get(self, url, cache_key, parse, timeout=5, **kwargs):
+        """GET with If-None-Match. Returns (body, not_modified); on 304 the body is the cached one."""
+        cached = self.http_cache.get(cache_key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = requests.get(url, headers=headers, timeout=timeout, **kwargs)
+        if response.status_code == 304 and cached:
+            return cached[1], True
+        response.raise_for_status()
+        body = parse(response)
+        etag = response.headers.get('ETag')
+        if etag:
+            self.http_cache[cache_key] = (etag, body)
+        return body, False
+
     def check_for_updates(self):
-        """Check for updates and report status to server."""
+        """Start an update check on a worker thread; the download and hashing never run on the GUI thread."""
+        if self.update_thread is not None and self.update_thread.is_alive():
+            logging.debug("Update check already running")
+            return
+        self.update_thread = threading.Thread(target=self.run_update_check, daemon=True)
+        self.update_thread.start()
+
+    def run_update_check(self):
+        """Check for updates and report status to server (worker thread)."""
         logging.info("Checking for updates...")
         try:
             self.report_update_status('pending', 'Checking for updates')
-            response = requests.get(f"{self.SERVER_URL}/updates/version", timeout=5)
-            response.raise_for_status()
-            server_version = response.text.strip()
-            if version.parse(server_version) > version.parse(self.APP_VERSION):
+            manifest, _ = self.cached_get(f"{self.SERVER_URL}/updates/manifest", 'manifest', lambda r: r.json(),
+                                          params={'device_id': self.device_id})
+            server_version = manifest['version']
+            rollout = manifest.get('rollout') or {}
+            if version.parse(server_version) > version.parse(self.APP_VERSION) and rollout.get('admitted') is False:
+                logging.info(f"Update {server_version} not released to cohort {rollout.get('cohort')} yet ({rollout.get('percent')}%)")
+                self.report_update_status('pending', f"Waiting for rollout of {server_version}")
+            elif version.parse(server_version) > version.parse(self.APP_VERSION):
                 logging.info(f"Update available: {server_version} (current: {self.APP_VERSION})")
-                self.download_update(server_version)
+                self.download_update(server_version, manifest)
             else:
                 logging.info("No new version available")
                 self.report_update_status('success', 'Version up to date')
@@ -410,36 +461,87 @@ class StudentApp(QMainWindow):
             logging.error(f"Error checking for updates: {str(e)}")
             self.report_update_status('failed', f"Error checking updates: {str(e)}")
         finally:
-            QTimer.singleShot(4 * 60 * 1000, self.check_for_updates)  # Check again in 4 minutes
+            # Check again in 4 minutes, or when the server / download backoff asked for
+            delay = self.update_retry_after or 4 * 60
+            self.update_retry_after = 0
+            self.update_check_done_signal.emit(delay)
+
+    def schedule_update_check(self, delay):
+        """Re-arm the update timer on the GUI thread once a worker check has finished."""
+        QTimer.singleShot(delay * 1000, self.check_for_updates)
 
     # Updated download_update method
-    def download_update(self, new_version):
-        """Download new app.exe, update registry, and report status."""
+    def download_update(self, new_version, manifest=None):
+        """Download and verify the new app.exe (worker thread), then hand it to install_update on the GUI thread."""
         try:
             temp_dir = os.getenv('TEMP')
             temp_exe_path = os.path.join(temp_dir, f"app_{new_version}.exe")
+            patch_path = os.path.join(temp_dir, f"app_{self.APP_VERSION}_{new_version}.delta")
+            manifest = manifest or {}
             self.report_update_status('pending', f"Downloading version {new_version}")
 
-            # Clean up old .exe files
+            # Clean up old downloads, keeping partial files of this version so they can resume
             for old_file in os.listdir(temp_dir):
-                if old_file.startswith("app_") and old_file.endswith(".exe"):
+                resumable = old_file.startswith((f"app_{new_version}.exe.", os.path.basename(patch_path)))
+                if old_file.startswith("app_") and old_file.endswith((".exe", ".part", ".etag", ".delta")) and not resumable:
                     try:
                         os.remove(os.path.join(temp_dir, old_file))
                         logging.info(f"Removed old update file: {old_file}")
                     except Exception as e:
                         logging.warning(f"Failed to remove old file {old_file}: {str(e)}")
 
-            response = requests.get(f"{self.SERVER_URL}/updates/app", stream=True, timeout=10)
-            response.raise_for_status()
-            with open(temp_exe_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            # Frozen builds ask for a patch against the running exe when the manifest lists one;
+            # anything that goes wrong with the patch (mismatched base, bad hash) falls back to the full exe
+            patched = False
+            has_delta = any(d.get('from_version') == self.APP_VERSION for d in manifest.get('deltas', []))
+            if getattr(sys, 'frozen', False) and (has_delta or not manifest):
+                try:
+                    update_format, target_sha = self.fetch_update_file(f"{self.SERVER_URL}/updates/patch/{self.APP_VERSION}", patch_path)
+                    if update_format == 'delta':
+                        self.apply_update_delta(patch_path, sys.executable, temp_exe_path)
+                    else:
+                        os.replace(patch_path, temp_exe_path)
+                    self.verify_update(temp_exe_path, target_sha or manifest.get('sha256'))
+                    patched = True
+                    logging.info(f"Built update from {update_format} download")
+                except UpdateDeferred:
+                    raise
+                except Exception as e:
+                    logging.warning(f"Patch update failed, downloading full app.exe: {str(e)}")
+                finally:
+                    if os.path.exists(patch_path):
+                        os.remove(patch_path)
+            if not patched:
+                _, target_sha = self.fetch_update_file(f"{self.SERVER_URL}/updates/app", temp_exe_path)
+                self.verify_update(temp_exe_path, target_sha or manifest.get('sha256'))
             logging.info(f"Downloaded update to {temp_exe_path}")
 
+            # Report success before restarting
+            self.report_update_status('success', f"Updated to version {new_version}")
+            self.update_ready_signal.emit(new_version, temp_exe_path)
+        except UpdateDeferred as e:
+            # Not a failure: the rollout hasn't reached us, the server is busy or the download was
+            # interrupted; partial files are kept and the next timed check resumes them
+            logging.info(f"Update {new_version} deferred for {e.retry_after}s: {str(e)}")
+            self.update_retry_after = e.retry_after
+            self.report_update_status('pending', f"Update deferred: {str(e)}")
+        except Exception as e:
+            logging.error(f"Update failed: {str(e)}")
+            self.report_update_status('failed', f"Update failed: {str(e)}")
+            if os.path.exists(temp_exe_path):
+                try:
+                    os.remove(temp_exe_path)
+                    logging.info(f"Cleaned up failed download: {temp_exe_path}")
+                except Exception as e:
+                    logging.warning(f"Failed to clean up {temp_exe_path}: {str(e)}")
+
+    def install_update(self, new_version, temp_exe_path):
+        """Swap in a downloaded, verified exe: write update.bat, update registry, restart (GUI thread)."""
+        try:
             # Create batch file to replace executable
             current_exe = sys.executable
             exe_filename = os.path.basename(current_exe)
-            batch_path = os.path.join(temp_dir, "update.bat")
+            batch_path = os.path.join(os.getenv('TEMP'), "update.bat")
             batch_content = f"""@echo off
                 timeout /t 5 /nobreak >nul
                 taskkill /IM {exe_filename} /F >nul 2>&1
@@ -458,21 +560,112 @@ class StudentApp(QMainWindow):
             # Update registry
             self.add_to_registry()
 
-            # Report success before restarting
-            self.report_update_status('success', f"Updated to version {new_version}")
-
             # Run batch file and exit
+            logging.info(f"Installing version {new_version}")
             subprocess.Popen([batch_path], shell=True, creationflags=subprocess.CREATE_NEW_CONSOLE)
             self.close()
         except Exception as e:
-            logging.error(f"Update failed: {str(e)}")
-            self.report_update_status('failed', f"Update failed: {str(e)}")
-            if os.path.exists(temp_exe_path):
-                try:
-                    os.remove(temp_exe_path)
-                    logging.info(f"Cleaned up failed download: {temp_exe_path}")
-                except Exception as e:
-                    logging.warning(f"Failed to clean up {temp_exe_path}: {str(e)}")
+            logging.error(f"Update install failed: {str(e)}")
+            threading.Thread(target=self.report_update_status, args=('failed', f"Update install failed: {str(e)}"),
+                             daemon=True).start()
+
+    def fetch_update_file(self, url, path, attempts=5):
+        """
+        Stream an update download to path; returns (X-Update-Format, X-Target-SHA256). Bytes land in
+        path + ".part" and an interrupted download resumes with Range + If-Range (the server's ETag),
+        across retries and app restarts; if the build changed meanwhile the server sends it whole.
+        Makes one request per call: an interruption raises UpdateDeferred with a short backoff so the
+        next timed update check resumes it, and after `attempts` interruptions in a row it gives up.
+        """
+        part_path, etag_path = path + ".part", path + ".etag"
+        for _ in range(2):  # a 416 means the partial file is stale: drop it and start over once
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {}
+            if offset and os.path.exists(etag_path):
+                with open(etag_path, 'r') as f:
+                    headers = {'Range': f"bytes={offset}-", 'If-Range': f.read().strip()}
+            try:
+                with requests.get(url, headers=headers, params={'device_id': self.device_id},
+                                  stream=True, timeout=(10, 60)) as response:
+                    if response.status_code == 429:
+                        retry_after = response.headers.get('Retry-After', '')
+                        retry_after = int(retry_after) if retry_after.isdigit() else 300
+                        raise UpdateDeferred(retry_after, f"server asked to retry in {retry_after}s")
+                    if response.status_code == 416:
+                        os.remove(part_path)
+                        continue
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        expected = int(response.headers['Content-Range'].rsplit('/', 1)[-1])
+                        mode = 'ab'
+                    else:
+                        expected = int(response.headers.get('Content-Length') or -1)
+                        mode = 'wb'
+                    if response.headers.get('ETag'):
+                        with open(etag_path, 'w') as f:
+                            f.write(response.headers['ETag'])
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=64 * 1024):
+                            f.write(chunk)
+                    if expected >= 0 and os.path.getsize(part_path) != expected:
+                        raise IOError(f"Incomplete download: {os.path.getsize(part_path)} of {expected} bytes")
+                    os.replace(part_path, path)
+                    if os.path.exists(etag_path):
+                        os.remove(etag_path)
+                    self.update_download_failures.pop(path, None)
+                    return response.headers.get('X-Update-Format', 'full'), response.headers.get('X-Target-SHA256')
+            except (requests.RequestException, IOError, ValueError) as e:
+                failures = self.update_download_failures.get(path, 0) + 1
+                logging.warning(f"Download of {url} interrupted (attempt {failures}/{attempts}): {str(e)}")
+                if failures >= attempts:
+                    self.update_download_failures.pop(path, None)
+                    raise IOError(f"Download of {url} failed after {attempts} attempts")
+                self.update_download_failures[path] = failures
+                raise UpdateDeferred(min(60, 2 ** failures), f"download interrupted, resuming shortly: {str(e)}")
+        raise IOError(f"Download of {url} failed: server rejected the resume range")
+
+    def apply_update_delta(self, patch_path, source_exe, output_path):
+        """Rebuild the new exe from the running one and an HRDELTA1 patch (copy/insert ops, LZMA-compressed)."""
+        with open(patch_path, 'rb') as f:
+            header = f.read(48)
+            if len(header) < 48 or header[:8] != b'HRDELTA1':
+                raise ValueError("Not an update patch")
+            target_size = struct.unpack('>Q', header[8:16])[0]
+            ops = memoryview(lzma.decompress(f.read()))
+        position = 0
+        with open(source_exe, 'rb') as source, open(output_path, 'wb') as out:
+            while position < len(ops):
+                op = ops[position]
+                if op == ord('C'):
+                    offset, length = struct.unpack_from('>QI', ops, position + 1)
+                    position += 13
+                    source.seek(offset)
+                    while length:
+                        data = source.read(min(length, 1024 * 1024))
+                        if not data:
+                            raise ValueError("Patch does not match the installed version")
+                        out.write(data)
+                        length -= len(data)
+                elif op == ord('I'):
+                    (length,) = struct.unpack_from('>I', ops, position + 1)
+                    out.write(ops[position + 5:position + 5 + length])
+                    position += 5 + length
+                else:
+                    raise ValueError("Corrupt update patch")
+        if os.path.getsize(output_path) != target_size:
+            raise ValueError("Patched file has the wrong size")
+
+    def verify_update(self, path, expected_sha):
+        """Refuse to install an exe whose SHA-256 differs from what the server published."""
+        if not expected_sha:
+            logging.warning("Server sent no X-Target-SHA256; installing update unverified")
+            return
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        if sha.hexdigest() != expected_sha.lower():
+            raise ValueError(f"Update hash mismatch: got {sha.hexdigest()}, expected {expected_sha}")
 
     def fetch_views(self):
         """Fetch view data from server to populate viewed_durations."""
@@ -480,9 +673,11 @@ class StudentApp(QMainWindow):
         for attempt in range(retries):
             try:
                 logging.debug(f"Fetching views for employee_id: {self.employee_id}, attempt {attempt + 1}")
-                response = requests.get(f"{self.server_url}/views/{self.employee_id}", timeout=10)
-                response.raise_for_status()
-                views = response.json().get('views', [])
+                data, not_modified = self.cached_get(f"{self.server_url}/views/{self.employee_id}", 'views', lambda r: r.json(), timeout=10)
+                if not_modified:
+                    logging.debug("Views unchanged since last fetch")
+                    break
+                views = data.get('views', [])
                 server_durations = {view['content_id']: view['viewed_duration'] for view in views}
                 for content_id, duration in server_durations.items():
                     if content_id not in self.viewed_durations or duration > self.viewed_durations[content_id]:
@@ -761,6 +956,61 @@ class StudentApp(QMainWindow):
             logging.debug("Content check thread started")
         else:
             logging.debug("Content check thread already running")
+        if self.event_thread is None or not self.event_thread.is_alive():
+            self.event_thread = threading.Thread(target=self.listen_for_events, daemon=True)
+            self.event_thread.start()
+            logging.debug("Event stream thread started")
+
+    def listen_for_events(self):
+        """Hold an SSE connection to /events and wake check_content when something changes."""
+        retry_delay = 5
+        while self.running:
+            try:
+                headers = {'Accept': 'text/event-stream'}
+                if self.last_event_id:
+                    headers['Last-Event-ID'] = self.last_event_id
+                # Read timeout well above the server's 15s keep-alive so a dead link is noticed
+                with requests.get(f"{self.server_url}/events/{self.employee_id}", headers=headers, stream=True, timeout=(5, 60)) as response:
+                    response.raise_for_status()
+                    self.sse_connected = True
+                    logging.info("Event stream connected")
+                    event_type, data_lines = None, []
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not self.running:
+                            break
+                        if line is None:
+                            continue
+                        if line == '':
+                            if event_type or data_lines:
+                                self.handle_server_event(event_type or 'message', '\n'.join(data_lines))
+                            event_type, data_lines = None, []
+                        elif line.startswith(':'):
+                            continue
+                        elif line.startswith('id:'):
+                            self.last_event_id = line[3:].strip()
+                        elif line.startswith('event:'):
+                            event_type = line[6:].strip()
+                        elif line.startswith('data:'):
+                            data_lines.append(line[5:].lstrip())
+                        elif line.startswith('retry:'):
+                            try:
+                                retry_delay = max(1, int(line[6:].strip()) // 1000)
+                            except ValueError:
+                                pass
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Event stream disconnected: {str(e)}")
+            finally:
+                if self.sse_connected:
+                    # Catch up on anything published while we were reconnecting
+                    self.content_wakeup.set()
+                self.sse_connected = False
+            if self.running:
+                time.sleep(retry_delay + randint(0, retry_delay))
+
+    def handle_server_event(self, event_type, data):
+        logging.debug(f"Server event {event_type}: {data}")
+        if event_type in ('content', 'notification', 'reactions', 'resync'):
+            self.content_wakeup.set()
 
     def check_content_at_startup(self):
         """Check for new content at startup and show window only if new messages are found."""
@@ -769,12 +1019,13 @@ class StudentApp(QMainWindow):
             return
         
         try:
-            response = requests.get(f"{self.server_url}/content/{self.employee_id}", timeout=5)
-            response.raise_for_status()
-            data = response.json()
+            data, _ = self.cached_get(f"{self.server_url}/content/{self.employee_id}", 'content', lambda r: r.json())
             logging.debug(f"Startup content response for {self.employee_id}: {data}")
             self.notifications = data.get('notifications', [])
             new_content = data.get('content', [])
+            self.content_cursor = data.get('cursor') or self.content_cursor
+            if data.get('next_wakeup'):
+                self.next_wakeup = datetime.fromisoformat(data['next_wakeup'].replace('Z', '+00:00'))
 
             self.fetch_views()
 
@@ -810,16 +1061,8 @@ class StudentApp(QMainWindow):
         content_id = content['id']
 
         try:
-            # First check if message already has delay preferences
-            response = requests.get(
-                f"{self.server_url}/message_preferences/{self.employee_id}/{content_id}",
-                timeout=5
-            )
-            response.raise_for_status()
-            preference_data = response.json().get('preference', {})
-
-            # If message already has delay preference, display directly without dialog
-            if preference_data:
+            # /content carries the delay preference, so a message that already has one is due now
+            if content.get('delay_choice'):
                 logging.debug(f"Content {content_id} already has delay preference, displaying directly")
                 self.display_content(content)
                 return
@@ -923,6 +1166,7 @@ class StudentApp(QMainWindow):
             else:
                 response.raise_for_status()
                 logging.info(f"Delay choice {delay_choice} set for content {content_id}")
+                self.content_wakeup.set()  # pick up the new next_wakeup from /content
         except requests.exceptions.RequestException as e:
             logging.error(f"Error setting delay choice for content {content_id}: {str(e)}")
             QMessageBox.warning(self, "Warning", f"Failed to set delay choice: {str(e)}. Displaying content anyway.")
@@ -949,19 +1193,63 @@ class StudentApp(QMainWindow):
             if delay_seconds != 0:
                 self.hide()
 
+    def merge_content_sync(self, data):
+        """Apply a (possibly incremental) /content response to all_content and notifications."""
+        new_content = data.get('content', [])
+        content_by_id = {c['id']: c for c in self.all_content}
+
+        if self.content_cursor:
+            # Incremental sync: the server only returns what changed, so merge instead of replacing
+            known_notification_ids = {n.get('id') for n in self.notifications}
+            self.notifications = [n for n in data.get('notifications', []) if n.get('id') not in known_notification_ids] + self.notifications
+        else:
+            self.notifications = data.get('notifications', [])
+
+        for update in data.get('reaction_updates', []):
+            existing = content_by_id.get(update['id'])
+            if existing:
+                existing['reaction_counts'] = update.get('reaction_counts')
+                existing['user_reaction'] = update.get('user_reaction')
+
+        for content in new_content:
+            existing = content_by_id.get(content['id'])
+            if existing:
+                existing['reaction_counts'] = content.get('reaction_counts')
+                existing['user_reaction'] = content.get('user_reaction')
+                existing['delay_choice'] = content.get('delay_choice')
+                existing['display_time'] = content.get('display_time')
+                # Re-sent once the server has encoded the image variants
+                existing['image_url'] = content.get('image_url')
+                existing['image_variants'] = content.get('image_variants')
+                existing['media'] = content.get('media')
+
+        self.content_cursor = data.get('cursor') or self.content_cursor
+        if 'next_wakeup' in data:
+            self.next_wakeup = datetime.fromisoformat(data['next_wakeup'].replace('Z', '+00:00')) if data['next_wakeup'] else None
+        return new_content
+
     def check_content(self):
+        woke = False
+        last_sync = None
         while self.running:
             try:
-                response = requests.get(f"{self.server_url}/content/{self.employee_id}", timeout=5)
-                response.raise_for_status()
-                data = response.json()
+                # With the event stream up, /content is only fetched when an event says so
+                # (plus a slow safety sync); heartbeat and pending display checks keep their pace
+                if woke or not self.sse_connected or last_sync is None or time.monotonic() - last_sync >= self.SSE_FALLBACK_POLL_INTERVAL:
+                    params = {'since': self.content_cursor} if self.content_cursor else None
+                    data, not_modified = self.cached_get(f"{self.server_url}/content/{self.employee_id}", 'content', lambda r: r.json(), params=params)
+                    if not_modified:
+                        # Nothing changed server-side: an empty delta keeps the cursor and local state as they are
+                        data = {}
+                    last_sync = time.monotonic()
+                else:
+                    data = {}
                 logging.debug(f"Content response for {self.employee_id}: {data}")
-                self.notifications = data.get('notifications', [])
-                new_content = data.get('content', [])
 
                 self.fetch_views()
 
                 current_ids = {c['id'] for c in self.all_content}
+                new_content = self.merge_content_sync(data)
                 new_messages = [c for c in new_content if c['id'] not in current_ids and c['id'] not in self.processed_content_ids and self.viewed_durations.get(c['id'], 0) <= 30]
                 logging.debug(f"New messages detected: {[c['id'] for c in new_messages]}")
                 for content in new_content:
@@ -973,29 +1261,17 @@ class StudentApp(QMainWindow):
                         logging.debug(f"Emitting signal for new content {content['id']}")
                         self.new_content_signal.emit(content)
 
-                current_time = datetime.now(timezone.utc)
+                # The server only returns a delayed message again once its display time has come,
+                # so anything we already held that shows up with a delay preference is due now
+                held_by_id = {c['id']: c for c in self.all_content}
                 for content in new_content:
-                    if content['id'] in self.processed_content_ids or content['id'] in self.pending_display or self.viewed_durations.get(content['id'], 0) > 30:
-                        logging.debug(f"Skipping content {content['id']} (processed: {content['id'] in self.processed_content_ids}, pending: {content['id'] in self.pending_display}, viewed_duration: {self.viewed_durations.get(content['id'], 0)})")
+                    content_id = content['id']
+                    if content_id not in current_ids or not content.get('delay_choice'):
                         continue
-                    try:
-                        preference_response = requests.get(f"{self.server_url}/message_preferences/{self.employee_id}/{content['id']}", timeout=5)
-                        preference_response.raise_for_status()
-                        preference_data = preference_response.json().get('preference', {})
-                        logging.debug(f"Preference for content {content['id']}: {preference_data}")
-                        display_time = preference_data.get('display_time')
-                        if display_time:
-                            display_time = datetime.fromisoformat(display_time)
-                            if display_time <= current_time and content['id'] not in self.processed_content_ids and self.viewed_durations.get(content['id'], 0) <= 30:
-                                logging.debug(f"Displaying content {content['id']} as display_time reached")
-                                QTimer.singleShot(0, lambda c=content: self.display_content(c))
-                                if content['id'] in self.pending_display:
-                                    del self.pending_display[content['id']]
-                    except requests.exceptions.RequestException as e:
-                        logging.error(f"Error fetching preference for content {content['id']}: {str(e)}")
-                        if content['id'] not in self.processed_content_ids and content['id'] not in self.pending_display and self.viewed_durations.get(content['id'], 0) <= 30:
-                            logging.debug(f"Fallback: Emitting signal for content {content['id']} due to preference fetch failure")
-                            self.new_content_signal.emit(content)
+                    if content_id in self.processed_content_ids or content_id in self.pending_display or self.viewed_durations.get(content_id, 0) > 30:
+                        continue
+                    logging.debug(f"Displaying content {content_id} as display_time reached")
+                    QTimer.singleShot(0, lambda c=held_by_id[content_id]: self.display_content(c))
 
                 requests.post(f"{self.server_url}/update_status", json={
                     "employee_id": self.employee_id,
@@ -1010,7 +1286,16 @@ class StudentApp(QMainWindow):
             except requests.exceptions.RequestException as e:
                 logging.error(f"Error checking content: {str(e)}")
 
-            time.sleep(60)
+            # Sleep until the next planned delivery if that comes before the regular poll
+            timeout = self.POLL_INTERVAL
+            if self.next_wakeup:
+                timeout = max(1, min(timeout, (self.next_wakeup - datetime.now(timezone.utc)).total_seconds()))
+            woke = self.content_wakeup.wait(timeout)
+            self.content_wakeup.clear()
+            if self.next_wakeup and datetime.now(timezone.utc) >= self.next_wakeup:
+                # Sync now; the response brings the following wake-up (cleared so clock skew can't spin us)
+                self.next_wakeup = None
+                woke = True
 
     def start_countdown(self):
         self.countdown_remaining = self.countdown_seconds
@@ -1137,18 +1422,26 @@ class StudentApp(QMainWindow):
                 video_container.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
                 video_layout = QVBoxLayout(video_container)
                 try:
-                    logging.debug(f"Validating video URL: {content['url']}")
-                    # Use GET with Range header to verify file accessibility and content type
-                    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36', 'Range': 'bytes=0-1023'}
-                    response = requests.get(content['url'], headers=headers, timeout=10, allow_redirects=True)
-                    logging.debug(f"Video URL response: status={response.status_code}, headers={response.headers}")
-                    if response.status_code not in (200, 206):
-                        raise ValueError(f"Video URL inaccessible: status code {response.status_code}")
-                    content_type = response.headers.get('Content-Type', '')
-                    if not content_type.startswith('video/mp4'):
-                        raise ValueError(f"Unsupported video content type: {content_type}")
-                    video_url = response.url  # Use the final URL after redirects
-                    logging.debug(f"Final video URL after redirects: {video_url}")
+                    video_meta = (content.get('media') or {}).get('video')
+                    if video_meta:
+                        # /content already describes the stored file, so no probe request is needed
+                        if not (video_meta.get('mime_type') or '').startswith('video/mp4'):
+                            raise ValueError(f"Unsupported video content type: {video_meta.get('mime_type')}")
+                        video_url = content['url']
+                        logging.debug(f"Video metadata from server: {video_meta}")
+                    else:
+                        logging.debug(f"Validating video URL: {content['url']}")
+                        # Use GET with Range header to verify file accessibility and content type
+                        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36', 'Range': 'bytes=0-1023'}
+                        response = requests.get(content['url'], headers=headers, timeout=10, allow_redirects=True)
+                        logging.debug(f"Video URL response: status={response.status_code}, headers={response.headers}")
+                        if response.status_code not in (200, 206):
+                            raise ValueError(f"Video URL inaccessible: status code {response.status_code}")
+                        content_type = response.headers.get('Content-Type', '')
+                        if not content_type.startswith('video/mp4'):
+                            raise ValueError(f"Unsupported video content type: {content_type}")
+                        video_url = response.url  # Use the final URL after redirects
+                        logging.debug(f"Final video URL after redirects: {video_url}")
 
                     self.media_player = QMediaPlayer()
                     self.audio_output = QAudioOutput()
@@ -1596,6 +1889,7 @@ class StudentApp(QMainWindow):
 
     def on_exit(self):
         self.running = False
+        self.content_wakeup.set()
         if self.content_thread:
             self.content_thread.join(timeout=2.0)
         if self.countdown_timer:
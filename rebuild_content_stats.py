@@ -0,0 +1,86 @@
+import mysql.connector
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+
+def rebuild_content_stats():
+    """Create content_stats if needed and recompute every row from reactions, feedback and views."""
+    try:
+        conn = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            database=MYSQL_DATABASE,
+            port=MYSQL_PORT
+        )
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS content_stats (
+                content_id VARCHAR(36) NOT NULL PRIMARY KEY,
+                like_count INT NOT NULL DEFAULT 0,
+                unlike_count INT NOT NULL DEFAULT 0,
+                heart_count INT NOT NULL DEFAULT 0,
+                cry_count INT NOT NULL DEFAULT 0,
+                feedback_count INT NOT NULL DEFAULT 0,
+                view_count INT NOT NULL DEFAULT 0,
+                FOREIGN KEY (content_id) REFERENCES scheduled_content(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+
+        # Recompute in one statement so the app's incremental bumps never see a half-built table
+        cursor.execute("""
+            INSERT INTO content_stats
+                (content_id, like_count, unlike_count, heart_count, cry_count, feedback_count, view_count)
+            SELECT sc.id,
+                   COALESCE(r.like_count, 0), COALESCE(r.unlike_count, 0),
+                   COALESCE(r.heart_count, 0), COALESCE(r.cry_count, 0),
+                   COALESCE(f.feedback_count, 0), COALESCE(v.view_count, 0)
+            FROM scheduled_content sc
+            LEFT JOIN (
+                SELECT content_id,
+                       SUM(reaction = 'like') AS like_count,
+                       SUM(reaction = 'unlike') AS unlike_count,
+                       SUM(reaction = 'heart') AS heart_count,
+                       SUM(reaction = 'cry') AS cry_count
+                FROM reactions
+                GROUP BY content_id
+            ) r ON r.content_id = sc.id
+            LEFT JOIN (
+                SELECT content_id, COUNT(*) AS feedback_count
+                FROM feedback
+                GROUP BY content_id
+            ) f ON f.content_id = sc.id
+            LEFT JOIN (
+                SELECT content_id, COUNT(DISTINCT employee_id) AS view_count
+                FROM views
+                GROUP BY content_id
+            ) v ON v.content_id = sc.id
+            ON DUPLICATE KEY UPDATE
+                like_count = VALUES(like_count),
+                unlike_count = VALUES(unlike_count),
+                heart_count = VALUES(heart_count),
+                cry_count = VALUES(cry_count),
+                feedback_count = VALUES(feedback_count),
+                view_count = VALUES(view_count)
+        """)
+        print(f"Rebuilt content_stats ({cursor.rowcount} rows affected).")
+
+        conn.commit()
+        print("content_stats rebuild complete.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if 'conn' in locals() and conn.is_connected():
+            cursor.close()
+            conn.close()
+
+if __name__ == "__main__":
+    rebuild_content_stats()
@@ -0,0 +1,73 @@
+import glob
+import mysql.connector
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+
+UPLOAD_DIR = "hr_notification\\uploads"
+MEDIA_DIRS = {
+    'video': os.path.join(UPLOAD_DIR, "message", "videos"),
+    'image': os.path.join(UPLOAD_DIR, "message", "images"),
+}
+
+def rebuild_media_refs():
+    """
+    Recompute media_objects.ref_count from scheduled_content (plus the reference a finalized but not
+    yet attached chunked upload holds) and delete objects nothing references
+    (e.g. uploads whose send_message failed after the file was stored). Objects a send took a
+    reference on within the last hour are kept so an in-flight send is never collected.
+    """
+    try:
+        conn = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            database=MYSQL_DATABASE,
+            port=MYSQL_PORT
+        )
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE media_objects m
+            SET m.ref_count = (
+                SELECT COUNT(*) FROM scheduled_content sc
+                WHERE sc.url LIKE CONCAT('%/', m.sha256, '.', m.ext)
+                   OR sc.image_url LIKE CONCAT('%/', m.sha256, '.', m.ext)
+            ) + (
+                SELECT COUNT(*) FROM media_uploads mu
+                WHERE mu.status = 'finalized' AND mu.sha256 = m.sha256
+            )
+        """)
+        print(f"Recomputed reference counts ({cursor.rowcount} objects changed).")
+
+        cursor.execute("""
+            SELECT sha256, kind, ext FROM media_objects
+            WHERE ref_count = 0 AND last_acquired_at < NOW() - INTERVAL 1 HOUR
+        """)
+        unreferenced = cursor.fetchall()
+        for sha256, kind, ext in unreferenced:
+            directory = MEDIA_DIRS[kind]
+            for path in [os.path.join(directory, f"{sha256}.{ext}")] + glob.glob(os.path.join(directory, f"{sha256}_*")):
+                if os.path.exists(path):
+                    os.remove(path)
+            cursor.execute("DELETE FROM media_objects WHERE sha256 = %s AND ref_count = 0", (sha256,))
+        print(f"Removed {len(unreferenced)} unreferenced media objects.")
+
+        conn.commit()
+        print("Media reference rebuild complete.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if 'conn' in locals() and conn.is_connected():
+            cursor.close()
+            conn.close()
+
+if __name__ == "__main__":
+    rebuild_media_refs()
@@ -0,0 +1,179 @@
+"""
+Benchmark for /update_bulk_device_status: old per-device loop vs the set-based version.
+
+Creates throwaway employees (ids prefixed "bench-"), runs both strategies at 100, 1,000 and
+10,000 devices against the configured MySQL database, prints timings and round trips, then
+deletes everything it created.
+
+    python scratch/bench_bulk_device_status.py [--sizes 100 1000 10000]
+
+The per-device strategy mirrors the old route: three statements per device, each on a
+connection checked out of a pool (as execute_query does). The set-based strategy mirrors the
+new route: chunked joined read + chunked multi-row upsert in one transaction.
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from mysql.connector.pooling import MySQLConnectionPool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+
+BATCH_SIZE = 1000
+
+pool = MySQLConnectionPool(
+    pool_name="bench_pool",
+    pool_size=5,
+    host=MYSQL_HOST,
+    user=MYSQL_USER,
+    password=MYSQL_PASSWORD,
+    database=MYSQL_DATABASE,
+    port=MYSQL_PORT,
+    autocommit=True,
+    charset='utf8mb4'
+)
+
+
+def batched(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def pooled_query(query, params=(), fetch=False):
+    conn = pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall() if fetch else None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def create_employees(count):
+    ids = [f"bench-{uuid.uuid4().hex[:30]}" for _ in range(count)]
+    for batch in batched(ids, BATCH_SIZE):
+        placeholders = ','.join(['(%s, %s)'] * len(batch))
+        params = [value for emp in batch for value in (emp, f"{emp}@bench.local")]
+        pooled_query(f"INSERT INTO employees (id, email) VALUES {placeholders}", tuple(params))
+    return ids
+
+
+def cleanup():
+    pooled_query("DELETE FROM employee_devices WHERE employee_id LIKE 'bench-%'")
+    pooled_query("DELETE FROM employees WHERE id LIKE 'bench-%'")
+
+
+def per_device(ids):
+    round_trips = 0
+    for employee_id in ids:
+        email = pooled_query("SELECT email FROM employees WHERE id = %s LIMIT 1", (employee_id,), fetch=True)[0]['email']
+        existing = pooled_query("""
+            SELECT status, app_running, ip, device_type, hostname
+            FROM employee_devices WHERE employee_id = %s LIMIT 1
+        """, (employee_id,), fetch=True)
+        row = existing[0] if existing else {}
+        pooled_query("""
+            INSERT INTO employee_devices
+                (employee_id, status, active_status, hostname, email, last_seen, app_running, ip, device_type)
+            VALUES (%s, %s, 1, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                status = VALUES(status), active_status = VALUES(active_status), hostname = VALUES(hostname),
+                email = VALUES(email), last_seen = VALUES(last_seen), app_running = VALUES(app_running),
+                ip = VALUES(ip), device_type = VALUES(device_type)
+        """, (employee_id, row.get('status', 'online'), row.get('hostname', 'unknown-host'), email,
+              datetime.now(timezone.utc).isoformat(), row.get('app_running', False), row.get('ip'), row.get('device_type')))
+        round_trips += 3
+    return round_trips
+
+
+def set_based(ids):
+    round_trips = 0
+    conn = pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        known = {}
+        for batch in batched(ids, BATCH_SIZE):
+            placeholders = ','.join(['%s'] * len(batch))
+            cursor.execute(f"""
+                SELECT e.id AS employee_id, e.email, ed.employee_id AS device_employee_id,
+                       ed.status, ed.app_running, ed.ip, ed.device_type, ed.hostname
+                FROM employees e
+                LEFT JOIN employee_devices ed ON ed.employee_id = e.id
+                WHERE e.id IN ({placeholders})
+            """, tuple(batch))
+            for row in cursor.fetchall():
+                known[row['employee_id']] = row
+            round_trips += 1
+
+        last_seen = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for employee_id in ids:
+            row = known[employee_id]
+            exists = row['device_employee_id'] is not None
+            rows.append((employee_id, row['status'] if exists else 'online', 1,
+                         row['hostname'] if exists else 'unknown-host', row['email'], last_seen,
+                         row['app_running'] if exists else False, row['ip'] if exists else None,
+                         row['device_type'] if exists else None))
+
+        for batch in batched(rows, BATCH_SIZE):
+            placeholders = ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(f"""
+                INSERT INTO employee_devices
+                    (employee_id, status, active_status, hostname, email, last_seen, app_running, ip, device_type)
+                VALUES {placeholders}
+                ON DUPLICATE KEY UPDATE
+                    status = VALUES(status), active_status = VALUES(active_status), hostname = VALUES(hostname),
+                    email = VALUES(email), last_seen = VALUES(last_seen), app_running = VALUES(app_running),
+                    ip = VALUES(ip), device_type = VALUES(device_type)
+            """, tuple(value for row in batch for value in row))
+            round_trips += 1
+        conn.commit()
+        round_trips += 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return round_trips
+
+
+def run(sizes):
+    print(f"{'devices':>8} | {'per-device s':>12} {'trips':>7} | {'set-based s':>11} {'trips':>6} | speedup")
+    for size in sizes:
+        try:
+            ids = create_employees(size)
+
+            started = time.perf_counter()
+            old_trips = per_device(ids)
+            old_elapsed = time.perf_counter() - started
+
+            # Reset so both strategies do the same mix of inserts (first run creates the rows)
+            pooled_query("DELETE FROM employee_devices WHERE employee_id LIKE 'bench-%'")
+
+            started = time.perf_counter()
+            new_trips = set_based(ids)
+            new_elapsed = time.perf_counter() - started
+
+            print(f"{size:>8} | {old_elapsed:>12.2f} {old_trips:>7} | {new_elapsed:>11.3f} {new_trips:>6} | {old_elapsed / new_elapsed:>6.1f}x")
+        finally:
+            cleanup()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compare per-device and set-based bulk device status updates")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = arg_parser.parse_args()
+    run(args.sizes)
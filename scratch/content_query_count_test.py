@@ -0,0 +1,101 @@
+"""
+Regression check: /content/<employee_id> runs a fixed number of queries, however many items it returns.
+
+Replaces app_sql.execute_query with a recorder that answers each statement with canned rows
+(no MySQL needed) and makes the connection pool unusable, so any query that bypasses
+execute_query fails the check. Calls get_content through the Flask test client for an employee
+with 1 visible item and with 200, and asserts both made the same number of execute_query calls.
+
+    python scratch/content_query_count_test.py
+"""
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_sql  # noqa: E402
+
+EMPLOYEE_ID = "emp-query-count"
+# ETag token, content, media metadata, reactions, notifications
+EXPECTED_QUERIES = 5
+
+
+def fake_rows(item_count):
+    now = datetime(2026, 1, 1, 12, 0, 0)
+    items = []
+    for i in range(item_count):
+        video_hash = uuid.uuid4().hex * 2
+        image_hash = uuid.uuid4().hex * 2
+        items.append({
+            "employee_id": EMPLOYEE_ID, "server_now": now, "next_wakeup": None,
+            "id": str(uuid.uuid4()), "type": "video", "title": f"item {i}", "text": "",
+            "image_url": f"http://test/uploads/message/images/{image_hash}.jpg", "image_variants": None,
+            "url": f"http://test/uploads/message/videos/{video_hash}.mp4",
+            "scheduled_time": now - timedelta(minutes=i), "employees": f'["{EMPLOYEE_ID}"]',
+            "delay_choice": None, "display_time": None
+        })
+    return items
+
+
+def make_recorder(items):
+    calls = []
+
+    def execute_query(query, params=None, fetch=False, commit=False):
+        calls.append(" ".join(query.split())[:80])
+        if "employee_exists" in query:
+            data = [{"employee_exists": 1, "content_state": f"{len(items)}/x", "notified_state": "-",
+                     "variants_state": "-", "reaction_state": "0/-/0"}]
+        elif "FROM employees e" in query:
+            data = [dict(item) for item in items]
+        elif "FROM media_objects" in query:
+            data = [{"sha256": h, "mime_type": "video/mp4", "size_bytes": 1, "width": None,
+                     "height": None, "duration_ms": None} for h in params]
+        elif "JOIN reactions r" in query:
+            data = [{"content_id": item["id"], "like_count": 1, "unlike_count": 0, "heart_count": 0,
+                     "cry_count": 0, "user_reaction": None} for item in items]
+        else:
+            data = []
+        return {"data": data, "rowcount": len(data)}
+
+    return execute_query, calls
+
+
+def no_pool():
+    raise AssertionError("query bypassed execute_query and asked the pool for a connection")
+
+
+def count_queries(item_count):
+    items = fake_rows(item_count)
+    recorder, calls = make_recorder(items)
+    app_sql.execute_query = recorder
+    app_sql.get_db_connection = no_pool
+    client = app_sql.app.test_client()
+    response = client.get(f"/content/{EMPLOYEE_ID}")
+    body = response.get_json()
+    assert response.status_code == 200, f"status {response.status_code}: {body}"
+    assert len(body["content"]) == item_count, f"expected {item_count} items, got {len(body['content'])}"
+    return calls
+
+
+def run():
+    # Keep the background workers (and their startup recovery queries) out of the count
+    app_sql._background_workers_started = True
+    small = count_queries(1)
+    large = count_queries(200)
+    print(f"1 item: {len(small)} queries, 200 items: {len(large)} queries")
+    for query in large:
+        print(f"  {query}")
+    if len(small) != len(large):
+        print("FAIL: query count grows with the number of items")
+        return False
+    if len(large) != EXPECTED_QUERIES:
+        print(f"FAIL: expected {EXPECTED_QUERIES} queries per request")
+        return False
+    print("PASS")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,80 @@
+"""
+Regression check: HeartbeatBuffer always writes a device's newest update status.
+
+Replaces the buffer's writers with stubs that record rows (no MySQL needed) and checks that
+- a heartbeat matching the last written state drops an older, different state still queued,
+  so the flush never writes a report the device has since superseded;
+- after upload_version deletes the non-success device_update_status rows and the buffer forgets
+  them, an unchanged heartbeat is written again (and 'success' rows stay deduplicated).
+
+    python scratch/heartbeat_buffer_test.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_sql  # noqa: E402
+
+KEY = ("emp-heartbeat", "device-1")
+DONE_KEY = ("emp-heartbeat", "device-2")
+PENDING = ("1.1.3", "pending", None)
+FAILED = ("1.1.3", "failed", "hash mismatch")
+SUCCESS = ("1.1.3", "success", None)
+
+
+def make_buffer():
+    buffer = app_sql.HeartbeatBuffer(flush_interval=60)
+    written = []
+    buffer._write_devices = lambda rows: None
+    buffer._write_update_status = lambda rows: written.extend(rows)
+    return buffer, written
+
+
+def heartbeat(buffer, key, state):
+    buffer.add({"employee_id": key[0]}, key, state)
+
+
+def check_newest_report_wins():
+    buffer, written = make_buffer()
+    heartbeat(buffer, KEY, PENDING)
+    buffer.flush()
+    buffer.add_update_status(KEY, FAILED)
+    heartbeat(buffer, KEY, PENDING)
+    written.clear()
+    buffer.flush()
+    assert written == [], f"stale queued state written over the newest report: {written}"
+
+
+def check_forget_after_delete():
+    buffer, written = make_buffer()
+    heartbeat(buffer, KEY, PENDING)
+    heartbeat(buffer, DONE_KEY, SUCCESS)
+    buffer.flush()
+    written.clear()
+    heartbeat(buffer, KEY, PENDING)
+    buffer.flush()
+    assert written == [], f"unchanged heartbeat was written again: {written}"
+    # upload_version: DELETE ... WHERE status != 'success', then forget those rows
+    buffer.forget_written_status(keep_status='success')
+    heartbeat(buffer, KEY, PENDING)
+    heartbeat(buffer, DONE_KEY, SUCCESS)
+    buffer.flush()
+    assert written == [(KEY, PENDING)], f"expected only the deleted pending row rewritten, got {written}"
+
+
+def run():
+    failures = 0
+    for check in (check_newest_report_wins, check_forget_after_delete):
+        try:
+            check()
+            print(f"ok   {check.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {check.__name__}: {e}")
+    print("PASS" if not failures else "FAIL")
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
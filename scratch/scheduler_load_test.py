@@ -0,0 +1,203 @@
+"""
+Load test for the persistent notification scheduler.
+
+Creates one throwaway scheduled_content row (id prefixed "schedtest-"), schedules 10,000
+notification jobs due over the next --spread seconds, and runs --workers NotificationScheduler
+instances against them at once (as separate worker processes or nodes would). Each job is
+recorded instead of sending a real notification. Checks that:
+
+  * each scheduler runs exactly one thread and the thread count does not grow with the jobs,
+  * every job fires exactly once across all workers (no double-fire),
+  * jobs fire close to their due time (prints lateness p50/p99/max).
+
+Everything it created is deleted at the end. With --stub, app_sql.execute_query is replaced by an
+in-memory notification_jobs table that applies the scheduler's statements atomically (as the
+row-level UPDATE ... WHERE status = 'pending' does in MySQL), so the check runs without a database.
+
+    python scratch/scheduler_load_test.py [--jobs 10000] [--spread 60] [--workers 3] [--stub]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_sql  # noqa: E402
+from app_sql import NotificationScheduler  # noqa: E402
+
+SCHEDULER_THREAD_NAME = "notification-scheduler"
+
+
+class InMemoryJobs:
+    """Just enough of notification_jobs for NotificationScheduler's statements, one lock per statement."""
+
+    def __init__(self):
+        self.rows = {}
+        self.finished = Counter()  # job id -> times a worker recorded its outcome
+        self.lock = threading.Lock()
+
+    def execute_query(self, query, params=None, fetch=False, commit=False):
+        q = " ".join(query.split())
+        params = params or ()
+        with self.lock:
+            if q.startswith("INSERT INTO notification_jobs"):
+                for i in range(0, len(params), 3):
+                    job_id, content_id, due_at = params[i:i + 3]
+                    self.rows[job_id] = {"id": job_id, "content_id": content_id, "status": "pending",
+                                         "due_at": datetime.strptime(due_at, '%Y-%m-%d %H:%M:%S'),
+                                         "claimed_by": None, "claimed_at": 0.0, "attempts": 0}
+                return {"data": [], "rowcount": len(params) // 3}
+            if "WHERE status = 'claimed' AND claimed_at <" in q:
+                stale = [r for r in self.rows.values()
+                         if r["status"] == "claimed" and r["claimed_at"] < time.time() - params[0]]
+                for r in stale:
+                    r.update(status="pending", claimed_by=None)
+                return {"data": [], "rowcount": len(stale)}
+            if q.startswith("SELECT id, content_id, due_at FROM notification_jobs WHERE status = 'pending'"):
+                data = sorted((dict(r) for r in self.rows.values() if r["status"] == "pending"),
+                              key=lambda r: r["due_at"])
+                return {"data": data, "rowcount": len(data)}
+            if "SET status = 'claimed'" in q:
+                token, ids = params[0], params[1:]
+                won = [self.rows[i] for i in ids if i in self.rows and self.rows[i]["status"] == "pending"]
+                for r in won:
+                    r.update(status="claimed", claimed_by=token, claimed_at=time.time(), attempts=r["attempts"] + 1)
+                return {"data": [], "rowcount": len(won)}
+            if q.startswith("SELECT id, attempts FROM notification_jobs"):
+                ids, token = params[:-1], params[-1]
+                data = [{"id": i, "attempts": self.rows[i]["attempts"]} for i in ids
+                        if i in self.rows and self.rows[i]["claimed_by"] == token]
+                return {"data": data, "rowcount": len(data)}
+            if "SET status = %s, fired_at" in q:
+                status, _error, job_id = params
+                self.rows[job_id]["status"] = status
+                self.finished[job_id] += 1
+                return {"data": [], "rowcount": 1}
+            if "SET status = 'pending', claimed_by = NULL, last_error" in q:
+                self.rows[params[1]].update(status="pending", claimed_by=None)
+                return {"data": [], "rowcount": 1}
+            if "GROUP BY status" in q:
+                data = [{"status": status, "count": count}
+                        for status, count in Counter(r["status"] for r in self.rows.values()).items()]
+                return {"data": data, "rowcount": len(data)}
+            if q.startswith(("INSERT INTO scheduled_content", "DELETE FROM")):
+                return {"data": [], "rowcount": 0}
+        raise AssertionError(f"unexpected query in stub mode: {q[:80]}")
+
+
+def execute_query(*args, **kwargs):
+    # Looked up at call time so --stub can swap app_sql.execute_query for the in-memory table
+    return app_sql.execute_query(*args, **kwargs)
+
+
+def create_content():
+    content_id = f"schedtest-{uuid.uuid4().hex[:26]}"
+    execute_query("""
+        INSERT INTO scheduled_content (id, type, title, text, scheduled_time, employees)
+        VALUES (%s, 'text', 'scheduler load test', '', UTC_TIMESTAMP(), '[]')
+    """, (content_id,), commit=True)
+    return content_id
+
+
+def cleanup(content_id):
+    execute_query("DELETE FROM notification_jobs WHERE content_id = %s", (content_id,), commit=True)
+    execute_query("DELETE FROM scheduled_content WHERE id = %s", (content_id,), commit=True)
+
+
+def run(jobs, spread, workers, lead, use_stub=False):
+    stub = InMemoryJobs() if use_stub else None
+    if stub:
+        app_sql.execute_query = stub.execute_query
+    content_id = create_content()
+    fired = []
+    fired_lock = threading.Lock()
+
+    def make_handler(worker):
+        def handler(_content_id):
+            with fired_lock:
+                fired.append((worker, time.time()))
+            return True
+        return handler
+
+    schedulers = [NotificationScheduler(handler=make_handler(i), poll_interval=2) for i in range(workers)]
+    try:
+        threads_before = threading.active_count()
+        start = datetime.now(timezone.utc) + timedelta(seconds=lead)
+        due_times = [start + timedelta(seconds=spread * i / jobs) for i in range(jobs)]
+
+        t0 = time.monotonic()
+        job_ids = schedulers[0].schedule_many([(content_id, due) for due in due_times])
+        print(f"scheduled {len(job_ids)} jobs in {time.monotonic() - t0:.2f}s")
+        for scheduler in schedulers:
+            scheduler.start()
+        scheduler_threads = sum(1 for t in threading.enumerate() if t.name == SCHEDULER_THREAD_NAME)
+
+        peak_threads = threading.active_count()
+        deadline = time.monotonic() + lead + spread + 30
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            peak_threads = max(peak_threads, threading.active_count())
+            with fired_lock:
+                done = len(fired)
+            if done >= jobs:
+                break
+
+        for scheduler in schedulers:
+            scheduler.stop()
+
+        rows = execute_query(
+            "SELECT status, COUNT(*) AS count FROM notification_jobs WHERE content_id = %s GROUP BY status",
+            (content_id,), fetch=True
+        ).get("data", [])
+        statuses = {row['status']: row['count'] for row in rows}
+
+        # Lateness: pair the sorted due times with the sorted fire times (jobs fire in due order)
+        fire_times = sorted(t for _, t in fired)
+        lateness = sorted(max(0.0, fired_at - due.timestamp()) for fired_at, due in zip(fire_times, due_times))
+        per_worker = Counter(worker for worker, _ in fired)
+
+        print(f"threads: before={threads_before} peak={peak_threads} "
+              f"(expected about +{workers} scheduler threads, independent of job count)")
+        print(f"fired={len(fired)}/{jobs} per worker={dict(per_worker)} db statuses={statuses}")
+        if lateness:
+            print(f"lateness p50={lateness[len(lateness) // 2] * 1000:.1f}ms "
+                  f"p99={lateness[int(len(lateness) * 0.99) - 1] * 1000:.1f}ms max={lateness[-1] * 1000:.1f}ms")
+
+        ok = True
+        if scheduler_threads != workers:
+            print(f"FAIL: expected one scheduler thread per worker, found {scheduler_threads} for {workers}")
+            ok = False
+        if stub and (len(stub.finished) != jobs or any(count != 1 for count in stub.finished.values())):
+            print("FAIL: not every job was finished exactly once")
+            ok = False
+        if len(fired) != jobs:
+            print("FAIL: number of fires does not match number of jobs (missed or double-fired)")
+            ok = False
+        if statuses.get('done', 0) != jobs:
+            print("FAIL: not every job row ended as done")
+            ok = False
+        if peak_threads - threads_before > workers + 2:
+            print("FAIL: thread count grew with scheduled jobs")
+            ok = False
+        print("PASS" if ok else "FAILED")
+        return ok
+    finally:
+        for scheduler in schedulers:
+            scheduler.stop()
+        cleanup(content_id)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Schedule many notifications and check firing")
+    arg_parser.add_argument("--jobs", type=int, default=10000)
+    arg_parser.add_argument("--spread", type=float, default=60, help="seconds over which jobs come due")
+    arg_parser.add_argument("--workers", type=int, default=3, help="scheduler instances competing for jobs")
+    arg_parser.add_argument("--lead", type=float, default=5, help="seconds before the first job is due")
+    arg_parser.add_argument("--stub", action="store_true", help="use an in-memory notification_jobs table")
+    args = arg_parser.parse_args()
+    sys.exit(0 if run(args.jobs, args.spread, args.workers, args.lead, args.stub) else 1)
@@ -0,0 +1,139 @@
+"""
+Load test for the /events/<employee_id> SSE stream.
+
+Opens N concurrent idle streams (default 2000) against a running app_sql.py and keeps them
+open for a while, counting keep-alives and events per stream. Employee ids are read from the
+database (reused round-robin if there are fewer employees than streams).
+
+    python scratch/sse_load_test.py --streams 2000 --duration 120 --server http://127.0.0.1:5000
+
+Notes:
+- The Werkzeug dev server uses one thread per connection, so 2000 streams means ~2000 threads
+  on the server side. Raise `ulimit -n` on both ends before running.
+- While the test runs, send a message from the dashboard to a few of the employees and watch
+  the "events" column and the reported delivery latency.
+"""
+import argparse
+import asyncio
+import os
+import time
+import urllib.parse
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "hr_notification")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+
+
+def load_employee_ids(limit):
+    conn = mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DATABASE,
+        port=MYSQL_PORT
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM employees LIMIT %s", (limit,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+class StreamStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.dropped = 0
+        self.keepalives = 0
+        self.events = 0
+        self.connect_times = []
+
+
+async def open_stream(server, employee_id, stats, stop_at):
+    url = urllib.parse.urlparse(server)
+    start = time.monotonic()
+    try:
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        writer.write((
+            f"GET /events/{employee_id} HTTP/1.1\r\n"
+            f"Host: {url.netloc}\r\n"
+            "Accept: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout=30)
+        if b" 200 " not in status_line:
+            stats.failed += 1
+            writer.close()
+            return
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        stats.connected += 1
+        stats.connect_times.append(time.monotonic() - start)
+    except (OSError, asyncio.TimeoutError):
+        stats.failed += 1
+        return
+
+    try:
+        while time.monotonic() < stop_at:
+            line = await asyncio.wait_for(reader.readline(), timeout=max(1, stop_at - time.monotonic()))
+            if not line:
+                stats.dropped += 1
+                break
+            if line.startswith(b": keep-alive"):
+                stats.keepalives += 1
+            elif line.startswith(b"event:"):
+                stats.events += 1
+    except asyncio.TimeoutError:
+        pass
+    except OSError:
+        stats.dropped += 1
+    finally:
+        writer.close()
+
+
+async def report(stats, stop_at):
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(5)
+        print(f"connected={stats.connected} failed={stats.failed} dropped={stats.dropped} "
+              f"keepalives={stats.keepalives} events={stats.events}")
+
+
+async def run(server, employee_ids, streams, duration, ramp):
+    stats = StreamStats()
+    stop_at = time.monotonic() + duration
+    tasks = [asyncio.create_task(report(stats, stop_at))]
+    for i in range(streams):
+        tasks.append(asyncio.create_task(open_stream(server, employee_ids[i % len(employee_ids)], stats, stop_at)))
+        if ramp:
+            await asyncio.sleep(ramp)
+    await asyncio.gather(*tasks)
+
+    times = sorted(stats.connect_times)
+    if times:
+        print(f"connect time p50={times[len(times) // 2]:.3f}s p99={times[int(len(times) * 0.99) - 1]:.3f}s max={times[-1]:.3f}s")
+    print(f"final: connected={stats.connected}/{streams} failed={stats.failed} dropped={stats.dropped} "
+          f"keepalives={stats.keepalives} events={stats.events}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Hold many idle SSE streams open against /events")
+    arg_parser.add_argument("--server", default="http://127.0.0.1:5000")
+    arg_parser.add_argument("--streams", type=int, default=2000)
+    arg_parser.add_argument("--duration", type=int, default=120, help="seconds to keep the streams open")
+    arg_parser.add_argument("--ramp", type=float, default=0.005, help="delay between opening streams")
+    args = arg_parser.parse_args()
+
+    ids = load_employee_ids(args.streams)
+    if not ids:
+        print("No employees found in the database")
+    else:
+        asyncio.run(run(args.server, ids, args.streams, args.duration, args.ramp))
@@ -64,6 +64,170 @@ def sync_db():
             print("Adding unique constraint unique_reaction to reactions...")
             cursor.execute("ALTER TABLE reactions ADD UNIQUE KEY unique_reaction (content_id, employee_id)")
 
+        # 7. Reactions index used by /content?since= to find recently changed reactions
+        cursor.execute("SHOW INDEX FROM reactions WHERE Key_name = 'idx_time_content'")
+        if not cursor.fetchall():
+            print("Adding index idx_time_content to reactions...")
+            cursor.execute("CREATE INDEX idx_time_content ON reactions(timestamp, content_id)")
+
+        # 8. Covering indexes behind the /content and /views ETag tokens
+        cursor.execute("SHOW INDEX FROM reactions WHERE Key_name = 'idx_content_time'")
+        if not cursor.fetchall():
+            print("Adding index idx_content_time to reactions...")
+            cursor.execute("CREATE INDEX idx_content_time ON reactions(content_id, timestamp, reaction)")
+        cursor.execute("SHOW INDEX FROM views WHERE Key_name = 'idx_employee_time'")
+        if not cursor.fetchall():
+            print("Adding index idx_employee_time to views...")
+            cursor.execute("CREATE INDEX idx_employee_time ON views(employee_id, timestamp, viewed_duration)")
+
+        # 9. Covering index behind the cached update-status summary (latest row per employee)
+        cursor.execute("SHOW INDEX FROM device_update_status WHERE Key_name = 'idx_employee_attempt'")
+        if not cursor.fetchall():
+            print("Adding index idx_employee_attempt to device_update_status...")
+            cursor.execute("CREATE INDEX idx_employee_attempt ON device_update_status(employee_id, last_attempted_at, status, version)")
+
+        # 10. Indexes behind the /update_status/devices explorer: (filter, last_attempted_at) + the implicit PK id
+        cursor.execute("SHOW INDEX FROM device_update_status")
+        indexes = [idx[2] for idx in cursor.fetchall()]
+        for name, cols in (("idx_attempt", "(last_attempted_at)"),
+                           ("idx_status_attempt", "(status, last_attempted_at)"),
+                           ("idx_version_attempt", "(version, last_attempted_at)")):
+            if name not in indexes:
+                print(f"Adding index {name} to device_update_status...")
+                cursor.execute(f"CREATE INDEX {name} ON device_update_status{cols}")
+
+        # 11. Persistent notification schedule (replaces in-process threading.Timer per message)
+        cursor.execute("SHOW TABLES LIKE 'notification_jobs'")
+        if not cursor.fetchall():
+            print("Creating table notification_jobs...")
+            cursor.execute("""
+                CREATE TABLE notification_jobs (
+                    id VARCHAR(36) PRIMARY KEY,
+                    content_id VARCHAR(36) NOT NULL,
+                    kind VARCHAR(20) NOT NULL DEFAULT 'notification',
+                    due_at DATETIME NOT NULL,
+                    status ENUM('pending','claimed','done','failed','missed') NOT NULL DEFAULT 'pending',
+                    claimed_by VARCHAR(64) NULL,
+                    claimed_at DATETIME NULL,
+                    attempts INT NOT NULL DEFAULT 0,
+                    fired_at DATETIME NULL,
+                    last_error TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (content_id) REFERENCES scheduled_content(id) ON DELETE CASCADE,
+                    INDEX idx_status_due (status, due_at),
+                    INDEX idx_claimed_by (claimed_by)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+
+        # 12. Delivery planner: content_recipients.display_at + its per-employee due-queue index
+        cursor.execute("DESCRIBE content_recipients")
+        cols = [col[0] for col in cursor.fetchall()]
+        if 'display_at' not in cols:
+            print("Adding column display_at to content_recipients...")
+            cursor.execute("ALTER TABLE content_recipients ADD COLUMN display_at DATETIME NULL AFTER scheduled_time")
+            cursor.execute("""
+                UPDATE content_recipients cr
+                LEFT JOIN message_preferences mp ON mp.content_id = cr.content_id AND mp.employee_id = cr.employee_id
+                SET cr.display_at = GREATEST(cr.scheduled_time, COALESCE(mp.display_time, cr.scheduled_time))
+            """)
+            cursor.execute("ALTER TABLE content_recipients MODIFY display_at DATETIME NOT NULL")
+        cursor.execute("SHOW INDEX FROM content_recipients WHERE Key_name = 'idx_employee_display'")
+        if not cursor.fetchall():
+            print("Adding index idx_employee_display to content_recipients...")
+            cursor.execute("CREATE INDEX idx_employee_display ON content_recipients(employee_id, display_at)")
+
+        # 13. Image derivatives (display/thumb/webp URLs and dimensions) recorded per content
+        cursor.execute("DESCRIBE scheduled_content")
+        cols = [col[0] for col in cursor.fetchall()]
+        if 'image_variants' not in cols:
+            print("Adding column image_variants to scheduled_content...")
+            cursor.execute("ALTER TABLE scheduled_content ADD COLUMN image_variants JSON NULL AFTER image_url")
+
+        # 14. Content-addressed media store (reference counts per stored object)
+        cursor.execute("SHOW TABLES LIKE 'media_objects'")
+        if not cursor.fetchall():
+            print("Creating table media_objects...")
+            cursor.execute("""
+                CREATE TABLE media_objects (
+                    sha256 CHAR(64) PRIMARY KEY,
+                    kind ENUM('video','image') NOT NULL,
+                    ext VARCHAR(10) NOT NULL,
+                    size_bytes BIGINT NOT NULL,
+                    mime_type VARCHAR(100) NULL,
+                    width INT NULL,
+                    height INT NULL,
+                    duration_ms INT NULL,
+                    ref_count INT NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    last_acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+
+        # 15. Chunked, resumable media upload sessions
+        cursor.execute("SHOW TABLES LIKE 'media_uploads'")
+        if not cursor.fetchall():
+            print("Creating table media_uploads...")
+            cursor.execute("""
+                CREATE TABLE media_uploads (
+                    id VARCHAR(36) PRIMARY KEY,
+                    kind ENUM('video','image') NOT NULL,
+                    ext VARCHAR(10) NOT NULL,
+                    filename VARCHAR(255),
+                    total_bytes BIGINT NOT NULL,
+                    chunk_bytes INT NOT NULL,
+                    received_bytes BIGINT NOT NULL DEFAULT 0,
+                    status ENUM('open','finalized','attached','aborted') NOT NULL DEFAULT 'open',
+                    sha256 CHAR(64) NULL,
+                    created_by VARCHAR(255),
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX idx_status_updated (status, updated_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+
+        # 16. Media metadata (MIME type, dimensions, MP4 duration) returned by /content
+        cursor.execute("DESCRIBE media_objects")
+        cols = [col[0] for col in cursor.fetchall()]
+        for name, ddl in (('mime_type', 'VARCHAR(100) NULL AFTER size_bytes'), ('width', 'INT NULL AFTER mime_type'),
+                          ('height', 'INT NULL AFTER width'), ('duration_ms', 'INT NULL AFTER height')):
+            if name not in cols:
+                print(f"Adding column {name} to media_objects...")
+                cursor.execute(f"ALTER TABLE media_objects ADD COLUMN {name} {ddl}")
+
+        # 17. Update rollout: ramp settings per version and the cohort of each device
+        cursor.execute("DESCRIBE version_history")
+        cols = [col[0] for col in cursor.fetchall()]
+        for name, ddl in (('rollout_percents', 'VARCHAR(100) NULL AFTER uploaded_by'),
+                          ('rollout_interval_minutes', 'INT NULL AFTER rollout_percents'),
+                          ('rollout_started_at', 'DATETIME NULL AFTER rollout_interval_minutes')):
+            if name not in cols:
+                print(f"Adding column {name} to version_history...")
+                cursor.execute(f"ALTER TABLE version_history ADD COLUMN {name} {ddl}")
+        cursor.execute("DESCRIBE device_update_status")
+        if 'cohort' not in [col[0] for col in cursor.fetchall()]:
+            print("Adding column cohort to device_update_status...")
+            cursor.execute("ALTER TABLE device_update_status ADD COLUMN cohort TINYINT UNSIGNED NULL AFTER device_id")
+        # Same value as update_cohort(): first 4 bytes of SHA-256(device_id) mod 100
+        cursor.execute("""
+            UPDATE device_update_status
+            SET cohort = CONV(LEFT(SHA2(device_id, 256), 8), 16, 10) % 100
+            WHERE cohort IS NULL
+        """)
+
+        # 18. When image variants were recorded, so /content can re-send items whose image changed
+        cursor.execute("DESCRIBE scheduled_content")
+        if 'image_variants_at' not in [col[0] for col in cursor.fetchall()]:
+            print("Adding column image_variants_at to scheduled_content...")
+            cursor.execute("ALTER TABLE scheduled_content ADD COLUMN image_variants_at DATETIME NULL AFTER image_variants")
+            cursor.execute("CREATE INDEX idx_variants_at ON scheduled_content(image_variants_at)")
+
+        # 19. Last time a reference was taken on each media object (grace window for rebuild_media_refs.py)
+        cursor.execute("DESCRIBE media_objects")
+        if 'last_acquired_at' not in [col[0] for col in cursor.fetchall()]:
+            print("Adding column last_acquired_at to media_objects...")
+            cursor.execute("ALTER TABLE media_objects ADD COLUMN last_acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP AFTER created_at")
+            cursor.execute("UPDATE media_objects SET last_acquired_at = created_at")
+
         conn.commit()
         print("Database synchronization complete.")
         conn.close()